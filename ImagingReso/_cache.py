@@ -0,0 +1,181 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+default_max_bytes = 512 * 1024 ** 2
+
+
+class ArrayCache(object):
+    """thread-safe least-recently-used cache of numpy arrays bounded by a byte budget
+
+    Values are dictionaries of numpy arrays. Arrays are flagged read-only when stored so they can be
+    shared between callers without copy. Pinned values (ex: views of shared memory) are never evicted
+    and do not count in the byte budget.
+    """
+
+    def __init__(self, max_bytes=default_max_bytes):
+        """
+        :param max_bytes: maximum number of bytes held by the cache (0 disables caching)
+        :type max_bytes: int
+        """
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+        self._pinned = {}
+        self._nbytes = 0
+        self.max_bytes = int(max_bytes)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _size_of(value: dict):
+        return sum(_array.nbytes for _array in value.values())
+
+    def get(self, key):
+        """return the cached value of key (and mark it as most recently used) or None"""
+        with self._lock:
+            value = self._pinned.get(key)
+            if value is not None:
+                self.hits += 1
+                return value
+            value = self._items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value: dict):
+        """store value under key, evicting the least recently used entries to stay within max_bytes
+
+        :return: the stored value, with its arrays flagged read-only
+        :rtype: dict
+        """
+        for _array in value.values():
+            if isinstance(_array, np.ndarray):
+                _array.flags.writeable = False
+        _size = self._size_of(value)
+        with self._lock:
+            if key in self._items:
+                self._nbytes -= self._size_of(self._items.pop(key))
+            if _size > self.max_bytes:
+                return value
+            self._items[key] = value
+            self._nbytes += _size
+            self._evict()
+        return value
+
+    def pin(self, key, value: dict):
+        """store value under key outside of the byte budget, it is kept until unpin or clear
+
+        :return: the stored value, with its arrays flagged read-only
+        :rtype: dict
+        """
+        for _array in value.values():
+            if isinstance(_array, np.ndarray):
+                _array.flags.writeable = False
+        with self._lock:
+            if key in self._items:
+                self._nbytes -= self._size_of(self._items.pop(key))
+            self._pinned[key] = value
+        return value
+
+    def unpin(self, key):
+        """remove the pinned value of key, if any"""
+        with self._lock:
+            self._pinned.pop(key, None)
+
+    def _evict(self):
+        while self._nbytes > self.max_bytes and self._items:
+            _key, _value = self._items.popitem(last=False)
+            self._nbytes -= self._size_of(_value)
+            self.evictions += 1
+
+    def set_max_bytes(self, max_bytes):
+        """change the byte budget of the cache, evicting entries if needed"""
+        with self._lock:
+            self.max_bytes = int(max_bytes)
+            self._evict()
+
+    def clear(self):
+        """remove every entry (pinned entries included) and reset the counters"""
+        with self._lock:
+            self._items.clear()
+            self._pinned.clear()
+            self._nbytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self):
+        """return the usage of the cache
+
+        :return: {'entries', 'nbytes', 'max_bytes', 'hits', 'misses', 'evictions'}
+        :rtype: dict
+        """
+        with self._lock:
+            return {'entries': len(self._items),
+                    'nbytes': self._nbytes,
+                    'max_bytes': self.max_bytes,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions}
+
+
+# raw E_eV/Sig_b arrays of the database files, keyed by (database, file name, file mtime)
+raw_sigma_cache = ArrayCache()
+
+# energy_eV/sigma_b arrays interpolated on a grid, keyed by (database, file name, file mtime, grid signature)
+interpolated_sigma_cache = ArrayCache()
+
+# indices and weights of the linear interpolation from a database energy axis to an energy grid
+interpolation_index_cache = ArrayCache(max_bytes=default_max_bytes // 4)
+
+# Fourier transforms of the instrument resolution kernels, keyed by the instrument parameters and transform length
+resolution_kernel_cache = ArrayCache(max_bytes=default_max_bytes // 16)
+
+
+def clear():
+    """empty the process-wide cross-section caches"""
+    raw_sigma_cache.clear()
+    interpolated_sigma_cache.clear()
+    interpolation_index_cache.clear()
+    resolution_kernel_cache.clear()
+
+
+def stats():
+    """return the usage of the process-wide cross-section caches
+
+    :return: {'raw': {...}, 'interpolated': {...}, 'interpolation_index': {...}, 'resolution_kernel': {...}},
+             each level reporting
+             {'entries', 'nbytes', 'max_bytes', 'hits', 'misses', 'evictions'}
+    :rtype: dict
+    """
+    return {'raw': raw_sigma_cache.stats(),
+            'interpolated': interpolated_sigma_cache.stats(),
+            'interpolation_index': interpolation_index_cache.stats(),
+            'resolution_kernel': resolution_kernel_cache.stats()}
+
+
+def set_max_bytes(raw=None, interpolated=None, interpolation_index=None, resolution_kernel=None):
+    """set the byte budget of the process-wide cross-section caches
+
+    :param raw: maximum bytes of raw database arrays to keep in memory
+    :type raw: int
+    :param interpolated: maximum bytes of interpolated arrays to keep in memory
+    :type interpolated: int
+    :param interpolation_index: maximum bytes of interpolation indices and weights to keep in memory
+    :type interpolation_index: int
+    :param resolution_kernel: maximum bytes of Fourier transforms of resolution kernels to keep in memory
+    :type resolution_kernel: int
+    """
+    if raw is not None:
+        raw_sigma_cache.set_max_bytes(raw)
+    if interpolated is not None:
+        interpolated_sigma_cache.set_max_bytes(interpolated)
+    if interpolation_index is not None:
+        interpolation_index_cache.set_max_bytes(interpolation_index)
+    if resolution_kernel is not None:
+        resolution_kernel_cache.set_max_bytes(resolution_kernel)
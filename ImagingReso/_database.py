@@ -0,0 +1,304 @@
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+store_data_name = '_sigma_store.bin'
+store_index_name = '_sigma_store_index.json'
+store_dtype = np.dtype('<f8')
+metadata_name = '_isotope_metadata.json'
+
+# folder of the packaged databases, the only folders binary stores are built and loaded for
+reference_data_folder = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'reference_data')
+
+_loaded_stores = {}
+_manifests = {}
+_metadata_tables = {}
+
+
+def get_database_folder(database='ENDF_VII'):
+    """return the absolute path of the folder holding the given database
+
+    :param database: name of the database folder, ex: 'ENDF_VII'
+    :type database: str
+
+    :return: path/to/reference_data/database
+    :rtype: str
+    """
+    return os.path.join(reference_data_folder, database)
+
+
+def is_database_folder(folder):
+    """return True if folder is one of the packaged database folders (reference_data/<database>)"""
+    return os.path.dirname(os.path.abspath(folder)) == os.path.abspath(reference_data_folder)
+
+
+def _list_csv_files(database_folder):
+    """return the sorted list of isotope '.csv' files of a database folder (files starting with '_' are skipped)"""
+    _list_files = []
+    for _name in sorted(os.listdir(database_folder)):
+        if _name.startswith('_') or os.path.splitext(_name)[1] != '.csv':
+            continue
+        _list_files.append(_name)
+    return _list_files
+
+
+def _get_tmp_suffix():
+    """return a suffix for temporary files unique to the process and thread writing them"""
+    return '.{}.{}.tmp'.format(os.getpid(), threading.get_ident())
+
+
+def _get_element_of_file(file_name):
+    """return the element of an isotope file name ('Cd-115_m1.csv' -> 'Cd'), None if the name has no '-'"""
+    _name = os.path.splitext(file_name)[0]
+    if '-' not in _name:
+        return None
+    return _name.split('-')[0]
+
+
+def build_sigma_store(database_folder):
+    """convert every isotope '.csv' file of a database folder into one binary store
+
+    The store is made of two files saved inside the database folder:
+      '_sigma_store.bin': little-endian float64 blocks, one per isotope, laid out as
+                          [E_eV(0) ... E_eV(n-1), Sig_b(0) ... Sig_b(n-1)]
+      '_sigma_store_index.json': manifest of the database
+                                 {'elements': {element: [file_name, ...]},
+                                  'files': {file_name: {'offset': int, 'length': int, 'mtime_ns': int, 'size': int}},
+                                  'signature': sha1 of the file names}
+                                 where file names are sorted, offset and length are counted in float64 items
+
+    :param database_folder: path/to/database folder
+    :type database_folder: str
+
+    :return: manifest (index) of the store
+    :rtype: dict
+    """
+    _data_path = os.path.join(database_folder, store_data_name)
+    _index_path = os.path.join(database_folder, store_index_name)
+    _tmp_suffix = _get_tmp_suffix()
+
+    _list_files = _list_csv_files(database_folder)
+    index = {'elements': {},
+             'files': {},
+             'signature': hashlib.sha1('\n'.join(_list_files).encode()).hexdigest()}
+    _offset = 0
+    import pandas as pd
+    try:
+        with open(_data_path + _tmp_suffix, 'wb') as fh:
+            for _name in _list_files:
+                _csv_path = os.path.join(database_folder, _name)
+                _stat = os.stat(_csv_path)
+                _df = pd.read_csv(_csv_path, header=0)
+                _block = np.empty((2, len(_df)), dtype=store_dtype)
+                _block[0] = _df['E_eV'].to_numpy(dtype=np.float64)
+                _block[1] = _df['Sig_b'].to_numpy(dtype=np.float64)
+                fh.write(_block.tobytes())
+                index['files'][_name] = {'offset': _offset,
+                                         'length': len(_df),
+                                         'mtime_ns': _stat.st_mtime_ns,
+                                         'size': _stat.st_size}
+                _element = _get_element_of_file(_name)
+                if _element is not None:
+                    index['elements'].setdefault(_element, []).append(_name)
+                _offset += _block.size
+        with open(_index_path + _tmp_suffix, 'w') as fh:
+            json.dump(index, fh)
+
+        # data file is replaced first so that an index is never paired with a shorter data file
+        os.replace(_data_path + _tmp_suffix, _data_path)
+        os.replace(_index_path + _tmp_suffix, _index_path)
+    finally:
+        for _tmp_path in [_data_path + _tmp_suffix, _index_path + _tmp_suffix]:
+            try:
+                os.remove(_tmp_path)
+            except OSError:
+                pass
+    _loaded_stores.pop(os.path.abspath(database_folder), None)
+    _manifests.pop(os.path.abspath(database_folder), None)
+    return index
+
+
+def load_sigma_store(database_folder, build=True):
+    """return the memory-mapped data and the index of the binary store of a database folder
+
+    Stores are only used for the packaged database folders (see is_database_folder), files of any other
+    folder are read from their '.csv' file.
+
+    :param database_folder: path/to/database folder
+    :type database_folder: str
+    :param build: build the store if it does not exist yet
+    :type build: bool
+
+    :return: (np.memmap of float64, index dictionary) or None if the store is not available
+    :rtype: tuple
+    """
+    database_folder = os.path.abspath(database_folder)
+    if not is_database_folder(database_folder):
+        return None
+    _data_path = os.path.join(database_folder, store_data_name)
+    _index_path = os.path.join(database_folder, store_index_name)
+
+    try:
+        _mtime_ns = os.stat(_index_path).st_mtime_ns
+    except OSError:
+        if not build:
+            return None
+        try:
+            build_sigma_store(database_folder)
+            _mtime_ns = os.stat(_index_path).st_mtime_ns
+        except (OSError, KeyError, ValueError):
+            # read-only installation or unreadable file, the '.csv' files are used directly
+            return None
+
+    _loaded = _loaded_stores.get(database_folder)
+    if _loaded is not None and _loaded[0] == _mtime_ns:
+        return _loaded[1], _loaded[2]
+
+    with open(_index_path, 'r') as fh:
+        index = json.load(fh)
+    if 'signature' not in index:
+        # store built by a previous version, without the element manifest
+        if not build:
+            return None
+        try:
+            index = build_sigma_store(database_folder)
+            _mtime_ns = os.stat(_index_path).st_mtime_ns
+        except (OSError, KeyError, ValueError):
+            return None
+    if os.path.getsize(_data_path) == 0:
+        data = np.empty(0, dtype=store_dtype)
+    else:
+        data = np.asarray(np.memmap(_data_path, dtype=store_dtype, mode='r'))
+    _loaded_stores[database_folder] = (_mtime_ns, data, index)
+    return data, index
+
+
+def get_stored_sigma(file_name):
+    """return the raw energy (eV) and sigma (barn) arrays of an isotope file from the binary store
+
+    The arrays are read-only views into the memory-mapped store, no text parsing is involved.
+    The store is rebuilt when the file has been modified (or only touched) since the store was built.
+    None is returned when the file is not part of the store or the store can not be rebuilt.
+
+    :param file_name: path/to/isotope file ('.csv')
+    :type file_name: str
+
+    :return: (energy_eV, sigma_b) or None
+    :rtype: tuple
+    """
+    _folder, _name = os.path.split(os.path.abspath(file_name))
+    _store = load_sigma_store(_folder)
+    if _store is None:
+        return None
+    data, index = _store
+    _entry = index['files'].get(_name)
+    if _entry is None:
+        return None
+    _stat = os.stat(file_name)
+    if _stat.st_mtime_ns != _entry['mtime_ns'] or _stat.st_size != _entry['size']:
+        # edited, touched or checked out again since the store was built
+        try:
+            build_sigma_store(_folder)
+        except (OSError, KeyError, ValueError):
+            return None
+        _store = load_sigma_store(_folder, build=False)
+        if _store is None:
+            return None
+        data, index = _store
+        _entry = index['files'].get(_name)
+        if _entry is None or _stat.st_mtime_ns != _entry['mtime_ns'] or _stat.st_size != _entry['size']:
+            return None
+
+    _start = _entry['offset']
+    _length = _entry['length']
+    energy = data[_start:_start + _length]
+    sigma = data[_start + _length:_start + 2 * _length]
+    return energy, sigma
+
+
+def get_loaded_manifest(database_folder):
+    """return the manifest of a database folder if already loaded in memory (no file system access), else None"""
+    return _manifests.get(os.path.abspath(database_folder))
+
+
+def get_manifest(database_folder):
+    """return the manifest of a database folder, read once per process and then served from memory
+
+    The manifest is the index of the binary store (see build_sigma_store). The first time a folder is used,
+    its list of '.csv' files is compared with the manifest and the store is rebuilt if files were added or removed.
+
+    :param database_folder: path/to/database folder
+    :type database_folder: str
+
+    :return: {'elements': {element: [file_name, ...]}, 'files': {file_name: {...}}} or None if the store
+             is not available
+    :rtype: dict
+    """
+    database_folder = os.path.abspath(database_folder)
+    manifest = _manifests.get(database_folder)
+    if manifest is not None:
+        return manifest
+
+    _store = load_sigma_store(database_folder)
+    if _store is None:
+        return None
+    manifest = _store[1]
+    if sorted(manifest['files'].keys()) != _list_csv_files(database_folder):
+        try:
+            manifest = build_sigma_store(database_folder)
+        except (OSError, KeyError, ValueError):
+            return None
+    _manifests[database_folder] = manifest
+    return manifest
+
+
+def load_metadata_table(database_folder, version):
+    """return the isotope metadata table saved in a database folder, read once per process
+
+    :param database_folder: path/to/database folder
+    :type database_folder: str
+    :param version: version the table must have been saved with
+    :type version: str
+
+    :return: the table or None if it does not exist or has another version
+    :rtype: dict
+    """
+    database_folder = os.path.abspath(database_folder)
+    table = _metadata_tables.get(database_folder)
+    if table is None:
+        try:
+            with open(os.path.join(database_folder, metadata_name), 'r') as fh:
+                table = json.load(fh)
+        except (OSError, ValueError):
+            return None
+        _metadata_tables[database_folder] = table
+    if table.get('version') != version:
+        return None
+    return table
+
+
+def save_metadata_table(database_folder, table: dict):
+    """save the isotope metadata table of a database folder (kept in memory only if the folder is read-only)
+
+    :param database_folder: path/to/database folder
+    :type database_folder: str
+    :param table: metadata table with a 'version' key
+    :type table: dict
+
+    :return: the table
+    :rtype: dict
+    """
+    database_folder = os.path.abspath(database_folder)
+    _metadata_tables[database_folder] = table
+    _path = os.path.join(database_folder, metadata_name)
+    _tmp_path = _path + _get_tmp_suffix()
+    try:
+        with open(_tmp_path, 'w') as fh:
+            json.dump(table, fh)
+        os.replace(_tmp_path, _path)
+    except OSError:
+        pass
+    return table
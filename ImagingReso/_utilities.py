@@ -1,23 +1,33 @@
+import contextlib
 import glob
+import hashlib
+import io
 import numbers
 import os
 import re
 import zipfile
+from collections.abc import MutableMapping
 
 import numpy as np
-import pandas as pd
 import periodictable as pt
-from scipy.constants import Avogadro
-from scipy.interpolate import interp1d
 
 from six.moves import input
 from six.moves.urllib.request import urlopen
 import sys
 
+from ImagingReso import _cache
+from ImagingReso import _database
+
 x_type_list = ['energy', 'lambda', 'time', 'number']
 y_type_list = ['transmission', 'attenuation', 'sigma', 'sigma_raw', 'mu_per_cm']
 time_unit_list = ['s', 'us', 'ns']
+energy_scale_list = ['linear', 'log']
 export_type_list = ['df', 'csv', 'clip']
+metadata_table_version = 2  # format of the isotope metadata tables saved with the databases
+Avogadro = 6.02214076e+23  # mol-1, exact since the 2019 SI redefinition (same value as scipy.constants.Avogadro)
+Boltzmann_eV = 8.617333262e-05  # eV/K, exact since the 2019 SI redefinition
+neutron_mass_amu = 1.00866491595  # CODATA 2018
+database_temperature_k = 294.  # temperature of the cross-sections of the databases
 h_bond_list = ['H2', 'C4H10', 'C16H34', 'C4H6', 'CH4', 'C2H6', 'C3H8', 'C2H4', 'ZrH']
 h_dict = {
     'H2': 'Hydrogen gas',
@@ -117,6 +127,11 @@ def get_list_element_from_database(database='ENDF_VII'):
     _ref_data_folder = os.path.join(_file_path, 'reference_data')
     _database_folder = os.path.join(_ref_data_folder, database)
 
+    # manifest already loaded, no access to the file system
+    _manifest = _database.get_loaded_manifest(database_folder=_database_folder)
+    if _manifest is not None:
+        return sorted(_manifest['elements'].keys())
+
     if not os.path.exists(_ref_data_folder):
         os.makedirs(_ref_data_folder)
         print("Folder to store database files has been created: '{}'".format(_ref_data_folder))
@@ -126,6 +141,10 @@ def get_list_element_from_database(database='ENDF_VII'):
         print("I will retrieve and store a local copy of database'{}': ".format(database))
         download_from_github(fname=database + '.zip', path=_ref_data_folder)
 
+    _manifest = _database.get_manifest(database_folder=_database_folder)
+    if _manifest is not None and _manifest['elements']:
+        return sorted(_manifest['elements'].keys())
+
     # if '/_elements_list.csv' NOT exist
     if not os.path.exists(_database_folder + '/_elements_list.csv'):
         # glob all .csv files
@@ -154,6 +173,7 @@ def get_list_element_from_database(database='ENDF_VII'):
                 if len(each_letter_part) <= 2:
                     _list_element.append(each_letter_part)
         # save to current dir
+        import pandas as pd
         _list_element.sort()
         df_to_save = pd.DataFrame()
         df_to_save['elements'] = _list_element
@@ -163,6 +183,7 @@ def get_list_element_from_database(database='ENDF_VII'):
 
     # '/_elements_list.csv' exist
     else:
+        import pandas as pd
         df_to_read = pd.read_csv(_database_folder + '/_elements_list.csv')
         _list_element = list(df_to_read['elements'])
         # print("FOUND '{}'".format(_database_folder + '/_elements_list.csv'))
@@ -324,46 +345,67 @@ def get_isotope_dicts(element='', database='ENDF_VII'):
                   'file_names': ['Ag-107.csv','Ag-109.csv']}}
     
     """
-    _file_path = os.path.abspath(os.path.dirname(__file__))
-    _database_folder = os.path.join(_file_path, 'reference_data', database)
-    _element_search_path = os.path.join(_database_folder, element + '-*.csv')
-
-    list_files = glob.glob(_element_search_path)
-    if not list_files:
-        raise ValueError("File names contains NO '-', the name should in the format of 'Cd-115_m1' or 'Cd-114'")
-    list_files.sort()
-    isotope_dict = {'isotopes': {'list': [],
-                                 'file_names': [],
-                                 'density': {'value': np.nan,
+    _metadata = get_isotope_metadata(database=database)
+    if _metadata is not None and element in _metadata['elements']:
+        _element_metadata = _metadata['elements'][element]
+        # notices of periodictable fallbacks, silenced when the table was built for every element
+        for _notice in _element_metadata.get('notices', []):
+            print(_notice)
+    else:
+        _file_path = os.path.abspath(os.path.dirname(__file__))
+        _database_folder = os.path.join(_file_path, 'reference_data', database)
+        list_files = glob.glob(os.path.join(_database_folder, element + '-*.csv'))
+        if not list_files:
+            raise ValueError("File names contains NO '-', the name should in the format of 'Cd-115_m1' or 'Cd-114'")
+        _element_metadata = _get_element_metadata(element=element, list_files=list_files)
+
+    _isotopes = _element_metadata['isotopes']
+    isotope_dict = {'isotopes': {'list': list(_isotopes['list']),
+                                 'file_names': list(_isotopes['file_names']),
+                                 'density': {'value': list(_isotopes['density']),
                                              'units': 'g/cm3'},
-                                 'mass': {'value': [],
+                                 'mass': {'value': list(_isotopes['mass']),
                                           'units': 'g/mol',
                                           },
-                                 'isotopic_ratio': [], },
-                    'density': {'value': np.nan,
+                                 'isotopic_ratio': list(_isotopes['isotopic_ratio']), },
+                    'density': {'value': _element_metadata['density'],
                                 'units': 'g/cm3'},
-                    'molar_mass': {'value': np.nan,
+                    'molar_mass': {'value': _element_metadata['molar_mass'],
                                    'units': 'g/mol'},
                     }
 
-    # isotope_dict_mirror = {}
+    check_iso_ratios(ratios=isotope_dict['isotopes']['isotopic_ratio'], tol=0.005)
+    return isotope_dict
+
+
+def _get_element_metadata(element, list_files: list):
+    """return the mass, abundance, density and meta-state of the isotopes of the files given and the density and
+    molar mass of the element, as found in periodictable
+
+    Returns:
+    ========
+    {'density': float, 'molar_mass': float,
+     'isotopes': {'list': [...], 'file_names': [...], 'mass': [...], 'isotopic_ratio': [...], 'density': [...],
+                  'meta': [...]}}
+    """
     _isotopes_list = []
     _isotopes_list_files = []
     _isotopes_mass = []
     _isotopes_density = []
     _isotopes_atomic_ratio = []
-    _density = np.nan
-    _molar_mass = np.nan
+    _isotopes_meta = []
 
-    for file in list_files:
+    for file in sorted(list_files):
         # Obtain element, z number from the basename
         _basename = os.path.basename(file)
         filename = os.path.splitext(_basename)[0]
+        meta = 0
         if '-' in filename:
             [_name, _number] = filename.split('-')
             if '_' in _number:
-                [aaa, meta] = _number.split('_')
+                [aaa, _meta] = _number.split('_')
                 _number = aaa[:]
+                meta = int(_meta.lstrip('m') or 0)
         else:
             _split_list = re.split(r'(\d+)', filename)
             if len(_split_list) == 2:
@@ -381,19 +423,57 @@ def get_isotope_dicts(element='', database='ENDF_VII'):
         _isotopes_mass.append(get_mass(isotope))
         _isotopes_atomic_ratio.append(get_abundance(isotope))
         _isotopes_density.append(get_density(isotope))
-        _density = get_density(element)
-        _molar_mass = get_mass(element)
-
-    check_iso_ratios(ratios=_isotopes_atomic_ratio, tol=0.005)
-
-    isotope_dict['isotopes']['list'] = _isotopes_list
-    isotope_dict['isotopes']['file_names'] = _isotopes_list_files
-    isotope_dict['isotopes']['mass']['value'] = _isotopes_mass
-    isotope_dict['isotopes']['isotopic_ratio'] = _isotopes_atomic_ratio
-    isotope_dict['isotopes']['density']['value'] = _isotopes_density
-    isotope_dict['density']['value'] = _density
-    isotope_dict['molar_mass']['value'] = _molar_mass
-    return isotope_dict
+        _isotopes_meta.append(meta)
+
+    return {'density': get_density(element),
+            'molar_mass': get_mass(element),
+            'isotopes': {'list': _isotopes_list,
+                         'file_names': _isotopes_list_files,
+                         'mass': _isotopes_mass,
+                         'isotopic_ratio': _isotopes_atomic_ratio,
+                         'density': _isotopes_density,
+                         'meta': _isotopes_meta}}
+
+
+def get_isotope_metadata(database='ENDF_VII'):
+    """return the table of isotope metadata (mass, abundance, density, meta-state) of a database
+
+    The table is built from periodictable the first time a database is used, saved alongside the
+    database files and then read once per process (see ImagingReso._database.load_metadata_table).
+    It is rebuilt if the isotope files of the database or the version of periodictable change.
+
+    Parameters:
+    ===========
+    database: string (default is ENDF_VII)
+
+    Returns:
+    ========
+    {'version': str, 'elements': {element: output of _get_element_metadata with the 'notices' printed
+                                           while looking it up}}
+    or None if the database has no manifest (see ImagingReso._database.get_manifest)
+    """
+    _database_folder = _database.get_database_folder(database)
+    _manifest = _database.get_manifest(database_folder=_database_folder)
+    if _manifest is None:
+        return None
+    _version = '{}:{}:{}'.format(metadata_table_version, pt.__version__, _manifest['signature'])
+    table = _database.load_metadata_table(database_folder=_database_folder, version=_version)
+    if table is not None:
+        return table
+
+    table = {'version': _version, 'elements': {}}
+    for _element, _list_files in _manifest['elements'].items():
+        # notices (literature data used instead of periodictable) are kept for when the element is requested
+        _notices = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(_notices):
+                _element_metadata = _get_element_metadata(element=_element, list_files=_list_files)
+        except (KeyError, TypeError, ValueError):
+            # left out of the table, the metadata of this element are looked up in periodictable when used
+            continue
+        _element_metadata['notices'] = _notices.getvalue().splitlines()
+        table['elements'][_element] = _element_metadata
+    return _database.save_metadata_table(database_folder=_database_folder, table=table)
 
 
 def get_abundance(element):
@@ -493,48 +573,388 @@ def get_database_data(file_name=''):
     """
     if not os.path.exists(file_name):
         raise IOError("File {} does not exist!".format(file_name))
+    import pandas as pd
     df = pd.read_csv(file_name, header=0)
     return df
 
 
-def get_interpolated_data(df: pd.DataFrame, e_min=np.nan, e_max=np.nan, e_step=np.nan):
+def _get_database_file_key(file_name=''):
+    """return the (database, file name, file mtime) key identifying the content of a database file"""
+    try:
+        _mtime_ns = os.stat(file_name).st_mtime_ns
+    except OSError:
+        raise IOError("File {} does not exist!".format(file_name))
+    _folder, _name = os.path.split(os.path.abspath(file_name))
+    return os.path.basename(_folder), _name, _mtime_ns
+
+
+def get_sigma_file(compound='', isotope='', file_name='', database='ENDF_VII'):
+    """return path/to/database file holding the cross-section of the isotope of the layer given
+    ('1-H' of layers with bonded H uses the experimental data of the 'Bonded_H' database)
+
+    Parameters:
+    ===========
+    compound: string. name of the layer
+    isotope: string. name of the isotope, ex: '1-H'
+    file_name: string. name of the database file of the isotope, ex: 'H-1.csv'
+    database: string (default is ENDF_VII)
+    """
+    if compound in h_bond_list and isotope == '1-H':
+        is_element_in_database(element='H', database='Bonded_H')
+        return os.path.join(_database.get_database_folder('Bonded_H'), 'H-{}.csv'.format(compound))
+    return os.path.join(_database.get_database_folder(database), file_name)
+
+
+def get_database_arrays(file_name=''):
+    """return the energy (eV) and Sigma (barn) arrays from the file_name
+
+    The arrays are read from the binary store of the database folder (built on first use) and
+    fall back to parsing the '.csv' file when the store is not available or out of date.
+    Results are kept in the process-wide cache (see ImagingReso._cache) keyed by
+    (database, file name, file modification time) and are read-only.
+
+    Parameters:
+    ===========
+    file_name: string ('' by default) name of csv file
+
+    Returns:
+    ========
+    new dictionary {'E_eV': np.array, 'Sig_b': np.array} of the cached read-only arrays
+
+    Raises:
+    =======
+    IOError if file does not exist
+    """
+    _key = _get_database_file_key(file_name=file_name)
+    _cached = _cache.raw_sigma_cache.get(_key)
+    if _cached is not None:
+        return dict(_cached)
+
+    _stored = _database.get_stored_sigma(file_name=file_name)
+    if _stored is None:
+        df = get_database_data(file_name=file_name)
+        _dict = {'E_eV': df['E_eV'].to_numpy(dtype=np.float64),
+                 'Sig_b': df['Sig_b'].to_numpy(dtype=np.float64)}
+    else:
+        _dict = {'E_eV': _stored[0], 'Sig_b': _stored[1]}
+    return dict(_cache.raw_sigma_cache.put(_key, _dict))
+
+
+def get_energy_grid(e_min=np.nan, e_max=np.nan, e_step=np.nan, scale='linear'):
+    """return the energy axis (eV) covering [e_min, e_max]
+
+    :param e_min: left energy range in eV
+    :type e_min: float
+    :param e_max: right energy range in eV
+    :type e_max: float
+    :param e_step: 'linear' scale -> energy step in eV
+                   'log' scale -> relative energy step (dE/E) between consecutive points
+    :type e_step: float
+    :param scale: spacing of the points. Must be either ['linear'|'log']
+    :type scale: str
+
+    :return: energy axis
+    :rtype: np.array
+    """
+    if scale == 'linear':
+        nbr_point = int((e_max - e_min) / e_step + 1)
+        return np.linspace(e_min, e_max, nbr_point).round(6)
+    elif scale == 'log':
+        nbr_point = int(np.log(e_max / e_min) / np.log1p(e_step) + 1)
+        return np.geomspace(e_min, e_max, nbr_point)
+    else:
+        raise ValueError("Please specify the energy scale using one from '{}'.".format(energy_scale_list))
+
+
+def get_union_energy_grid(file_names: list, e_min=np.nan, e_max=np.nan, max_workers=None):
+    """return the union of the energies found in the database files within [e_min, e_max], both limits included
+
+    :param file_names: list of path/to/database files
+    :type file_names: list
+    :param e_min: left energy range in eV
+    :type e_min: float
+    :param e_max: right energy range in eV
+    :type e_max: float
+    :param max_workers: number of threads loading the files (None or 1: no thread)
+    :type max_workers: int
+
+    :return: sorted energy axis without duplicates
+    :rtype: np.array
+    """
+    _list_energy = [np.array([e_min, e_max], dtype=np.float64)]
+    _list_data = _map_in_threads(lambda _file_name: get_database_arrays(file_name=_file_name), list(file_names),
+                                 max_workers=max_workers)
+    for _data in _list_data:
+        _energy = _data['E_eV']
+        _start, _stop = np.searchsorted(_energy, [e_min, e_max], side='left')
+        _list_energy.append(_energy[_start:_stop])
+    return np.unique(np.concatenate(_list_energy))
+
+
+def thin_energy_grid(energy: np.array, signal: np.array, tolerance: float):
+    """return the subset of energies needed to describe the signal by linear interpolation within the tolerance
+
+    Starting from the first and last points, the point of each interval with the largest deviation from the
+    linear interpolation is added until no deviation exceeds the tolerance.
+
+    :param energy: energy axis (eV) in increasing order
+    :type energy: np.array
+    :param signal: signal on the energy axis
+    :type signal: np.array
+    :param tolerance: maximum absolute deviation allowed
+    :type tolerance: float
+
+    :return: thinned energy axis
+    :rtype: np.array
+    """
+    energy = np.asarray(energy, dtype=np.float64)
+    signal = np.asarray(signal, dtype=np.float64)
+    _keep = np.zeros(len(energy), dtype=bool)
+    _keep[[0, -1]] = True
+    while True:
+        _kept_index = np.flatnonzero(_keep)
+        _error = np.abs(signal - np.interp(energy, energy[_kept_index], signal[_kept_index]))
+        # largest deviation of each interval [kept_i, kept_i+1)
+        _interval_max = np.maximum.reduceat(_error, _kept_index[:-1])
+        _interval = np.searchsorted(_kept_index, np.arange(len(energy)), side='right') - 1
+        _interval = np.minimum(_interval, len(_interval_max) - 1)
+        _new_points = (_error > tolerance) & (_error == _interval_max[_interval])
+        if not _new_points.any():
+            return energy[_keep]
+        _keep |= _new_points
+
+
+def get_interpolation_index(x: np.array, x_new: np.array):
+    """return the indices and weights of the linear interpolation at x_new of data sampled on x
+
+    Results are kept in the process-wide cache (see ImagingReso._cache) so the search of the indices is done
+    once per distinct (x, x_new) pair, whatever the number of data sets sampled on x.
+
+    :param x: axis of the data
+    :type x: np.array
+    :param x_new: axis to interpolate on
+    :type x_new: np.array
+
+    :return: {'index': left index in sorted x, 'weight': relative position between index and index + 1,
+              'order': order sorting x (empty if x is already sorted)}
+    :rtype: dict
+
+    :raises ValueError: if a value of x_new is outside [min(x), max(x)]
+    """
+    x = np.asarray(x, dtype=np.float64)
+    x_new = np.asarray(x_new, dtype=np.float64)
+    _key = get_grid_signature(energy_grid=x) + get_grid_signature(energy_grid=x_new)
+    _cached = _cache.interpolation_index_cache.get(_key)
+    if _cached is not None:
+        return _cached
+
+    _order = np.empty(0, dtype=np.intp)
+    if np.any(x[1:] < x[:-1]):
+        _order = np.argsort(x, kind='stable')
+        x = x[_order]
+    if len(x_new) and (x_new.min() < x[0] or x_new.max() > x[-1]):
+        raise ValueError("A value in x_new is out of the interpolation range.")
+
+    # at repeated x (step in the data) the value on the right side of the step is used, as np.interp does
+    _index_right = np.clip(np.searchsorted(x, x_new, side='right'), 1, len(x) - 1)
+    _index = _index_right - 1
+    _step = x[_index_right] - x[_index]
+    _weight = np.divide(x_new - x[_index], _step, out=np.ones_like(x_new), where=_step != 0)
+    return _cache.interpolation_index_cache.put(_key, {'index': _index, 'weight': _weight, 'order': _order})
+
+
+def interpolate_with_index(y: np.array, index: dict):
+    """evaluate the linear interpolation of y using the indices and weights from get_interpolation_index
+
+    :param y: data (1D), or data sets sampled on the same axis (2D, one row per data set)
+    :type y: np.array
+    :param index: output of get_interpolation_index
+    :type index: dict
+
+    :return: interpolated data (1D or 2D)
+    :rtype: np.array
+    """
+    y = np.asarray(y, dtype=np.float64)
+    if len(index['order']):
+        y = y[..., index['order']]
+    _index = index['index']
+    _y_left = y[..., _index]
+    return _y_left + index['weight'] * (y[..., _index + 1] - _y_left)
+
+
+def _raise_out_of_range(data_energy: np.array, e_min, e_max, err: Exception):
+    a_min = round(ev_to_angstroms(e_max), 6)
+    a_max = round(ev_to_angstroms(e_min), 6)
+    data_e_min = round(np.min(data_energy), 6)
+    data_e_max = round(np.max(data_energy), 6)
+    data_a_min = round(ev_to_angstroms(data_e_max), 6)
+    data_a_max = round(ev_to_angstroms(data_e_min), 6)
+    errmsg = "Oops, the experimental data does not cover the specified range ({}, {}) eV or ({}, {}) \u212B, please adjust to numbers within ({}, {}) eV or ({}, {}) \u212B.".format(
+        e_min, e_max,
+        a_min, a_max,
+        data_e_min, data_e_max,
+        data_a_min, data_a_max)
+    raise Exception(errmsg) from err
+
+
+def get_interpolated_data(df, e_min=np.nan, e_max=np.nan, e_step=np.nan, x_axis=None):
     """return the interpolated x and y axis for the given x range [e_min, e_max] with step defined
 
-    :param df: input data frame
-    :type df: pandas.DataFrame
+    :param df: input data with 'E_eV' and 'Sig_b' columns
+    :type df: pandas.DataFrame or dict
     :param e_min: left energy range in eV of new interpolated data
     :type e_min: float
     :param e_max: right energy range in eV of new interpolated data
     :type e_max: float
     :param e_step: energy step in eV for interpolation
     :type e_step: float
+    :param x_axis: energy axis (eV) of the interpolated data, used instead of e_min, e_max and e_step
+    :type x_axis: np.array
 
     :return: x_axis and y_axis of interpolated data over specified range
     :rtype: dict
     """
-    nbr_point = int((e_max - e_min) / e_step + 1)
-    x_axis = np.linspace(e_min, e_max, nbr_point).round(6)
-    y_axis_function = interp1d(x=df['E_eV'], y=df['Sig_b'], kind='linear')
+    if x_axis is None:
+        x_axis = get_energy_grid(e_min=e_min, e_max=e_max, e_step=e_step)
+    else:
+        e_min = x_axis[0]
+        e_max = x_axis[-1]
     try:
-        y_axis = y_axis_function(x_axis)
+        _index = get_interpolation_index(x=df['E_eV'], x_new=x_axis)
     except ValueError as err:
-        a_min = round(ev_to_angstroms(e_max), 6)
-        a_max = round(ev_to_angstroms(e_min), 6)
-        data_e_min = round(min(df['E_eV']), 6)
-        data_e_max = round(max(df['E_eV']), 6)
-        data_a_min = round(ev_to_angstroms(data_e_max), 6)
-        data_a_max = round(ev_to_angstroms(data_e_min), 6)
-        errmsg = "Oops, the experimental data does not cover the specified range ({}, {}) eV or ({}, {}) \u212B, please adjust to numbers within ({}, {}) eV or ({}, {}) \u212B.".format(
-            e_min, e_max,
-            a_min, a_max,
-            data_e_min, data_e_max,
-            data_a_min, data_a_max)
-        raise Exception(errmsg) from err
-        sys.exit(1)
+        _raise_out_of_range(data_energy=df['E_eV'], e_min=e_min, e_max=e_max, err=err)
+    y_axis = interpolate_with_index(y=df['Sig_b'], index=_index)
     return {'x_axis': x_axis, 'y_axis': y_axis}
 
 
-def get_sigma(database_file_name='', e_min=np.nan, e_max=np.nan, e_step=np.nan, t_kelvin=None):
+def get_grid_signature(energy_grid: np.array):
+    """return a hashable signature of an energy axis, used to identify cached data interpolated on it"""
+    _grid = np.ascontiguousarray(energy_grid, dtype=np.float64)
+    return 'grid', len(_grid), hashlib.sha1(_grid.tobytes()).hexdigest()
+
+
+def get_temperature_kelvin(temperature='294K'):
+    """return the temperature in Kelvin of a temperature given as a number or a string ('294K', '600 K')
+
+    Raises:
+    =======
+    ValueError if the temperature can not be read or is below the temperature of the databases (294K)
+    """
+    if isinstance(temperature, str):
+        _match = re.match(r'^\s*([0-9.eE+-]+)\s*[kK]?\s*$', temperature)
+        if _match is None:
+            raise ValueError("Temperature '{}' must be in Kelvin, ex: '294K'".format(temperature))
+        temperature = _match.group(1)
+    try:
+        t_kelvin = float(temperature)
+    except (TypeError, ValueError):
+        raise ValueError("Temperature '{}' must be in Kelvin, ex: '294K'".format(temperature))
+    if not t_kelvin >= database_temperature_k:
+        raise ValueError("Temperature must be >= {}K, the temperature of the database!".format(database_temperature_k))
+    return t_kelvin
+
+
+def get_mass_ratio_of_file(file_name=''):
+    """return the mass of the nucleus of an isotope database file in units of neutron mass
+
+    Parameters:
+    ===========
+    file_name: string. path/to/database file, ex: 'Ag-107.csv' (107-Ag), 'Ag-110_m1.csv' (110-Ag) or 'H-CH4.csv' (H)
+    """
+    _element, _, _number = os.path.splitext(os.path.basename(file_name))[0].partition('-')
+    _number = _number.split('_')[0]
+    if _number.isdigit() and _number != '0':
+        _mass = get_mass(_number + '-' + _element)
+    else:
+        _mass = get_mass(_element)
+    return _mass / neutron_mass_amu
+
+
+def get_doppler_broadened_sigma(energy: np.array, sigma: np.array, energy_out: np.array, mass_ratio: float,
+                                t_kelvin: float, t_kelvin_data=database_temperature_k):
+    """return the cross-section at t_kelvin from the cross-section at t_kelvin_data, at the energies energy_out
+
+    The free gas kernel of SIGMA1 is applied for the temperature increase t_kelvin - t_kelvin_data:
+    with u = sqrt(E) and alpha = mass_ratio / (k * (t_kelvin - t_kelvin_data)),
+
+        sigma_t(u) = 1 / u^2 * sqrt(alpha / pi) * integral(v^2 * sigma(v) * (exp(-alpha (u - v)^2) -
+                                                                             exp(-alpha (u + v)^2)) dv)
+
+    which is the convolution of the odd extension of v^2 * sigma(v) with a Gaussian. v^2 * sigma(v) is averaged over
+    a uniform u grid (4 points per standard deviation of the Gaussian, integral of the data conserved) and
+    convolved using FFTs.
+
+    :param energy: energy axis (eV) of the data at t_kelvin_data
+    :type energy: np.array
+    :param sigma: cross-section (barn) at t_kelvin_data
+    :type sigma: np.array
+    :param energy_out: energies (eV) of the broadened cross-section
+    :type energy_out: np.array
+    :param mass_ratio: mass of the target nucleus in units of neutron mass
+    :type mass_ratio: float
+    :param t_kelvin: temperature (K) of the broadened cross-section
+    :type t_kelvin: float
+    :param t_kelvin_data: temperature (K) of the data
+    :type t_kelvin_data: float
+
+    :return: broadened cross-section (barn) at energy_out
+    :rtype: np.array
+
+    :raises ValueError: if t_kelvin < t_kelvin_data or if energy_out is outside of the energy range of the data
+    """
+    energy = np.asarray(energy, dtype=np.float64)
+    sigma = np.asarray(sigma, dtype=np.float64)
+    energy_out = np.asarray(energy_out, dtype=np.float64)
+    if t_kelvin < t_kelvin_data:
+        raise ValueError("Temperature must be >= {}K, the temperature of the database!".format(t_kelvin_data))
+    _check_energy_range(data_energy=energy, energy=energy_out)
+    if t_kelvin == t_kelvin_data:
+        return interpolate_with_index(y=sigma, index=get_interpolation_index(x=energy, x_new=energy_out))
+
+    from scipy.signal import fftconvolve
+
+    alpha = mass_ratio / (Boltzmann_eV * (t_kelvin - t_kelvin_data))
+    _width = 1. / np.sqrt(2. * alpha)  # standard deviation of the Gaussian in sqrt(eV)
+    _step = _width / 4.
+    _nbr_width = 6.
+
+    # v^2 * sigma(v) averaged over uniform bins of u, from its cumulative integral over the data points
+    u_out = np.sqrt(energy_out)
+    _u_min = max(u_out.min() - _nbr_width * _width, 0.)
+    _nbr_bins = int(np.ceil((u_out.max() + _nbr_width * _width - _u_min) / _step)) + 1
+    _edges = _u_min + _step * np.arange(_nbr_bins + 1)
+    _u = np.sqrt(energy)
+    _f = energy * sigma
+    _cumulative = np.concatenate([[0.], np.cumsum(np.diff(_u) * (_f[1:] + _f[:-1]) / 2.)])
+    _f_bins = np.diff(np.interp(_edges, _u, _cumulative)) / _step
+    _centers = _edges[:-1] + _step / 2.
+    if _u_min == 0:
+        # odd extension, accounts for the exp(-alpha (u + v)^2) term
+        _f_bins = np.concatenate([-_f_bins[::-1], _f_bins])
+        _centers = np.concatenate([-_centers[::-1], _centers])
+
+    _offsets = _step * np.arange(-int(np.ceil(_nbr_width * _width / _step)),
+                                 int(np.ceil(_nbr_width * _width / _step)) + 1)
+    _kernel = np.sqrt(alpha / np.pi) * np.exp(-alpha * _offsets ** 2) * _step
+    _f_broadened = fftconvolve(_f_bins, _kernel, mode='same')
+    # round-off of the FFTs can give tiny negative values where the cross-section is close to 0
+    return np.maximum(np.interp(u_out, _centers, _f_broadened) / energy_out, 0.)
+
+
+def _check_energy_range(data_energy: np.array, energy: np.array):
+    """raise ValueError if a value of energy is outside [min(data_energy), max(data_energy)]"""
+    if np.min(energy) < np.min(data_energy) or np.max(energy) > np.max(data_energy):
+        raise ValueError("A value in x_new is out of the interpolation range.")
+
+
+def _get_temperature_key(t_kelvin=None):
+    """return the part of the cache key of interpolated sigma depending on the temperature (empty if not broadened)"""
+    if t_kelvin is None or t_kelvin == database_temperature_k:
+        return ()
+    return ('T', float(t_kelvin))
+
+
+def get_sigma(database_file_name='', e_min=np.nan, e_max=np.nan, e_step=np.nan, t_kelvin=None, energy_grid=None):
     """retrieve the Energy and sigma axis for the given isotope
 
     :param database_file_name: path/to/file with extension
@@ -545,27 +965,140 @@ def get_sigma(database_file_name='', e_min=np.nan, e_max=np.nan, e_step=np.nan,
     :type e_max: float
     :param e_step: energy step in eV for interpolation
     :type e_step: float
-    :param t_kelvin: temperature in Kelvin
+    :param t_kelvin: temperature in Kelvin (None -> temperature of the database), the cross-section is
+                     Doppler broadened from the temperature of the database (see get_doppler_broadened_sigma)
     :type t_kelvin: float
+    :param energy_grid: energy axis (eV) to interpolate on, used instead of e_min, e_max and e_step
+    :type energy_grid: np.array
 
-    :return: {'energy': np.array, 'sigma': np.array}
+    :return: {'energy': np.array, 'sigma': np.array}, a new dictionary of read-only arrays shared through the
+             process-wide cache of interpolated data (see ImagingReso._cache)
     :rtype: dict
     """
 
     file_extension = os.path.splitext(database_file_name)[1]
 
-    if t_kelvin is None:
-        # '.csv' files
-        if file_extension != '.csv':
+    # '.csv' files
+    if file_extension != '.csv':
+        raise IOError("Cross-section File type must be '.csv'")
+    if energy_grid is None:
+        _grid_signature = (e_min, e_max, e_step)
+    else:
+        _grid_signature = get_grid_signature(energy_grid=energy_grid)
+    _key = _get_database_file_key(file_name=database_file_name) + _grid_signature + _get_temperature_key(t_kelvin)
+    _cached = _cache.interpolated_sigma_cache.get(_key)
+    if _cached is not None:
+        return dict(_cached)
+    if energy_grid is not None:
+        # the cached arrays are made read-only, the grid of the caller must stay writeable
+        energy_grid = np.array(energy_grid, dtype=np.float64)
+    _df = get_database_arrays(file_name=database_file_name)
+    if _get_temperature_key(t_kelvin):
+        if energy_grid is None:
+            energy_grid = get_energy_grid(e_min=e_min, e_max=e_max, e_step=e_step)
+        try:
+            _check_energy_range(data_energy=_df['E_eV'], energy=energy_grid)
+        except ValueError as err:
+            _raise_out_of_range(data_energy=_df['E_eV'], e_min=energy_grid[0], e_max=energy_grid[-1], err=err)
+        _sigma = get_doppler_broadened_sigma(energy=_df['E_eV'], sigma=_df['Sig_b'], energy_out=energy_grid,
+                                             mass_ratio=get_mass_ratio_of_file(file_name=database_file_name),
+                                             t_kelvin=t_kelvin)
+        return dict(_cache.interpolated_sigma_cache.put(_key, {'energy_eV': energy_grid,
+                                                               'sigma_b': _sigma}))
+    _dict = get_interpolated_data(df=_df, e_min=e_min, e_max=e_max,
+                                  e_step=e_step, x_axis=energy_grid)
+    return dict(_cache.interpolated_sigma_cache.put(_key, {'energy_eV': _dict['x_axis'],
+                                                           'sigma_b': _dict['y_axis']}))
+
+
+def _map_in_threads(function, list_args: list, max_workers=None):
+    """return [function(arg) for arg in list_args], evaluated by a pool of max_workers threads if max_workers > 1
+
+    The order of the outputs is the order of list_args whatever the number of threads.
+    """
+    if max_workers is None or max_workers <= 1 or len(list_args) <= 1:
+        return [function(_arg) for _arg in list_args]
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(function, list_args))
+
+
+def get_sigmas(database_file_names: list, energy_grid: np.array, max_workers=None, t_kelvin=None):
+    """retrieve the sigma axis of many isotopes interpolated on the same energy axis
+
+    Isotopes sharing the same energy axis in the database are interpolated together in a single pass,
+    the interpolation indices being computed once per distinct database energy axis.
+
+    :param database_file_names: list of path/to/file with extension
+    :type database_file_names: list
+    :param energy_grid: energy axis (eV) to interpolate on
+    :type energy_grid: np.array
+    :param max_workers: number of threads loading and interpolating the files (None or 1: no thread)
+    :type max_workers: int
+    :param t_kelvin: temperature in Kelvin (None -> temperature of the database), the cross-sections are
+                     Doppler broadened from the temperature of the database one file at a time
+    :type t_kelvin: float
+
+    :return: list of {'energy_eV': np.array, 'sigma_b': np.array} in the order of database_file_names,
+             read-only arrays shared through the process-wide cache of interpolated data
+    :rtype: list
+    """
+    energy_grid = np.array(energy_grid, dtype=np.float64)
+    _grid_signature = get_grid_signature(energy_grid=energy_grid) + _get_temperature_key(t_kelvin)
+    sigmas = [None] * len(database_file_names)
+
+    # database files not in cache: {cache key: [positions]}
+    _to_load = {}
+    _file_names = {}
+    for _position, _file_name in enumerate(database_file_names):
+        if os.path.splitext(_file_name)[1] != '.csv':
             raise IOError("Cross-section File type must be '.csv'")
+        _key = _get_database_file_key(file_name=_file_name) + _grid_signature
+        _cached = _cache.interpolated_sigma_cache.get(_key)
+        if _cached is not None:
+            sigmas[_position] = dict(_cached)
+            continue
+        _to_load.setdefault(_key, []).append(_position)
+        _file_names[_key] = _file_name
+
+    _list_keys = list(_to_load.keys())
+    _raw_data = dict(zip(_list_keys, _map_in_threads(lambda _key: get_database_arrays(file_name=_file_names[_key]),
+                                                     _list_keys, max_workers=max_workers)))
+
+    # files grouped by energy axis: {axis signature: [cache keys]}, one group per file if broadened
+    _groups = {}
+    for _key in _list_keys:
+        if _get_temperature_key(t_kelvin):
+            _groups[_key] = [_key]
         else:
-            _df = get_database_data(file_name=database_file_name)
-            _dict = get_interpolated_data(df=_df, e_min=e_min, e_max=e_max,
-                                          e_step=e_step)
-            return {'energy_eV': _dict['x_axis'],
-                    'sigma_b': _dict['y_axis']}
-    else:
-        raise ValueError("Doppler broadened cross-section in not yet supported in current version.")
+            _groups.setdefault(get_grid_signature(energy_grid=_raw_data[_key]['E_eV']), []).append(_key)
+
+    def _interpolate_group(group_keys):
+        _data_energy = _raw_data[group_keys[0]]['E_eV']
+        if _get_temperature_key(t_kelvin):
+            try:
+                _check_energy_range(data_energy=_data_energy, energy=energy_grid)
+            except ValueError as err:
+                _raise_out_of_range(data_energy=_data_energy, e_min=energy_grid[0], e_max=energy_grid[-1], err=err)
+            return get_doppler_broadened_sigma(energy=_data_energy, sigma=_raw_data[group_keys[0]]['Sig_b'],
+                                               energy_out=energy_grid,
+                                               mass_ratio=get_mass_ratio_of_file(file_name=_file_names[group_keys[0]]),
+                                               t_kelvin=t_kelvin)[np.newaxis]
+        try:
+            _index = get_interpolation_index(x=_data_energy, x_new=energy_grid)
+        except ValueError as err:
+            _raise_out_of_range(data_energy=_data_energy, e_min=energy_grid[0], e_max=energy_grid[-1], err=err)
+        return interpolate_with_index(y=np.vstack([_raw_data[_key]['Sig_b'] for _key in group_keys]), index=_index)
+
+    _list_groups = list(_groups.values())
+    _list_sigma = _map_in_threads(_interpolate_group, _list_groups, max_workers=max_workers)
+    for _group_keys, _sigma in zip(_list_groups, _list_sigma):
+        for _row, _key in enumerate(_group_keys):
+            _dict = _cache.interpolated_sigma_cache.put(_key, {'energy_eV': energy_grid,
+                                                               'sigma_b': _sigma[_row]})
+            for _position in _to_load[_key]:
+                sigmas[_position] = dict(_dict)
+    return sigmas
 
 
 # # '.h5' files
@@ -700,6 +1233,77 @@ def calculate_transmission(thickness_cm: float, atoms_per_cm3: float, sigma_b: n
     return mu_per_cm, transmission
 
 
+def calculate_transmission_batch(thickness_cm: np.array, atoms_per_cm3: np.array, sigma_b: np.array):
+    """calculate the transmission signal of many samples at once using the formula
+
+    transmission = exp( - outer(thickness_cm * atoms_per_cm3 * 1e-24, sigma_b))
+
+    Parameters:
+    ===========
+    thickness_cm: np.array (n_samples,) of thickness (in cm)
+    atoms_per_cm3: np.array (n_samples,) of number of atoms per cm3 of element/isotope
+    sigma_b: np.array (n_energy,) of sigma retrieved from database
+
+    Returns:
+    ========
+    transmission array (n_samples, n_energy)
+    """
+    _areal_density = np.asarray(thickness_cm, dtype=np.float64) * np.asarray(atoms_per_cm3, dtype=np.float64) * 1e-24
+    transmission = np.outer(_areal_density, sigma_b)
+    np.negative(transmission, out=transmission)
+    np.exp(transmission, out=transmission)
+    return transmission
+
+
+class LazyDict(MutableMapping):
+    """dictionary whose values can be defined by a function, called once on first access of the key
+
+    ex: signal = LazyDict(energy_eV=energy)
+        signal.set_lazy('transmission', lambda: np.exp(-mu))
+        signal['transmission']  # computed and kept
+    """
+
+    class _Pending(object):
+        __slots__ = ['function']
+
+        def __init__(self, function):
+            self.function = function
+
+    def __init__(self, *args, **kwargs):
+        self._items = dict(*args, **kwargs)
+
+    def set_lazy(self, key, function):
+        """define the value of key as the result of function(), evaluated on first access"""
+        self._items[key] = self._Pending(function)
+
+    def is_computed(self, key):
+        """return True if the value of key is available without calling its function"""
+        return not isinstance(self._items[key], self._Pending)
+
+    def __getitem__(self, key):
+        value = self._items[key]
+        if isinstance(value, self._Pending):
+            value = value.function()
+            self._items[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._items[key] = value
+
+    def __delitem__(self, key):
+        del self._items[key]
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __repr__(self):
+        return '{' + ', '.join('{!r}: {}'.format(_key, '<lazy>' if isinstance(_value, self._Pending) else repr(_value))
+                               for _key, _value in self._items.items()) + '}'
+
+
 def set_distance_units(value=np.nan, from_units='mm', to_units='cm'):
     """convert distance into new units
     
@@ -848,6 +1452,8 @@ def ev_to_image_number(offset_us, source_to_detector_m, time_resolution_us, t_st
     # delay values is normal 2.99 us with NONE actual MCP delay settings
     """convert energy (eV) to image numbers (#)
 
+    The time recorded by the detector is the one of ev_to_s: time of flight minus offset_us.
+
     Parameters:
     ===========
     numpy array of energy in eV
@@ -859,7 +1465,7 @@ def ev_to_image_number(offset_us, source_to_detector_m, time_resolution_us, t_st
     image numbers: array of image number
     """
     time_tot_us = np.sqrt(81.787 / (array * 1000)) * source_to_detector_m * 100 / 0.3956
-    time_record_us = (time_tot_us + offset_us)
+    time_record_us = (time_tot_us - offset_us)
     image_number = (time_record_us - t_start_us) / time_resolution_us
     return image_number
 
@@ -0,0 +1,129 @@
+import numpy as np
+
+from ImagingReso import _utilities
+
+
+def get_samples_weights(stacks: list, database='ENDF_VII'):
+    """return the weights (thickness_cm * atoms_per_cm3 * isotopic_ratio * 1e-24) of the isotopes of many samples
+
+    The isotopes are deduplicated across samples: every database file is listed once, whatever the number of
+    samples and layers using it. Densities and molar masses are derived as in Resonance (layer density calculated
+    from the element densities if not provided, natural isotopic ratios).
+
+    Parameters:
+    ===========
+    stacks: list of dictionaries defining the layers of each sample, same format as the stack of Resonance
+       ex: [{'CoAg': {'elements': ['Co', 'Ag'],
+                      'stoichiometric_ratio': [1, 1],
+                      'thickness': {'value': 0.025, 'units': 'mm'},
+                      'density': {'value': 9.8, 'units': 'g/cm3'}}},
+            ...]
+    database: string (default is ENDF_VII)
+
+    Returns:
+    ========
+    (weights, file_names) with weights a (n_samples, n_files) array and file_names the list of path/to/database
+    files of the columns
+
+    Raises:
+    =======
+    ValueError if one of the element of one of the samples can not be found in the database
+    """
+    _element_infos = {}
+    _columns = {}
+    _list_rows = []
+    for _stack in stacks:
+        _utilities.checking_stack(stack=_stack, database=database)
+        _row = {}
+        for _compound, _layer in _stack.items():
+            _elements = _layer['elements']
+            _stoichiometric_ratio = _layer['stoichiometric_ratio']
+            for _element in _elements:
+                if _element not in _element_infos:
+                    _element_infos[_element] = _utilities.get_isotope_dicts(element=_element, database=database)
+
+            _density = _layer.get('density', {'value': np.nan})['value']
+            if np.isnan(_density):
+                _density = _utilities.get_compound_density(
+                    list_density=[_element_infos[_element]['density']['value'] for _element in _elements],
+                    list_ratio=_stoichiometric_ratio)
+            _molar_mass = sum(_stoichio * _element_infos[_element]['molar_mass']['value']
+                              for _element, _stoichio in zip(_elements, _stoichiometric_ratio))
+            _atoms_per_cm3 = _utilities.Avogadro * _density / _molar_mass
+            _thickness_cm = _utilities.set_distance_units(value=_layer['thickness']['value'],
+                                                          from_units=_layer['thickness']['units'],
+                                                          to_units='cm')
+
+            for _element, _stoichio in zip(_elements, _stoichiometric_ratio):
+                _isotopes = _element_infos[_element]['isotopes']
+                for _iso, _file, _ratio in zip(_isotopes['list'], _isotopes['file_names'],
+                                               _isotopes['isotopic_ratio']):
+                    _file_name = _utilities.get_sigma_file(compound=_compound, isotope=_iso, file_name=_file,
+                                                           database=database)
+                    _column = _columns.setdefault(_file_name, len(_columns))
+                    _row[_column] = _row.get(_column, 0.) + \
+                        _thickness_cm * _atoms_per_cm3 * _stoichio * _ratio * 1e-24
+        _list_rows.append(_row)
+
+    weights = np.zeros((len(stacks), len(_columns)))
+    for _index, _row in enumerate(_list_rows):
+        for _column, _weight in _row.items():
+            weights[_index, _column] = _weight
+    return weights, list(_columns.keys())
+
+
+def calculate_transmission_of_samples(stacks: list, energy_grid, database='ENDF_VII', max_workers=None,
+                                      processes=None):
+    """calculate the total transmission of many independent samples on one energy axis
+
+    Each isotope found in the samples is loaded and interpolated once, the transmission of all the samples
+    is then given by exp(-weights @ sigma) with weights the (n_samples, n_isotopes) matrix of
+    thickness_cm * atoms_per_cm3 * isotopic_ratio * 1e-24 and sigma the (n_isotopes, n_energy) matrix of
+    interpolated cross-sections.
+
+    Parameters:
+    ===========
+    stacks: list of dictionaries defining the layers of each sample, same format as the stack of Resonance
+    energy_grid: np.array. strictly increasing energy axis in eV
+    database: string (default is ENDF_VII)
+    max_workers: int (default is None). number of threads loading and interpolating the database files
+    processes: int (default is None). number of processes sharing the samples, None or 1 -> the samples are
+       calculated in the current process
+
+    Returns:
+    ========
+    transmission array (n_samples, n_energy)
+
+    Raises:
+    =======
+    ValueError if database is not supported
+    ValueError if energy_grid is not strictly increasing
+    """
+    if database not in ['ENDF_VII', 'ENDF_VIII', '_data_for_unittest']:
+        raise ValueError(
+            "Database {} entered not existed. \nCurrent support: ['ENDF_VII', 'ENDF_VIII'] ".format(database))
+    energy_grid = np.array(energy_grid, dtype=np.float64)
+    if energy_grid.ndim != 1 or len(energy_grid) < 2:
+        raise ValueError("Energy grid must be a 1D array of at least 2 energies!")
+    if np.any(np.diff(energy_grid) <= 0):
+        raise ValueError("Energy grid must be strictly increasing!")
+    stacks = list(stacks)
+
+    if processes is not None and processes > 1 and len(stacks) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        _list_chunks = [_chunk.tolist() for _chunk in np.array_split(np.arange(len(stacks)), processes)
+                        if len(_chunk)]
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            _futures = [executor.submit(calculate_transmission_of_samples,
+                                        stacks=[stacks[_index] for _index in _chunk], energy_grid=energy_grid,
+                                        database=database, max_workers=max_workers)
+                        for _chunk in _list_chunks]
+            return np.vstack([_future.result() for _future in _futures])
+
+    weights, file_names = get_samples_weights(stacks=stacks, database=database)
+    _list_sigmas = _utilities.get_sigmas(database_file_names=file_names, energy_grid=energy_grid,
+                                         max_workers=max_workers)
+    if not _list_sigmas:
+        return np.ones((len(stacks), len(energy_grid)))
+    sigma = np.vstack([_dict['sigma_b'] for _dict in _list_sigmas])
+    return _utilities.calculate_trans(thickness_cm=1., mu_per_cm=weights @ sigma)
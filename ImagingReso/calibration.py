@@ -0,0 +1,138 @@
+import numpy as np
+
+from ImagingReso import _utilities
+
+
+def _find_peaks(y: np.array, min_prominence: float):
+    """return the fractional indices (parabola through the 3 highest points) of the peaks of y with a prominence
+    of at least min_prominence * (max(y) - min(y)), ordered by index"""
+    from scipy.signal import find_peaks
+
+    _index, _ = find_peaks(y, prominence=min_prominence * (np.max(y) - np.min(y)))
+    _index = _index[(_index > 0) & (_index < len(y) - 1)]
+    _left = y[_index - 1]
+    _center = y[_index]
+    _right = y[_index + 1]
+    _curvature = _left - 2. * _center + _right
+    with np.errstate(divide='ignore', invalid='ignore'):
+        _shift = np.where(_curvature < 0, 0.5 * (_left - _right) / _curvature, 0.)
+    return _index + np.clip(_shift, -0.5, 0.5)
+
+
+def get_resonance_energies(o_reso, min_prominence=0.05):
+    """return the energies (eV) of the resonances of the sample of a Resonance object
+
+    The resonances are the peaks of the total attenuation coefficient -ln(total transmission), i.e. of the sigma
+    of every isotope of the stack weighted by its areal density, already calculated by the Resonance object.
+
+    Parameters:
+    ===========
+    o_reso: Resonance object
+    min_prominence: float (default 0.05). minimum prominence of the peaks, fraction of the range of -ln(transmission)
+
+    Returns:
+    ========
+    array of increasing energies in eV
+    """
+    _energy = o_reso.energy_eV
+    _attenuation = -np.log(np.clip(o_reso.total_signal['transmission'], 1e-300, None))
+    _index = _find_peaks(y=_attenuation, min_prominence=min_prominence)
+    return np.interp(_index, np.arange(len(_energy)), _energy)
+
+
+def _match_peaks(time_predicted: np.array, time_measured: np.array):
+    """return the indices (predicted, measured) of the pairs of peaks closest to each other (mutual nearest)"""
+    _order = np.argsort(time_predicted)
+    _sorted = time_predicted[_order]
+
+    def _nearest(sorted_times, times):
+        _right = np.clip(np.searchsorted(sorted_times, times), 1, len(sorted_times) - 1)
+        _left = _right - 1
+        return np.where(np.abs(times - sorted_times[_left]) <= np.abs(times - sorted_times[_right]), _left, _right)
+
+    if len(_sorted) == 1:
+        _nearest_predicted = np.zeros(len(time_measured), dtype=int)
+    else:
+        _nearest_predicted = _nearest(_sorted, time_measured)
+    _order_measured = np.argsort(time_measured)
+    if len(time_measured) == 1:
+        _nearest_measured = np.zeros(len(_sorted), dtype=int)
+    else:
+        _nearest_measured = _order_measured[_nearest(time_measured[_order_measured], _sorted)]
+    _measured = np.arange(len(time_measured))
+    _mutual = _nearest_measured[_nearest_predicted] == _measured
+    return _order[_nearest_predicted[_mutual]], _measured[_mutual]
+
+
+def calibrate(o_reso, time_s, transmission, source_to_detector_m=16., offset_us=0., min_prominence=0.05,
+              max_iterations=20):
+    """fit source_to_detector_m and offset_us from the positions of the resonance dips of a reference sample
+
+    The dips of the measured transmission are matched to the resonances of the Resonance object (same sample),
+    starting from the given source_to_detector_m and offset_us. As the recorded time of a resonance of energy E is
+    ev_to_s(offset_us, source_to_detector_m, E) = source_to_detector_m * k / sqrt(E) - offset_us * 1e-6, the two
+    parameters are the linear least squares solution over the matched dips. Peaks are matched again with the new
+    parameters until the matches do not change.
+
+    Parameters:
+    ===========
+    o_reso: Resonance object of the reference sample, its energy range must cover the measured dips
+    time_s: array of the times of the measured spectrum in s (time recorded by the detector)
+    transmission: array of the measured transmission at time_s
+    source_to_detector_m: float (default 16.). starting distance source to detector in m
+    offset_us: float (default 0.). starting delay of detector in us
+    min_prominence: float (default 0.05). minimum prominence of the dips, fraction of the range of -ln(transmission)
+    max_iterations: int (default 20). maximum number of matching iterations
+
+    Returns:
+    ========
+    {'source_to_detector_m': float,
+     'offset_us': float,
+     'energy_eV': array of the energies of the matched resonances,
+     'time_s': array of the measured times of the matched dips,
+     'residuals_us': array of the measured minus calibrated times of the matched dips in us}
+
+    Raises:
+    =======
+    ValueError if time_s and transmission do not have the same size
+    ValueError if less than 2 dips could be matched
+    """
+    time_s = np.asarray(time_s, dtype=np.float64)
+    transmission = np.asarray(transmission, dtype=np.float64)
+    if time_s.shape != transmission.shape or time_s.ndim != 1:
+        raise ValueError("Time and transmission must be 1D arrays of the same size!")
+
+    _energy = get_resonance_energies(o_reso=o_reso, min_prominence=min_prominence)
+    _index = _find_peaks(y=-np.log(np.clip(transmission, 1e-6, None)), min_prominence=min_prominence)
+    _time_measured = np.interp(_index, np.arange(len(time_s)), time_s)
+    if len(_energy) < 2 or len(_time_measured) < 2:
+        raise ValueError("At least 2 resonances are needed, found {} simulated and {} measured dips".format(
+            len(_energy), len(_time_measured)))
+
+    # time of flight of 1 eV neutrons over 1 m, t = source_to_detector_m * _t_1ev_1m / sqrt(E) - offset_us * 1e-6
+    _t_1ev_1m = _utilities.ev_to_s(offset_us=0., source_to_detector_m=1., array=1.)
+    _matches = None
+    for _ in range(max_iterations):
+        _time_predicted = _utilities.ev_to_s(offset_us=offset_us, source_to_detector_m=source_to_detector_m,
+                                             array=_energy)
+        _new_matches = _match_peaks(time_predicted=_time_predicted, time_measured=_time_measured)
+        if len(_new_matches[0]) < 2:
+            raise ValueError("Less than 2 measured dips could be matched to the resonances, "
+                             "check the starting source_to_detector_m and offset_us")
+        if _matches is not None and np.array_equal(_matches[0], _new_matches[0]) and \
+                np.array_equal(_matches[1], _new_matches[1]):
+            break
+        _matches = _new_matches
+        _design = np.column_stack([_t_1ev_1m / np.sqrt(_energy[_matches[0]]), -1e-6 * np.ones(len(_matches[0]))])
+        (source_to_detector_m, offset_us), _, _, _ = np.linalg.lstsq(_design, _time_measured[_matches[1]],
+                                                                     rcond=None)
+
+    _energy_matched = _energy[_matches[0]]
+    _time_matched = _time_measured[_matches[1]]
+    _time_calibrated = _utilities.ev_to_s(offset_us=offset_us, source_to_detector_m=source_to_detector_m,
+                                          array=_energy_matched)
+    return {'source_to_detector_m': float(source_to_detector_m),
+            'offset_us': float(offset_us),
+            'energy_eV': _energy_matched,
+            'time_s': _time_matched,
+            'residuals_us': (_time_matched - _time_calibrated) * 1e6}
@@ -0,0 +1,145 @@
+import numpy as np
+
+from ImagingReso import _utilities
+
+# default layout of one event of the binary event files: pixel position and time of flight
+event_dtype = np.dtype([('x', '<u2'), ('y', '<u2'), ('tof', '<f8')])
+
+time_units = {'s': 1., 'ms': 1e-3, 'us': 1e-6, 'ns': 1e-9}
+
+
+def get_energy_bin_edges(energy_grid):
+    """return the edges of the energy bins centered on the energies of an energy axis (half way between energies)
+
+    Parameters:
+    ===========
+    energy_grid: np.array. strictly increasing energy axis in eV, ex: Resonance.energy_eV
+
+    Returns:
+    ========
+    array of len(energy_grid) + 1 edges in eV
+    """
+    energy_grid = np.asarray(energy_grid, dtype=np.float64)
+    if energy_grid.ndim != 1 or len(energy_grid) < 2:
+        raise ValueError("Energy grid must be a 1D array of at least 2 energies!")
+    if np.any(np.diff(energy_grid) <= 0):
+        raise ValueError("Energy grid must be strictly increasing!")
+    _middles = (energy_grid[1:] + energy_grid[:-1]) / 2.
+    return np.concatenate([[energy_grid[0] - (_middles[0] - energy_grid[0])], _middles,
+                           [energy_grid[-1] + (energy_grid[-1] - _middles[-1])]])
+
+
+def _accumulate(counts, index):
+    """add one count to counts (flat array) at every index, bincount if counts is not larger than index"""
+    if counts.size <= len(index):
+        counts += np.bincount(index, minlength=counts.size)
+    else:
+        np.add.at(counts, index, 1)
+
+
+def histogram_events(file_name, energy_grid, source_to_detector_m=16., offset_us=0., x_axis='energy',
+                     time_resolution_us=None, t_start_us=None, roi=None, detector_shape=None, dtype=event_dtype,
+                     tof_units='s', offset_bytes=0, chunk_size=4194304):
+    """histogram the (x, y, tof) events of a binary event file onto the energy or image number axis of Resonance
+
+    The file is memory-mapped and read by blocks of chunk_size events: the memory used does not depend on the
+    number of events, only on chunk_size and on the size of the spectra.
+
+    Parameters:
+    ===========
+    file_name: string. path/to/binary file of events
+    energy_grid: np.array. strictly increasing energy axis in eV, ex: Resonance.energy_eV
+    source_to_detector_m: float (default 16.). Distance source to detector in m
+    offset_us: float (default 0.). Delay of detector in us
+    x_axis: string (default 'energy'). ['energy'|'number']
+       'energy' -> one bin per energy of energy_grid (edges half way between energies)
+       'number' -> one bin per image covering the energies of energy_grid, image numbers of the Resonance
+                   'number' axis (ev_to_image_number): an event recorded at tof is in image
+                   floor((tof_us - t_start_us) / time_resolution_us) (requires time_resolution_us and t_start_us)
+    time_resolution_us: float. duration of one image in us (x_axis='number' only)
+    t_start_us: float. start time of the first image in us (x_axis='number' only)
+    roi: list of (x_min, y_min, x_max, y_max) regions of interest, x_max and y_max excluded
+       (default None -> one spectrum for the whole detector, or per pixel if detector_shape is given)
+    detector_shape: tuple (height, width) (default None). spectra of every pixel if provided and roi is None
+    dtype: numpy dtype of one event with fields 'x', 'y' and 'tof' (default is event_dtype)
+    tof_units: string (default 's'). units of the 'tof' field ['s'|'ms'|'us'|'ns']
+    offset_bytes: int (default 0). size of the header of the file
+    chunk_size: int (default 4194304). number of events read at once
+
+    Returns:
+    ========
+    {'x_axis': energies (eV) or image numbers of the bins,
+     'counts': spectrum array (n_bins), (n_roi, n_bins) or (height, width, n_bins),
+     'nbr_events': number of events read,
+     'nbr_events_binned': number of events counted in the spectra}
+
+    Raises:
+    =======
+    ValueError if x_axis, tof_units or roi are not valid
+    """
+    if x_axis not in ['energy', 'number']:
+        raise ValueError("x_axis must be either ['energy'|'number']")
+    if tof_units not in time_units:
+        raise ValueError("tof_units must be one of {}".format(list(time_units.keys())))
+    if x_axis == 'number' and (time_resolution_us is None or t_start_us is None):
+        raise ValueError("time_resolution_us and t_start_us are required for x_axis='number'")
+    if roi is not None:
+        roi = [tuple(int(_value) for _value in _roi) for _roi in roi]
+        if any(len(_roi) != 4 or _roi[2] <= _roi[0] or _roi[3] <= _roi[1] for _roi in roi):
+            raise ValueError("roi must be a list of (x_min, y_min, x_max, y_max) with x_max > x_min, y_max > y_min")
+
+    _edges = get_energy_bin_edges(energy_grid=energy_grid)
+    if x_axis == 'energy':
+        _axis = np.asarray(energy_grid, dtype=np.float64)
+    else:
+        # images of the highest and lowest energies
+        _images = np.floor(_utilities.ev_to_image_number(
+            offset_us=offset_us, source_to_detector_m=source_to_detector_m, time_resolution_us=time_resolution_us,
+            t_start_us=t_start_us, array=_edges[[-1, 0]])).astype(np.int64)
+        _first_image = int(_images[0])
+        _axis = np.arange(_first_image, int(_images[1]) + 1)
+    _nbr_bins = len(_axis)
+
+    if roi is not None:
+        counts = np.zeros((len(roi), _nbr_bins), dtype=np.int64)
+    elif detector_shape is not None:
+        counts = np.zeros((detector_shape[0], detector_shape[1], _nbr_bins), dtype=np.int64)
+    else:
+        counts = np.zeros(_nbr_bins, dtype=np.int64)
+    _flat_counts = counts.reshape(-1)
+
+    _events = np.memmap(file_name, dtype=dtype, mode='r', offset=offset_bytes)
+    _nbr_events_binned = 0
+    for _start in range(0, len(_events), chunk_size):
+        _block = _events[_start:_start + chunk_size]
+        _tof_s = _block['tof'] * time_units[tof_units]
+        if x_axis == 'energy':
+            with np.errstate(divide='ignore', invalid='ignore'):
+                _energy = _utilities.s_to_ev(offset_us=offset_us, source_to_detector_m=source_to_detector_m,
+                                             array=_tof_s)
+            _bin = np.searchsorted(_edges, _energy, side='right') - 1
+        else:
+            _bin = np.floor((_tof_s * 1e6 - t_start_us) / time_resolution_us).astype(np.int64) - _first_image
+        _valid = (_bin >= 0) & (_bin < _nbr_bins)
+
+        if roi is not None:
+            _x = _block['x']
+            _y = _block['y']
+            for _index, (_x_min, _y_min, _x_max, _y_max) in enumerate(roi):
+                _in_roi = _valid & (_x >= _x_min) & (_x < _x_max) & (_y >= _y_min) & (_y < _y_max)
+                _accumulate(counts[_index], _bin[_in_roi])
+                _nbr_events_binned += int(np.count_nonzero(_in_roi))
+        elif detector_shape is not None:
+            _x = _block['x'].astype(np.int64)
+            _y = _block['y'].astype(np.int64)
+            _valid &= (_x < detector_shape[1]) & (_y < detector_shape[0])
+            _accumulate(_flat_counts, (_y[_valid] * detector_shape[1] + _x[_valid]) * _nbr_bins + _bin[_valid])
+            _nbr_events_binned += int(np.count_nonzero(_valid))
+        else:
+            _accumulate(counts, _bin[_valid])
+            _nbr_events_binned += int(np.count_nonzero(_valid))
+
+    return {'x_axis': _axis,
+            'counts': counts,
+            'nbr_events': len(_events),
+            'nbr_events_binned': _nbr_events_binned}
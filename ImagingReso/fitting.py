@@ -0,0 +1,437 @@
+import numpy as np
+
+from ImagingReso import _utilities
+
+
+def get_sigma_components(o_reso, components=None):
+    """return the raw cross-sections (barn) of isotopes of a Resonance object, one row per component
+
+    Components must have different cross-sections: an isotope found in several layers (ex: Ag in an 'Ag' layer and
+    in a 'CoAg' layer) can not be told apart by its transmission. By default such an isotope is a single component,
+    named after the first layer holding it, whose areal density is the total over all the layers holding it.
+
+    Parameters:
+    ===========
+    o_reso: Resonance object providing the stack_sigma
+    components: list of 'layer/element/isotope' strings (default is None -> every isotope of the stack, once)
+       ex: ['Ag/Ag/107-Ag', 'Ag/Ag/109-Ag']
+
+    Returns:
+    ========
+    (components, sigma) with sigma a (n_components, n_energy) array
+
+    Raises:
+    =======
+    ValueError if a component can not be found in the stack
+    ValueError if two components have the same cross-section
+    """
+    _stack_sigma = o_reso.stack_sigma
+    _merge = components is None
+    if components is None:
+        components = []
+        for _compound in o_reso.stack.keys():
+            for _element in o_reso.stack[_compound]['elements']:
+                for _iso in o_reso.stack[_compound][_element]['isotopes']['list']:
+                    components.append('/'.join([_compound, _element, _iso]))
+
+    _list_components = []
+    _list_sigma = []
+    for _component in components:
+        _path = _component.split('/')
+        if len(_path) != 3 or _path[0] not in _stack_sigma or _path[1] not in _stack_sigma[_path[0]] \
+                or _path[2] not in _stack_sigma[_path[0]][_path[1]]:
+            raise ValueError("Component '{}' could not be find in the stack (format: 'layer/element/isotope')".format(
+                _component))
+        _sigma = _stack_sigma[_path[0]][_path[1]][_path[2]]['sigma_b_raw']
+        _duplicate = [_other for _other, _other_sigma in zip(_list_components, _list_sigma)
+                      if np.array_equal(_sigma, _other_sigma)]
+        if _duplicate:
+            if _merge:
+                continue
+            raise ValueError("Components '{}' and '{}' have the same cross-section, their areal densities can not "
+                             "be separated".format(_duplicate[0], _component))
+        _list_components.append(_component)
+        _list_sigma.append(_sigma)
+    return _list_components, np.vstack(_list_sigma)
+
+
+def _solve_block(solver: np.array, transmission: np.array, min_transmission: float):
+    """return the areal densities (n_components, n_pixels) of a block of transmission spectra (n_energy, n_pixels)"""
+    _attenuation = -np.log(np.clip(transmission, min_transmission, None))
+    return solver @ _attenuation
+
+
+def fit_areal_density(o_reso, transmission, components=None, chunk_size=65536, processes=None,
+                      min_transmission=1e-6):
+    """fit the areal density (atoms/cm2) of isotopes for every pixel of a transmission image stack
+
+    The linearized problem -ln(T(E)) = sum_i(n_i * sigma_i(E) * 1e-24) is solved in the least squares sense
+    for all the pixels at once: the pseudo-inverse of the sigma matrix is calculated once and applied to blocks of
+    chunk_size pixels, so the memory used does not depend on the number of pixels.
+
+    Parameters:
+    ===========
+    o_reso: Resonance object, its energy axis must be the one of the measured spectra
+    transmission: np.array (n_energy, ...) of measured transmission, ex: (n_energy, 512, 512) image stack.
+       Can be a np.memmap, only one block of pixels is read at a time.
+    components: list of 'layer/element/isotope' strings (default is None -> every isotope of the stack, once,
+       see get_sigma_components)
+    chunk_size: int (default is 65536). number of pixels solved at once
+    processes: int (default is None). number of processes sharing the blocks of pixels, None or 1 -> the blocks
+       are solved in the current process
+    min_transmission: float (default is 1e-6). transmission values are clipped to this minimum before the log
+
+    Returns:
+    ========
+    {'components': list of components,
+     'areal_density': np.array (n_components, ...) in atoms/cm2}
+
+    Raises:
+    =======
+    ValueError if the first dimension of transmission is not the number of energies of o_reso
+    """
+    components, sigma = get_sigma_components(o_reso=o_reso, components=components)
+    _nbr_energy = sigma.shape[1]
+    if np.shape(transmission)[0] != _nbr_energy:
+        raise ValueError("Transmission should have {} energies along its first axis!".format(_nbr_energy))
+    _pixel_shape = np.shape(transmission)[1:]
+    _data = np.reshape(transmission, (_nbr_energy, -1))
+    _nbr_pixels = _data.shape[1]
+
+    # atoms/cm2 = pinv(sigma_b.T * 1e-24) @ -ln(T)
+    _solver = np.linalg.pinv(sigma.T) * 1e24
+    areal_density = np.empty((len(components), _nbr_pixels))
+    _list_blocks = [(_start, min(_start + chunk_size, _nbr_pixels)) for _start in range(0, _nbr_pixels, chunk_size)]
+
+    if processes is None or processes <= 1 or len(_list_blocks) <= 1:
+        for _start, _stop in _list_blocks:
+            areal_density[:, _start:_stop] = _solve_block(solver=_solver, transmission=_data[:, _start:_stop],
+                                                          min_transmission=min_transmission)
+    else:
+        from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            _pending = {}
+            for _start, _stop in _list_blocks:
+                # at most 2 blocks per process are in flight, to bound the memory used
+                while len(_pending) >= 2 * processes:
+                    _done, _ = wait(_pending, return_when=FIRST_COMPLETED)
+                    for _future in _done:
+                        _block_start, _block_stop = _pending.pop(_future)
+                        areal_density[:, _block_start:_block_stop] = _future.result()
+                _future = executor.submit(_solve_block, solver=_solver,
+                                          transmission=np.array(_data[:, _start:_stop]),
+                                          min_transmission=min_transmission)
+                _pending[_future] = (_start, _stop)
+            for _future, (_block_start, _block_stop) in _pending.items():
+                areal_density[:, _block_start:_block_stop] = _future.result()
+
+    return {'components': components,
+            'areal_density': areal_density.reshape((len(components),) + tuple(_pixel_shape))}
+
+
+class TransmissionModel(object):
+    """total transmission of the stack of a Resonance object as a function of layer thickness, layer density,
+    isotopic ratios and beam normalization, with its analytic Jacobian
+
+    The model is
+
+        model(E) = norm * exp(-mu(E)) + background
+        mu(E) = sum_layers(thickness_cm * Avogadro * density / molar_mass * 1e-24 *
+                           sum_elements(stoichiometric_ratio * sum_isotopes(isotopic_ratio * sigma_b_raw(E))))
+
+    where the molar mass of an element whose isotopic ratios are fitted is sum_isotopes(isotopic_ratio * mass).
+    The isotopic ratio parameters are weights: the ratios of an element whose ratios are fitted are its weights
+    divided by their sum, so they always sum to 1. The isotopes of the element that are not fitted keep their
+    ratio of the Resonance object as weight (the reference the fitted weights are relative to), so at least one
+    isotope of the element must not be fitted. The density of a layer is held at the value of the Resonance object
+    (or at its fitted value): unlike Resonance.set_isotopic_ratio, which also recalculates the density of the
+    layers whose density is not locked, changing isotopic ratios does not change the density of the layer. Only the
+    sigma_b_raw of the Resonance object are used: evaluating the model or its Jacobian does not access any file.
+    """
+
+    def __init__(self, o_reso, thickness=(), density=(), isotopic_ratio=(), norm=False, background=False):
+        """
+        :param o_reso: Resonance object defining the stack, the energy axis and the starting values
+        :type o_reso: Resonance
+        :param thickness: names of the layers whose thickness (in the units of the layer) is fitted
+        :type thickness: list
+        :param density: names of the layers whose density (g/cm3) is fitted
+        :type density: list
+        :param isotopic_ratio: 'layer/element/isotope' of the isotopes whose isotopic ratio is fitted, not every
+            isotope of an element
+        :type isotopic_ratio: list
+        :param norm: True -> fit a scale factor of the transmission (starting at 1)
+        :type norm: bool
+        :param background: True -> fit an offset of the transmission (starting at 0)
+        :type background: bool
+
+        :raises ValueError: if a layer or an isotope can not be found in the stack
+        :raises ValueError: if the ratios of every isotope of an element are fitted
+        """
+        _stack = o_reso.stack
+        self.energy_eV = o_reso.energy_eV
+        self.params = []
+        x0 = []
+        lower = []
+        upper = []
+        self.__layers = []
+
+        _fitted_ratio = {}
+        for _name in isotopic_ratio:
+            _path = _name.split('/')
+            if len(_path) != 3 or _path[0] not in _stack or _path[1] not in _stack[_path[0]]['elements'] \
+                    or _path[2] not in _stack[_path[0]][_path[1]]['isotopes']['list']:
+                raise ValueError("Isotope '{}' could not be find in the stack (format: 'layer/element/isotope')".format(
+                    _name))
+            _fitted_ratio[tuple(_path)] = None
+        for _compound, _element in set(_path[:2] for _path in _fitted_ratio):
+            if all((_compound, _element, _iso) in _fitted_ratio
+                   for _iso in _stack[_compound][_element]['isotopes']['list']):
+                raise ValueError("The isotopic ratio of at least one isotope of '{}/{}' must not be fitted, the "
+                                 "ratios are relative to it".format(_compound, _element))
+        for _compound in list(thickness) + list(density):
+            if _compound not in _stack:
+                list_compounds_joined = ', '.join(_stack.keys())
+                raise ValueError("Compound '{}' could not be find in {}".format(_compound, list_compounds_joined))
+
+        for _compound in _stack.keys():
+            _layer = {'thickness_param': None, 'density_param': None}
+            _layer['cm_per_unit'] = _utilities.set_distance_units(value=1.,
+                                                                  from_units=_stack[_compound]['thickness']['units'],
+                                                                  to_units='cm')
+            _layer['thickness'] = _stack[_compound]['thickness']['value']
+            _layer['density'] = _stack[_compound]['density']['value']
+            if _compound in thickness:
+                _layer['thickness_param'] = len(self.params)
+                self.params.append('thickness/' + _compound)
+                x0.append(_layer['thickness'])
+                lower.append(0.)
+                upper.append(np.inf)
+            if _compound in density:
+                _layer['density_param'] = len(self.params)
+                self.params.append('density/' + _compound)
+                x0.append(_layer['density'])
+                lower.append(0.)
+                upper.append(np.inf)
+
+            # one row per isotope of the layer
+            _list_sigma = []
+            _row_stoichio = []
+            _row_ratio = []
+            _row_mass = []
+            _row_param = []
+            _row_element = []
+            _row_name = []
+            _elements = _stack[_compound]['elements']
+            _element_molar_mass = []
+            _element_from_ratio = []
+            for _index_element, (_element, _stoichio) in enumerate(zip(_elements,
+                                                                       _stack[_compound]['stoichiometric_ratio'])):
+                _isotopes = _stack[_compound][_element]['isotopes']
+                _from_ratio = False
+                for _iso, _ratio, _mass in zip(_isotopes['list'], _isotopes['isotopic_ratio'],
+                                               _isotopes['mass']['value']):
+                    _list_sigma.append(o_reso.stack_sigma[_compound][_element][_iso]['sigma_b_raw'])
+                    _row_stoichio.append(_stoichio)
+                    _row_ratio.append(_ratio)
+                    _row_mass.append(_mass)
+                    _row_element.append(_index_element)
+                    _row_name.append('/'.join([_compound, _element, _iso]))
+                    if (_compound, _element, _iso) in _fitted_ratio:
+                        _from_ratio = True
+                        _row_param.append(len(self.params))
+                        self.params.append('isotopic_ratio/{}/{}/{}'.format(_compound, _element, _iso))
+                        x0.append(_ratio)
+                        lower.append(0.)
+                        upper.append(np.inf)
+                    else:
+                        _row_param.append(-1)
+                _element_molar_mass.append(_stack[_compound][_element]['molar_mass']['value'])
+                _element_from_ratio.append(_from_ratio)
+
+            _layer['sigma'] = np.vstack(_list_sigma)
+            _layer['stoichio'] = np.array(_row_stoichio, dtype=np.float64)
+            _layer['ratio'] = np.array(_row_ratio, dtype=np.float64)
+            _layer['mass'] = np.array(_row_mass, dtype=np.float64)
+            _layer['param'] = np.array(_row_param, dtype=np.intp)
+            _layer['element'] = np.array(_row_element, dtype=np.intp)
+            _layer['name'] = _row_name
+            _layer['element_molar_mass'] = np.array(_element_molar_mass, dtype=np.float64)
+            _layer['element_from_ratio'] = np.array(_element_from_ratio, dtype=bool)
+            # rows whose mass contributes to the molar mass of the layer
+            _layer['mass_rows'] = _layer['element_from_ratio'][_layer['element']]
+            self.__layers.append(_layer)
+
+        self.__norm_param = None
+        self.__background_param = None
+        if norm:
+            self.__norm_param = len(self.params)
+            self.params.append('norm')
+            x0.append(1.)
+            lower.append(0.)
+            upper.append(np.inf)
+        if background:
+            self.__background_param = len(self.params)
+            self.params.append('background')
+            x0.append(0.)
+            lower.append(-np.inf)
+            upper.append(np.inf)
+
+        self.x0 = np.array(x0, dtype=np.float64)
+        self.bounds = (np.array(lower), np.array(upper))
+        self.__last = None
+
+    def __get_ratios(self, layer, x):
+        """return (ratios, sums of the weights per element) of the rows of a layer, the ratios of the elements
+        whose ratios are fitted are normalized"""
+        _fitted = layer['param'] >= 0
+        _ratio = layer['ratio'].copy()
+        _ratio[_fitted] = x[layer['param'][_fitted]]
+        _weight_sum = np.bincount(layer['element'], weights=_ratio, minlength=len(layer['element_molar_mass']))
+        _rows = layer['mass_rows']
+        _ratio[_rows] /= _weight_sum[layer['element'][_rows]]
+        return _ratio, _weight_sum
+
+    def isotopic_ratio(self, x):
+        """return the isotopic ratios {'layer/element/isotope': ratio} of every isotope of the elements whose
+        ratios are fitted, for the parameter values x (they sum to 1 per element)"""
+        x = np.asarray(x, dtype=np.float64)
+        ratios = {}
+        for _layer in self.__layers:
+            _ratio, _ = self.__get_ratios(layer=_layer, x=x)
+            for _row in np.flatnonzero(_layer['mass_rows']):
+                ratios[_layer['name'][_row]] = float(_ratio[_row])
+        return ratios
+
+    def __evaluate(self, x):
+        """return (model, jacobian) at x, the last evaluation is kept as the model and its Jacobian are
+        requested one after the other at the same point by the optimizers"""
+        x = np.asarray(x, dtype=np.float64)
+        if self.__last is not None and np.array_equal(self.__last[0], x):
+            return self.__last[1], self.__last[2]
+
+        _nbr_energy = len(self.energy_eV)
+        _mu = np.zeros(_nbr_energy)
+        _d_mu = np.zeros((len(self.params), _nbr_energy))
+        for _layer in self.__layers:
+            _thickness = _layer['thickness'] if _layer['thickness_param'] is None else x[_layer['thickness_param']]
+            _density = _layer['density'] if _layer['density_param'] is None else x[_layer['density_param']]
+            _thickness_cm = _thickness * _layer['cm_per_unit']
+            _fitted = _layer['param'] >= 0
+            _ratio, _weight_sum = self.__get_ratios(layer=_layer, x=x)
+
+            # molar mass of the layer
+            _element_molar_mass = _layer['element_molar_mass'].copy()
+            if _layer['element_from_ratio'].any():
+                _mass_from_ratio = np.bincount(_layer['element'], weights=_ratio * _layer['mass'],
+                                               minlength=len(_element_molar_mass))
+                _element_molar_mass[_layer['element_from_ratio']] = _mass_from_ratio[_layer['element_from_ratio']]
+            _stoichio_element = np.bincount(_layer['element'], weights=_layer['stoichio'],
+                                            minlength=len(_element_molar_mass)) / \
+                np.bincount(_layer['element'], minlength=len(_element_molar_mass))
+            _molar_mass = np.sum(_stoichio_element * _element_molar_mass)
+
+            # mu_layer = thickness_cm * k * s_layer
+            _k = _utilities.Avogadro * _density / _molar_mass * 1e-24
+            _s_layer = (_layer['stoichio'] * _ratio) @ _layer['sigma']
+            _mu_layer = _thickness_cm * _k * _s_layer
+            _mu += _mu_layer
+
+            if _layer['thickness_param'] is not None:
+                _d_mu[_layer['thickness_param']] += _layer['cm_per_unit'] * _k * _s_layer
+            if _layer['density_param'] is not None:
+                _d_mu[_layer['density_param']] += _mu_layer / _density
+            if _fitted.any():
+                # d(mu_layer)/d(ratio) = thickness_cm * k * (stoichio * sigma - s_layer * stoichio * mass / molar_mass)
+                _rows = np.flatnonzero(_layer['mass_rows'])
+                _d_ratio = _thickness_cm * _k * _layer['stoichio'][_rows, None] * \
+                    (_layer['sigma'][_rows] - _s_layer * (_layer['mass'][_rows] / _molar_mass)[:, None])
+                # ratio = weight / sum(weights of the element): d(ratio_j)/d(weight_i) = (delta_ij - ratio_j) / sum
+                _element = _layer['element'][_rows]
+                _d_ratio_element = np.zeros((len(_layer['element_molar_mass']), _nbr_energy))
+                np.add.at(_d_ratio_element, _element, _ratio[_rows, None] * _d_ratio)
+                for _row in np.flatnonzero(_fitted):
+                    _index_element = _layer['element'][_row]
+                    _d_mu[_layer['param'][_row]] += (_d_ratio[np.searchsorted(_rows, _row)] -
+                                                     _d_ratio_element[_index_element]) / _weight_sum[_index_element]
+
+        _transmission = np.exp(-_mu)
+        _norm = 1. if self.__norm_param is None else x[self.__norm_param]
+        _background = 0. if self.__background_param is None else x[self.__background_param]
+        model = _norm * _transmission + _background
+        jacobian = -_norm * _transmission * _d_mu
+        if self.__norm_param is not None:
+            jacobian[self.__norm_param] = _transmission
+        if self.__background_param is not None:
+            jacobian[self.__background_param] = 1.
+        jacobian = jacobian.T
+        self.__last = (x.copy(), model, jacobian)
+        return model, jacobian
+
+    def transmission(self, x):
+        """return the modelled transmission (n_energy) for the parameter values x (in the order of params)"""
+        return self.__evaluate(x)[0]
+
+    def jacobian(self, x):
+        """return the derivatives (n_energy, n_params) of the modelled transmission for the parameter values x"""
+        return self.__evaluate(x)[1]
+
+
+def fit_transmission(o_reso, transmission, thickness=(), density=(), isotopic_ratio=(), norm=False,
+                     background=False, **kwargs):
+    """fit layer thickness, layer density, isotopic ratios and beam normalization to a measured transmission
+
+    The fit uses scipy.optimize.least_squares with the analytic Jacobian of TransmissionModel, starting from the
+    values of the stack of o_reso (which is not modified).
+
+    Parameters:
+    ===========
+    o_reso: Resonance object, its energy axis must be the one of the measured spectrum
+    transmission: np.array (n_energy) of measured transmission
+    thickness: list of layers whose thickness (in the units of the layer) is fitted
+    density: list of layers whose density (g/cm3) is fitted
+    isotopic_ratio: list of 'layer/element/isotope' whose isotopic ratio is fitted
+    norm: boolean. True -> fit a scale factor of the transmission
+    background: boolean. True -> fit an offset of the transmission
+    kwargs: passed to scipy.optimize.least_squares
+
+    Returns:
+    ========
+    {'thickness': {layer: value}, 'density': {layer: value}, 'isotopic_ratio': {'layer/element/isotope': value},
+     'norm': value, 'background': value, 'success': bool, 'cost': float, 'nfev': int, 'njev': int}
+    where only the fitted parameters are reported, 'isotopic_ratio' holding the ratios of every isotope of the
+    elements whose ratios are fitted (they sum to 1 per element, see Resonance.set_isotopic_ratio)
+
+    Raises:
+    =======
+    ValueError if transmission does not have the number of energies of o_reso
+    ValueError if no parameter is fitted
+    """
+    from scipy.optimize import least_squares
+
+    transmission = np.asarray(transmission, dtype=np.float64)
+    if transmission.shape != (len(o_reso.energy_eV),):
+        raise ValueError("Transmission should have {} energies!".format(len(o_reso.energy_eV)))
+    model = TransmissionModel(o_reso=o_reso, thickness=thickness, density=density, isotopic_ratio=isotopic_ratio,
+                              norm=norm, background=background)
+    if len(model.params) == 0:
+        raise ValueError("Please specify at least one parameter to fit!")
+
+    _result = least_squares(lambda x: model.transmission(x) - transmission, model.x0, jac=model.jacobian,
+                            bounds=model.bounds, **kwargs)
+
+    fitted = {'thickness': {}, 'density': {}, 'isotopic_ratio': {}}
+    for _name, _value in zip(model.params, _result.x):
+        _kind, _, _target = _name.partition('/')
+        if _kind == 'isotopic_ratio':
+            continue
+        if _target:
+            fitted[_kind][_target] = _value
+        else:
+            fitted[_kind] = _value
+    fitted['isotopic_ratio'] = model.isotopic_ratio(_result.x)
+    fitted['success'] = _result.success
+    fitted['cost'] = _result.cost
+    fitted['nfev'] = _result.nfev
+    fitted['njev'] = _result.njev
+    return fitted
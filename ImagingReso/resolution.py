@@ -0,0 +1,169 @@
+import numpy as np
+
+from ImagingReso import _cache
+from ImagingReso import _utilities
+
+
+def ikeda_carpenter(t_us, alpha_us=0.5, beta_us=0.05, r=0.3):
+    """return the Ikeda-Carpenter moderator pulse shape (normalized to 1) at the times t_us
+
+    f(t) = alpha / 2 * ((1 - r) * (alpha t)^2 exp(-alpha t)
+                        + 2 r alpha^2 beta / (alpha - beta)^3 * (exp(-beta t)
+                                                                - exp(-alpha t) (1 + d t + (d t)^2 / 2)))
+    with d = alpha - beta and f(t) = 0 for t < 0
+
+    Parameters:
+    ===========
+    t_us: array of times in us, relative to the emission of the pulse
+    alpha_us: float (default 0.5). inverse of the slowing down time in 1/us
+    beta_us: float (default 0.05). inverse of the storage (decay) time in 1/us, must be different from alpha_us
+    r: float (default 0.3). fraction of the storage component, between 0 and 1
+
+    Returns:
+    ========
+    array of the pulse shape in 1/us
+    """
+    t_us = np.asarray(t_us, dtype=np.float64)
+    _t = np.maximum(t_us, 0.)
+    _d = alpha_us - beta_us
+    _slowing_down = (1. - r) * (alpha_us * _t) ** 2 * np.exp(-alpha_us * _t)
+    _storage = 2. * r * alpha_us ** 2 * beta_us / _d ** 3 * \
+        (np.exp(-beta_us * _t) - np.exp(-alpha_us * _t) * (1. + _d * _t + (_d * _t) ** 2 / 2.))
+    return np.where(t_us >= 0, alpha_us / 2. * (_slowing_down + _storage), 0.)
+
+
+def _get_kernel_size(time_resolution_us, alpha_us, beta_us, tolerance=1e-6):
+    """return the number of bins of the kernel, up to the decay of the slower tail of the pulse below tolerance"""
+    _t_max = -np.log(tolerance) / min(alpha_us, beta_us) + 20. / alpha_us
+    return int(np.ceil(_t_max / time_resolution_us)) + 1
+
+
+def get_kernel(time_resolution_us, alpha_us=0.5, beta_us=0.05, r=0.3, tolerance=1e-6):
+    """return the Ikeda-Carpenter pulse integrated over bins of time_resolution_us, normalized to a sum of 1
+
+    Bin k covers [(k - 1/2), (k + 1/2)] * time_resolution_us (bin 0 starts at 0). The kernel stops when the
+    slower of the two exponential tails has decayed below tolerance.
+
+    Parameters:
+    ===========
+    time_resolution_us: float. width of the time bins in us
+    alpha_us, beta_us, r: floats. parameters of the Ikeda-Carpenter pulse (see ikeda_carpenter)
+    tolerance: float (default 1e-6). relative amplitude of the tail left out of the kernel
+
+    Returns:
+    ========
+    kernel array
+    """
+    _nbr_bins = _get_kernel_size(time_resolution_us=time_resolution_us, alpha_us=alpha_us, beta_us=beta_us,
+                                 tolerance=tolerance)
+    # 16 samples per bin integrate the pulse accurately whatever the bin width
+    _nbr_samples = 16
+    _t = (np.arange(_nbr_bins * _nbr_samples) + 0.5) / _nbr_samples * time_resolution_us - time_resolution_us / 2.
+    kernel = ikeda_carpenter(t_us=_t, alpha_us=alpha_us, beta_us=beta_us, r=r).reshape(_nbr_bins,
+                                                                                      _nbr_samples).sum(axis=1)
+    return kernel / kernel.sum()
+
+
+def get_kernel_fft(source_to_detector_m, offset_us, time_resolution_us, nbr_points, alpha_us=0.5, beta_us=0.05,
+                   r=0.3):
+    """return the real Fourier transform of the resolution kernel padded to nbr_points
+
+    The transform is kept in the process-wide resolution kernel cache (see ImagingReso._cache), keyed by
+    (source_to_detector_m, offset_us, time_resolution_us, alpha_us, beta_us, r, nbr_points), so a fit convolving
+    many spectra of the same instrument computes it once.
+
+    Returns:
+    ========
+    {'kernel_fft': complex array of nbr_points // 2 + 1 values, 'kernel': kernel array}
+    """
+    _key = ('resolution', float(source_to_detector_m), float(offset_us), float(time_resolution_us),
+            float(alpha_us), float(beta_us), float(r), int(nbr_points))
+    _cached = _cache.resolution_kernel_cache.get(_key)
+    if _cached is not None:
+        return _cached
+    kernel = get_kernel(time_resolution_us=time_resolution_us, alpha_us=alpha_us, beta_us=beta_us, r=r)
+    return _cache.resolution_kernel_cache.put(_key, {'kernel_fft': np.fft.rfft(kernel, n=nbr_points),
+                                                     'kernel': kernel})
+
+
+def convolve_signal(energy_eV, signal, source_to_detector_m, offset_us, time_resolution_us, alpha_us=0.5,
+                    beta_us=0.05, r=0.3):
+    """convolve a signal (transmission, attenuation...) with the resolution function of a time-of-flight instrument
+
+    The signal is resampled on a uniform time-of-flight grid of time_resolution_us (each bin is the average of the
+    signal over its width) and convolved, using FFTs, with the Ikeda-Carpenter moderator pulse integrated over the
+    same bins. Times before the first bin are assumed to see the signal of the first bin.
+
+    Parameters:
+    ===========
+    energy_eV: array of energies in eV of the signal
+    signal: array of the signal at energy_eV
+    source_to_detector_m: float. Distance source to detector in m
+    offset_us: float. Delay of detector in us
+    time_resolution_us: float. width of the time bins in us
+    alpha_us, beta_us, r: floats. parameters of the Ikeda-Carpenter pulse (see ikeda_carpenter)
+
+    Returns:
+    ========
+    {'time_us': array of the centers of the time bins (time recorded by the detector, increasing),
+     'energy_eV': array of the energies of the centers of the time bins (decreasing),
+     'signal': array of the convolved signal}
+
+    Raises:
+    =======
+    ValueError if energy_eV and signal do not have the same size or if time_resolution_us <= 0
+    """
+    energy_eV = np.asarray(energy_eV, dtype=np.float64)
+    signal = np.asarray(signal, dtype=np.float64)
+    if energy_eV.shape != signal.shape or energy_eV.ndim != 1:
+        raise ValueError("Energy and signal must be 1D arrays of the same size!")
+    if not time_resolution_us > 0:
+        raise ValueError("Time resolution must be > 0!")
+
+    # signal averaged over the time bins, from its cumulative integral over time
+    _time_us = _utilities.ev_to_s(offset_us=offset_us, source_to_detector_m=source_to_detector_m,
+                                  array=energy_eV) * 1e6
+    _order = np.argsort(_time_us)
+    _time_us = _time_us[_order]
+    _signal = signal[_order]
+    _cumulative = np.concatenate([[0.], np.cumsum(np.diff(_time_us) * (_signal[1:] + _signal[:-1]) / 2.)])
+    _nbr_bins = max(int(np.floor((_time_us[-1] - _time_us[0]) / time_resolution_us)), 1)
+    _edges = _time_us[0] + time_resolution_us * np.arange(_nbr_bins + 1)
+    _signal_bins = np.diff(np.interp(_edges, _time_us, _cumulative)) / time_resolution_us
+    time_us = _edges[:-1] + time_resolution_us / 2.
+
+    _nbr_kernel = _get_kernel_size(time_resolution_us=time_resolution_us, alpha_us=alpha_us, beta_us=beta_us)
+    _padded = np.concatenate([np.full(_nbr_kernel - 1, _signal_bins[0]), _signal_bins])
+    _nbr_points = 1 << int(np.ceil(np.log2(len(_padded) + _nbr_kernel - 1)))
+    _kernel_fft = get_kernel_fft(source_to_detector_m=source_to_detector_m, offset_us=offset_us,
+                                 time_resolution_us=time_resolution_us, nbr_points=_nbr_points, alpha_us=alpha_us,
+                                 beta_us=beta_us, r=r)['kernel_fft']
+    _convolved = np.fft.irfft(np.fft.rfft(_padded, n=_nbr_points) * _kernel_fft, n=_nbr_points)
+    return {'time_us': time_us,
+            'energy_eV': _utilities.s_to_ev(offset_us=offset_us, source_to_detector_m=source_to_detector_m,
+                                            array=time_us * 1e-6),
+            'signal': _convolved[_nbr_kernel - 1:_nbr_kernel - 1 + _nbr_bins]}
+
+
+def convolve_resonance(o_reso, source_to_detector_m, offset_us, time_resolution_us, y_axis='transmission',
+                       alpha_us=0.5, beta_us=0.05, r=0.3):
+    """convolve the total signal of a Resonance object with the resolution function of a time-of-flight instrument
+
+    Parameters:
+    ===========
+    o_reso: Resonance object
+    source_to_detector_m: float. Distance source to detector in m
+    offset_us: float. Delay of detector in us
+    time_resolution_us: float. width of the time bins in us
+    y_axis: string (default 'transmission'). ['transmission'|'attenuation']
+    alpha_us, beta_us, r: floats. parameters of the Ikeda-Carpenter pulse (see ikeda_carpenter)
+
+    Returns:
+    ========
+    {'time_us', 'energy_eV', 'signal'} (see convolve_signal)
+    """
+    if y_axis not in ['transmission', 'attenuation']:
+        raise ValueError("y_axis must be either ['transmission'|'attenuation']")
+    return convolve_signal(energy_eV=o_reso.energy_eV, signal=o_reso.total_signal[y_axis],
+                           source_to_detector_m=source_to_detector_m, offset_us=offset_us,
+                           time_resolution_us=time_resolution_us, alpha_us=alpha_us, beta_us=beta_us, r=r)
@@ -1,31 +1,23 @@
 import json
-import os
+import numbers
 
-import matplotlib.pyplot as plt
 import numpy as np
-import pandas as pd
 
 from ImagingReso import _utilities
-import plotly.tools as tls
+from ImagingReso import shared
 
 
 class Resonance(object):
     e_min = 1e-5
     e_max = 1e8
 
-    stack = {}  # compound, thickness, atomic_ratio of each layer with isotopes information
-    stack_sigma = {}  # all the energy and sigma of the isotopes and compounds
-    stack_signal = {}  # transmission and attenuation signal for every isotope and compound
-    total_signal = {}  # transmission and attenuation of the entire sample
-
-    density_lock = {}  # dictionary that will defined the densities locked
-
     energy_max = np.nan
     energy_min = np.nan
     energy_step = np.nan
+    energy_scale = 'linear'
 
     def __init__(self, stack={}, energy_max=1, energy_min=0.001, energy_step=0.001,
-                 database='ENDF_VII', temperature='294K'):
+                 database='ENDF_VII', temperature='294K', energy_scale='linear', energy_grid=None, max_workers=None):
         """initialize resonance object
 
         :param stack: dictionary to store sample info
@@ -48,11 +40,32 @@ class Resonance(object):
         :type energy_min: float
 
         :param energy_step: (default 0.1) energy step to use in extrapolation of sigma data
+                            when energy_scale='log', relative step (dE/E) between consecutive energies
+                            when energy_scale='adaptive', tolerance on the total transmission
         :type energy_step: float
 
         :param database: database to extract cross-section info. ['ENDF_VII', 'ENDF_VIII'], both are database at 294K
         :type database: str
 
+        :param temperature: (default '294K') temperature of the sample, ex: '600K' or 600. The cross-sections are
+                            Doppler broadened from the 294K of the database. Must be >= 294K
+        :type temperature: str or float
+
+        :param energy_scale: (default 'linear') spacing of the energy axis. Must be either ['linear'|'log'|'adaptive']
+                             'adaptive' -> the energy axis is made of the energies of the database files of every
+                             isotope of the stack, thinned to describe the total transmission within a tolerance
+                             given by energy_step. It is rebuilt (and every layer recalculated) when a layer is added
+                             or isotopic ratios are changed. Without layers, the axis is [energy_min, energy_max].
+        :type energy_scale: str
+
+        :param energy_grid: (default None) strictly increasing energy axis in eV to use in calculation.
+                            If provided, energy_min, energy_max, energy_step and energy_scale are ignored.
+        :type energy_grid: np.array
+
+        :param max_workers: (default None) number of threads loading and interpolating the database files of the
+                            isotopes of the stack. None or 1 -> files are processed one after the other
+        :type max_workers: int
+
         """
         if database not in ['ENDF_VII', 'ENDF_VIII', '_data_for_unittest']:
             raise ValueError(
@@ -65,7 +78,38 @@ class Resonance(object):
             pass
 
         self.database = database
+
+        if max_workers is not None and (not isinstance(max_workers, numbers.Integral) or max_workers < 1):
+            raise ValueError("Number of workers must be an integer >= 1!")
+        self.max_workers = max_workers
+        self.t_kelvin = _utilities.get_temperature_kelvin(temperature=temperature)
+
+        # every dictionary below is owned by the instance: nothing is shared between Resonance objects
+        self.stack = {}  # compound, thickness, atomic_ratio of each layer with isotopes information
+        self.stack_sigma = {}  # all the energy and sigma of the isotopes and compounds
+        self.stack_signal = {}  # transmission and attenuation signal for every isotope and compound
+        self.total_signal = {}  # transmission and attenuation of the entire sample
+        self.density_lock = {}  # dictionary that will defined the densities locked
         self.__element_metadata = {}
+        self.__dirty_layers = set()  # layers whose sigma, density and signals need to be (re)calculated
+        self.__sigma_matrix = np.empty((0, 0))  # raw sigma of every isotope of the stack (n_isotopes x n_energy)
+        self.__layer_rows = {}  # rows of the sigma matrix belonging to each layer
+        self.__element_rows = {}  # rows of the sigma matrix belonging to each element of each layer
+        self.__layer_weights = {}  # isotopic_ratio * atoms_per_cm3 * 1e-24 of the rows of each layer
+
+        if energy_grid is not None:
+            energy_grid = np.array(energy_grid, dtype=np.float64)
+            if energy_grid.ndim != 1 or len(energy_grid) < 2:
+                raise ValueError("Energy grid must be a 1D array of at least 2 energies!")
+            if np.any(np.diff(energy_grid) <= 0):
+                raise ValueError("Energy grid must be strictly increasing!")
+            energy_min = energy_grid[0]
+            energy_max = energy_grid[-1]
+            energy_step = np.nan
+            energy_scale = 'custom'
+        elif energy_scale not in _utilities.energy_scale_list + ['adaptive']:
+            raise ValueError("Please specify the energy scale using one from '{}'.".format(
+                _utilities.energy_scale_list + ['adaptive']))
 
         if energy_min < self.e_min:
             raise ValueError("Energy min (eV) must be >= {}".format(self.e_min))
@@ -78,12 +122,30 @@ class Resonance(object):
         if energy_min == energy_max:
             raise ValueError("Energy min and max should not have the same value!")
 
-        if (energy_max - energy_min) < energy_step:
+        if energy_scale == 'linear' and (energy_max - energy_min) < energy_step:
             raise ValueError("Energy step is bigger than range of energy specified!")
+        if energy_scale == 'log' and not energy_step > 0:
+            raise ValueError("Relative energy step must be > 0!")
+        if energy_scale == 'adaptive' and not energy_step > 0:
+            raise ValueError("Transmission tolerance must be > 0!")
 
         self.energy_step = energy_step
+        self.energy_scale = energy_scale
+        if energy_scale == 'adaptive':
+            # built from the isotopes of the stack, the transmission of an empty stack is flat: the limits are enough
+            energy_grid = np.array([energy_min, energy_max], dtype=np.float64)
+            energy_grid.flags.writeable = False
+        else:
+            if energy_grid is None:
+                energy_grid = _utilities.get_energy_grid(e_min=energy_min, e_max=energy_max, e_step=energy_step,
+                                                         scale=energy_scale)
+            energy_grid.flags.writeable = False
+        self.__energy_grid = energy_grid
 
         if not stack == {}:
+            # the stack given is adopted (and completed in place) by the instance, it should not be shared
+            # between instances
+
             # checking that every element of each stack is defined
             _utilities.checking_stack(stack=stack, database=self.database)
             new_stack = self.__update_stack_with_isotopes_infos(stack=stack)
@@ -93,8 +155,14 @@ class Resonance(object):
             self.__lock_density_if_defined(stack=self.stack)
 
             # calculate stack_sigma, layer density, atoms_per_cm3 ...
+            self.__dirty_layers = set(self.stack.keys())
             self.__math_on_stack()
 
+    @property
+    def energy_eV(self):
+        """energy axis (eV) shared by every sigma and signal of the stack (read-only array)"""
+        return self.__energy_grid
+
     def __str__(self):
         """what to display if user does
 
@@ -136,7 +204,8 @@ class Resonance(object):
         new_stack = self.__update_stack_with_isotopes_infos(stack=_new_stack)
         self.stack = {**self.stack, **new_stack}
 
-        # calculate stack_sigma, layer density, atoms_per_cm3 ...
+        # calculate stack_sigma, layer density, atoms_per_cm3 ... of the new layer only
+        self.__dirty_layers.update(new_stack.keys())
         self.__math_on_stack()
 
     def get_isotopic_ratio(self, compound='', element=''):
@@ -232,8 +301,16 @@ class Resonance(object):
         self.__update_molar_mass(compound=compound, element=element)
         self.__update_density(compound=compound, element=element)
 
-        # update entire stack
-        self.__math_on_stack()
+        if self.energy_scale == 'adaptive':
+            # the resonances to describe within the tolerance have changed, the energy axis is rebuilt
+            self.__dirty_layers.update(self.stack.keys())
+            self.__math_on_stack()
+            return
+
+        # reweight the raw sigma already loaded and update the signal of the layer holding the element
+        self.__update_element_sigma(compound=compound, element=element)
+        self.__calculate_atoms_per_cm3(compounds=[compound])
+        self.__calculate_transmission_attenuation(compounds=[compound])
 
     def get_density(self, compound='', element=''):
         """returns the list of isotopes for the element of the compound defined with their density
@@ -278,24 +355,115 @@ class Resonance(object):
 
         return _stack[compound][element]['density']['value']
 
+    def calculate_transmission_batch(self, thickness=None, density=None):
+        """calculate the total transmission of the sample for many thickness and/or density values at once
+
+        Each layer contributes one broadcasted exp(-outer(thickness * atoms_per_cm3, sigma)) product, the stack
+        itself is left untouched.
+
+        Parameters:
+        ===========
+        thickness: dictionary (default is None) of thickness values per layer, in the units of the layer
+           ex: {'CoAg': np.linspace(0.01, 0.1, 100)}
+        density: dictionary (default is None) of density values (g/cm3) per layer
+           ex: {'CoAg': [8.9, 9.0]}
+        layers not listed keep their current thickness and density. Scalars are broadcast to the number
+        of samples.
+
+        Returns:
+        ========
+        transmission array (n_samples, n_energy)
+
+        Raises:
+        =======
+        ValueError if a layer does not exist
+        ValueError if the arrays do not have the same number of samples
+        """
+        _stack = self.stack
+        if thickness is None:
+            thickness = {}
+        if density is None:
+            density = {}
+
+        for _compound in list(thickness.keys()) + list(density.keys()):
+            if _compound not in _stack.keys():
+                list_compounds_joined = ', '.join(_stack.keys())
+                raise ValueError("Compound '{}' could not be find in {}".format(_compound, list_compounds_joined))
+
+        _list_values = [np.atleast_1d(np.asarray(_value, dtype=np.float64))
+                        for _value in list(thickness.values()) + list(density.values())]
+        _nbr_samples = max([len(_value) for _value in _list_values] + [1])
+        for _value in _list_values:
+            if len(_value) not in [1, _nbr_samples]:
+                raise ValueError("Thickness and density arrays should all have {} values!".format(_nbr_samples))
+
+        transmission = np.ones((_nbr_samples, len(self.__energy_grid)))
+        for _compound in _stack.keys():
+            _thickness = thickness.get(_compound, _stack[_compound]['thickness']['value'])
+            _thickness_cm = _utilities.set_distance_units(value=np.asarray(_thickness, dtype=np.float64),
+                                                          from_units=_stack[_compound]['thickness']['units'],
+                                                          to_units='cm')
+            if _compound in density:
+                _atoms_per_cm3 = _utilities.Avogadro * np.asarray(density[_compound], dtype=np.float64) / \
+                                 _stack[_compound]['molar_mass']['value']
+            else:
+                _atoms_per_cm3 = _stack[_compound]['atoms_per_cm3']
+
+            # sigma per atom of the layer
+            _weights_layer = np.concatenate(
+                [_stoichio * np.asarray(_stack[_compound][_element]['isotopes']['isotopic_ratio'], dtype=np.float64)
+                 for _element, _stoichio in zip(_stack[_compound]['elements'],
+                                                _stack[_compound]['stoichiometric_ratio'])])
+            _sigma_layer = _weights_layer @ self.__sigma_matrix[self.__layer_rows[_compound]]
+
+            transmission *= _utilities.calculate_transmission_batch(
+                thickness_cm=np.broadcast_to(_thickness_cm, (_nbr_samples,)),
+                atoms_per_cm3=np.broadcast_to(_atoms_per_cm3, (_nbr_samples,)),
+                sigma_b=_sigma_layer)
+        return transmission
+
     def __math_on_stack(self, used_lock=False):
         """will perform all the various update of the stack, such as populating the stack_sigma, caluclate the density of the
-        layers....etc. """
+        layers....etc. Only the layers flagged as dirty are recalculated, the total signal is then refreshed
+        from the signal of every layer."""
+        _dirty_layers = [_compound for _compound in self.stack.keys() if _compound in self.__dirty_layers]
+
+        if self.energy_scale == 'adaptive' and _dirty_layers:
+            # new layers bring new resonances, the adaptive energy axis is rebuilt for the whole stack:
+            # signals are first calculated on the union of the database energies then the points not needed
+            # to describe the total transmission within the tolerance (energy_step) are removed
+            _dirty_layers = list(self.stack.keys())
+            _union_grid = self.__get_union_energy_grid()
+            _union_grid.flags.writeable = False
+            self.__energy_grid = _union_grid
+            self.__math_on_layers(compounds=_dirty_layers, used_lock=used_lock)
+            _energy_grid = _utilities.thin_energy_grid(energy=_union_grid,
+                                                       signal=self.total_signal['transmission'],
+                                                       tolerance=self.energy_step)
+            _energy_grid.flags.writeable = False
+            self.__energy_grid = _energy_grid
+
+        self.__math_on_layers(compounds=_dirty_layers, used_lock=used_lock)
+        self.__dirty_layers.clear()
+
+    def __math_on_layers(self, compounds: list, used_lock=False):
+        """populate the stack_sigma, density, atoms_per_cm3 and signals of the given layers"""
+        _dirty_layers = compounds
 
         # populate stack_sigma (Sigma vs Energy for every element)
-        self.__get_sigmas()
+        self.__get_sigmas(compounds=_dirty_layers)
 
         # populate compound density (if none provided)
-        self.__update_layer_density()
+        self.__update_layer_density(compounds=_dirty_layers)
 
         # populate compound molar mass
         # self.__update_layer_molar_mass()  ### included in __calculate_atoms_per_cm3
 
         # populate atoms_per_cm3
-        self.__calculate_atoms_per_cm3(used_lock=used_lock)
+        self.__calculate_atoms_per_cm3(used_lock=used_lock, compounds=_dirty_layers)
 
         # calculate transmission and attenuation
-        self.__calculate_transmission_attenuation()
+        self.__calculate_transmission_attenuation(compounds=_dirty_layers)
 
     def __lock_density_if_defined(self, stack: dict):
         """lock (True) the density lock if the density has been been defined during initialization
@@ -320,83 +488,122 @@ class Resonance(object):
                 density_lock[_compound] = True
         self.density_lock = density_lock
 
-    def __calculate_transmission_attenuation(self):
-        """  """
-        stack = self.stack
-        stack_sigma = self.stack_sigma
-        stack_signal = {}
+    def __calculate_transmission_attenuation(self, compounds=None):
+        """define the signals of the given layers (all layers if None) and the total signal of the sample
 
-        total_signal = {}
-        total_transmisison = 1.
+        Every signal is obtained from the isotope x energy sigma matrix: the linear attenuation coefficient of an
+        element or a layer is the product of its isotope weights (isotopic ratio * atoms_per_cm3 * 1e-24) with the
+        rows of the matrix belonging to it, and the total transmission comes from a single product of the
+        thickness-weighted vector of all the layers with the whole matrix.
+        'mu_per_cm', 'transmission' and 'attenuation' are only calculated (and then kept) when accessed.
+        """
+        stack = self.stack
+        stack_signal = {**self.stack_signal}
+        if compounds is None:
+            compounds = stack.keys()
 
         # compound level
-        for _name_of_compound in stack.keys():
-            stack_signal[_name_of_compound] = {}
-            mu_per_cm_compound = 0
-            transmission_compound = 1.
-            energy_compound = []
-
+        for _name_of_compound in compounds:
             _list_element = stack[_name_of_compound]['elements']
             _thickness_cm = _utilities.set_distance_units(value=stack[_name_of_compound]['thickness']['value'],
                                                           from_units=stack[_name_of_compound]['thickness']['units'],
                                                           to_units='cm')
+            _signal_compound = _utilities.LazyDict()
+            _weights_compound = []
 
             # element level
             for _element in _list_element:
-                stack_signal[_name_of_compound][_element] = {}
                 _atoms_per_cm3 = stack[_name_of_compound][_element]['atoms_per_cm3']
+                _list_ratio = stack[_name_of_compound][_element]['isotopes']['isotopic_ratio']
+                _weights_iso = np.asarray(_list_ratio, dtype=np.float64) * _atoms_per_cm3 * 1e-24
+                _signal_element = _utilities.LazyDict()
 
                 # isotope level
-                for _iso in stack[_name_of_compound][_element]['isotopes']['list']:
-                    stack_signal[_name_of_compound][_element][_iso] = {}
-                    _sigma_iso = stack_sigma[_name_of_compound][_element][_iso]['sigma_b']
-                    _mu_per_cm_iso, _transmission_iso = _utilities.calculate_transmission(
-                        thickness_cm=_thickness_cm,
-                        atoms_per_cm3=_atoms_per_cm3,
-                        sigma_b=_sigma_iso)
-                    stack_signal[_name_of_compound][_element][_iso]['mu_per_cm'] = _mu_per_cm_iso
-                    stack_signal[_name_of_compound][_element][_iso]['transmission'] = _transmission_iso
-                    stack_signal[_name_of_compound][_element][_iso]['attenuation'] = 1. - _transmission_iso
-                    stack_signal[_name_of_compound][_element][_iso]['energy_eV'] = \
-                        stack_sigma[_name_of_compound][_element][_iso]['energy_eV']
-
-                _sigma_ele = stack_sigma[_name_of_compound][_element]['sigma_b']
-                _mu_per_cm_ele, _transmission_ele = _utilities.calculate_transmission(
-                    thickness_cm=_thickness_cm,
-                    atoms_per_cm3=_atoms_per_cm3,
-                    sigma_b=_sigma_ele)
-                stack_signal[_name_of_compound][_element]['mu_per_cm'] = _mu_per_cm_ele
-                stack_signal[_name_of_compound][_element]['transmission'] = _transmission_ele
-                stack_signal[_name_of_compound][_element]['attenuation'] = 1. - _transmission_ele
-                stack_signal[_name_of_compound][_element]['energy_eV'] = \
-                    stack_sigma[_name_of_compound][_element]['energy_eV']
-
-                mu_per_cm_compound += _mu_per_cm_ele  # plus
-                transmission_compound *= _transmission_ele  # multiply
-                if len(energy_compound) == 0:
-                    energy_compound = stack_sigma[_name_of_compound][_element]['energy_eV']
-
-            stack_signal[_name_of_compound]['mu_per_cm'] = mu_per_cm_compound
-            stack_signal[_name_of_compound]['transmission'] = transmission_compound
-            stack_signal[_name_of_compound]['attenuation'] = 1. - transmission_compound
-            stack_signal[_name_of_compound]['energy_eV'] = energy_compound
-
-            total_transmisison *= transmission_compound
-
-        total_attenuation = 1. - total_transmisison
+                for _index, _iso in enumerate(stack[_name_of_compound][_element]['isotopes']['list']):
+                    _signal_element[_iso] = self.__lazy_signal(
+                        compound=_name_of_compound, element=_element, weights=_weights_iso[_index:_index + 1],
+                        thickness_cm=_thickness_cm, row=_index)
+
+                self.__lazy_signal(compound=_name_of_compound, element=_element, weights=_weights_iso,
+                                   thickness_cm=_thickness_cm, signal=_signal_element)
+                _signal_compound[_element] = _signal_element
+
+                _weights_compound.append(_weights_iso)
+
+            _weights_compound = np.concatenate(_weights_compound)
+            self.__layer_weights[_name_of_compound] = _weights_compound
+            stack_signal[_name_of_compound] = self.__lazy_signal(compound=_name_of_compound,
+                                                                 weights=_weights_compound,
+                                                                 thickness_cm=_thickness_cm,
+                                                                 signal=_signal_compound)
+
+        # sample level
+        _weights_total = np.zeros(len(self.__sigma_matrix))
+        for _name_of_compound in stack.keys():
+            _thickness_cm = _utilities.set_distance_units(value=stack[_name_of_compound]['thickness']['value'],
+                                                          from_units=stack[_name_of_compound]['thickness']['units'],
+                                                          to_units='cm')
+            _weights_total[self.__layer_rows[_name_of_compound]] = _thickness_cm * \
+                                                                   self.__layer_weights[_name_of_compound]
+
+        # the current matrix is captured: a total_signal held by a caller keeps its values when layers are added
+        _sigma_matrix = self.__sigma_matrix
+        total_signal = _utilities.LazyDict()
+        total_signal.set_lazy('transmission', lambda: _utilities.calculate_trans(
+            thickness_cm=1., mu_per_cm=_weights_total @ _sigma_matrix))
+        total_signal.set_lazy('attenuation', lambda: 1. - total_signal['transmission'])
+        total_signal['energy_eV'] = self.__energy_grid
 
         self.stack_signal = stack_signal
-        total_signal['transmission'] = total_transmisison
-        total_signal['attenuation'] = total_attenuation
-        total_signal['energy_eV'] = energy_compound
         self.total_signal = total_signal
 
-    def __calculate_atoms_per_cm3(self, used_lock=False):
-        """calculate for each element, the atoms per cm3"""
+    def __lazy_signal(self, compound, weights, thickness_cm, element=None, row=None, signal=None):
+        """define the lazy 'mu_per_cm', 'transmission', 'attenuation' and 'energy_eV' entries of a signal
+
+        Parameters:
+        ===========
+        compound: string. name of the layer
+        weights: np.array of isotopic_ratio * atoms_per_cm3 * 1e-24 of the rows of the layer (or element)
+        thickness_cm: float. thickness of the layer
+        element: string (default is None). name of the element, None for the layer level
+        row: int (default is None). row of the isotope within the element, None for the element level
+        signal: LazyDict (default is None) where to define the entries, a new one is created if None
+
+        Returns:
+        ========
+        the signal LazyDict
+        """
+        if signal is None:
+            signal = _utilities.LazyDict()
+
+        # rows of the current matrix (a view, no copy) are captured: the matrix is rebuilt when layers are added,
+        # signals created before keep the rows and energy axis they were defined with
+        if element is None:
+            _rows = self.__layer_rows[compound]
+        else:
+            _rows = self.__element_rows[compound][element]
+            if row is not None:
+                _rows = slice(_rows.start + row, _rows.start + row + 1)
+        _sigma_rows = self.__sigma_matrix[_rows]
+
+        if row is None:
+            signal.set_lazy('mu_per_cm', lambda: weights @ _sigma_rows)
+        else:
+            signal.set_lazy('mu_per_cm', lambda: weights[0] * _sigma_rows[0])
+        signal.set_lazy('transmission', lambda: _utilities.calculate_trans(thickness_cm=thickness_cm,
+                                                                           mu_per_cm=signal['mu_per_cm']))
+        signal.set_lazy('attenuation', lambda: 1. - signal['transmission'])
+        signal['energy_eV'] = self.__energy_grid
+        return signal
+
+    def __calculate_atoms_per_cm3(self, used_lock=False, compounds=None):
+        """calculate for each element of the given layers (all layers if None), the atoms per cm3"""
         stack = self.stack
         _density_lock = self.density_lock
+        if compounds is None:
+            compounds = stack.keys()
 
-        for _name_of_compound in stack.keys():
+        for _name_of_compound in compounds:
             if used_lock and _density_lock[_name_of_compound]:
                 continue
             molar_mass_layer, atoms_per_cm3_layer = _utilities.get_atoms_per_cm3_of_layer(
@@ -438,12 +645,13 @@ class Resonance(object):
         stack = self.__fill_missing_keys(stack=stack)
         return stack
 
-    def __update_layer_density(self):
-        """calculate or update the layer density"""
+    def __update_layer_density(self, compounds=None):
+        """calculate or update the density of the given layers (all layers if None)"""
         _stack = self.stack
         _density_lock = self.density_lock
-        list_compound = _stack.keys()
-        for _key in list_compound:
+        if compounds is None:
+            compounds = _stack.keys()
+        for _key in compounds:
             if _density_lock[_key]:
                 continue
 
@@ -509,71 +717,148 @@ class Resonance(object):
             _molar_mass_element += float(_ratio) * float(_mass)
         self.stack[compound][element]['molar_mass']['value'] = _molar_mass_element
 
-    def __get_sigmas(self):
+    def __update_element_sigma(self, compound='', element=''):
+        """Re-calculate the weighted sigma of the element given from the raw sigma of its isotopes
+        due to stoichiometric changes
+
+        Parameters:
+        ==========
+        compound: string (default is '') name of compound
+        element: string (default is '') name of element
+        """
+        _stack_sigma_element = self.stack_sigma[compound][element]
+        list_isotopes = self.stack[compound][element]['isotopes']['list']
+        list_ratio = self.stack[compound][element]['isotopes']['isotopic_ratio']
+        _ratio = np.asarray(list_ratio, dtype=np.float64)
+        _sigma_raw = self.__sigma_matrix[self.__element_rows[compound][element]]
+
+        _sigma_iso = _sigma_raw * _ratio[:, None]
+        for _index, _iso in enumerate(list_isotopes):
+            _stack_sigma_element[_iso]['sigma_b'] = _sigma_iso[_index]
+        _stack_sigma_element['sigma_b'] = _ratio @ _sigma_raw
+        _stack_sigma_element['isotopic_ratio'] = list_ratio
+
+    def __build_sigma_matrix(self, sigma_raw_loaded: dict):
+        """assemble the (n_isotopes x n_energy) matrix of raw sigma of the whole stack
+
+        The rows of each layer (and of each element within a layer) are contiguous and follow the order of the
+        stack. Rows of the layers not listed in sigma_raw_loaded are copied from the previous matrix.
+        If the rows are published consecutively in a shared memory block (see ImagingReso.shared), the matrix is a
+        read-only view of the block instead of a copy.
+        The 'sigma_b_raw' entries of stack_sigma are views on the rows of the matrix.
+
+        Parameters:
+        ===========
+        sigma_raw_loaded: dictionary {compound: list of raw sigma arrays} of the layers (re)loaded
+        """
+        _stack = self.stack
+        _rows = []
+        _layer_rows = {}
+        _element_rows = {}
+        _start = 0
+        for _compound in _stack.keys():
+            if _compound in sigma_raw_loaded:
+                _rows.extend(sigma_raw_loaded[_compound])
+            else:
+                _rows.extend(self.__sigma_matrix[self.__layer_rows[_compound]])
+            _element_rows[_compound] = {}
+            _layer_start = _start
+            for _element in _stack[_compound]['elements']:
+                _nbr_isotopes = len(_stack[_compound][_element]['isotopes']['list'])
+                _element_rows[_compound][_element] = slice(_start, _start + _nbr_isotopes)
+                _start += _nbr_isotopes
+            _layer_rows[_compound] = slice(_layer_start, _start)
+
+        _sigma_matrix = shared.get_block_matrix(rows=_rows)
+        if _sigma_matrix is None:
+            _sigma_matrix = np.vstack(_rows) if _rows else np.empty((0, 0))
+            _sigma_matrix.flags.writeable = False
+        self.__sigma_matrix = _sigma_matrix
+        self.__layer_rows = _layer_rows
+        self.__element_rows = _element_rows
+
+        for _compound in _stack.keys():
+            for _element in _stack[_compound]['elements']:
+                _start = _element_rows[_compound][_element].start
+                for _index, _iso in enumerate(_stack[_compound][_element]['isotopes']['list']):
+                    self.stack_sigma[_compound][_element][_iso]['sigma_b_raw'] = _sigma_matrix[_start + _index]
+
+    def __get_union_energy_grid(self):
+        """return the union of the energies of the database files of every isotope of the stack
+        within [energy_min, energy_max], both limits included"""
+        _stack = self.stack
+        _list_sigma_files = []
+        for _compound in _stack.keys():
+            for _element in _stack[_compound]['elements']:
+                _iso_file = zip(_stack[_compound][_element]['isotopes']['list'],
+                                _stack[_compound][_element]['isotopes']['file_names'])
+                for _iso, _file in _iso_file:
+                    _list_sigma_files.append(_utilities.get_sigma_file(compound=_compound, isotope=_iso,
+                                                                       file_name=_file, database=self.database))
+        return _utilities.get_union_energy_grid(file_names=_list_sigma_files,
+                                                e_min=self.energy_min,
+                                                e_max=self.energy_max,
+                                                max_workers=self.max_workers)
+
+    def __get_sigmas(self, compounds=None):
         """will populate the stack_sigma dictionary with the energy and sigma array
-        for all the compound/element and isotopes"""
-        stack_sigma = {}
+        for all the compound/element and isotopes of the given layers (all layers if None)"""
+        stack_sigma = {**self.stack_sigma}
         _stack = self.stack
 
-        _file_path = os.path.abspath(os.path.dirname(__file__))
-        _database_folder = os.path.join(_file_path, 'reference_data', self.database)
-
-        _list_compounds = _stack.keys()
+        _list_compounds = _stack.keys() if compounds is None else compounds
+        _list_sigma_files = []
+        for _compound in _list_compounds:
+            for _element in _stack[_compound]['elements']:
+                _list_isotopes = _stack[_compound][_element]['isotopes']['list']
+                _list_file_names = _stack[_compound][_element]['isotopes']['file_names']
+                for _iso, _file in zip(_list_isotopes, _list_file_names):
+                    if _compound in _utilities.h_bond_list and _iso == '1-H':
+                        if _compound == 'ZrH':
+                            print("NOTICE:\n"
+                                  "Your entry {} contains bonded H, and has experimental data available.\n"
+                                  "Therefore, '1-H' cross-section has been replaced by the data "
+                                  "reported at https://t2.lanl.gov/nis/data/endf/endfvii-thermal.html".format(_compound))
+                        else:
+                            print("NOTICE:\n"
+                                  "Your entry {} contains bonded H, and has experimental data available.\n"
+                                  "Therefore, '1-H' cross-section has been replaced by the data "
+                                  "reported at https://doi.org/10.1103/PhysRev.76.1750".format(_compound))
+                    _list_sigma_files.append(_utilities.get_sigma_file(compound=_compound, isotope=_iso,
+                                                                       file_name=_file, database=self.database))
+
+        # all isotopes of the layers are interpolated at once on the energy grid (by max_workers threads),
+        # the sigmas are returned in the order of the files
+        _list_sigmas = iter(_utilities.get_sigmas(database_file_names=_list_sigma_files,
+                                                  energy_grid=self.__energy_grid,
+                                                  max_workers=self.max_workers,
+                                                  t_kelvin=self.t_kelvin))
+
+        _sigma_raw_loaded = {}
         for _compound in _list_compounds:
             _list_element = _stack[_compound]['elements']
             stack_sigma[_compound] = {}
+            _sigma_raw_loaded[_compound] = []
             for _element in _list_element:
                 stack_sigma[_compound][_element] = {}
                 _list_isotopes = _stack[_compound][_element]['isotopes']['list']
-                _list_file_names = _stack[_compound][_element]['isotopes']['file_names']
                 _list_isotopic_ratio = _stack[_compound][_element]['isotopes']['isotopic_ratio']
-                _iso_file_ratio = zip(_list_isotopes, _list_file_names, _list_isotopic_ratio)
                 stack_sigma[_compound][_element]['isotopic_ratio'] = _list_isotopic_ratio
 
-                # _dict_sigma_isotopes_sum = {}
-                _sigma_all_isotopes = 0
-                _energy_all_isotopes = 0
-                for _iso, _file, _ratio in _iso_file_ratio:
-                    stack_sigma[_compound][_element][_iso] = {}
-                    # print(_iso,  _file, _ratio)
-                    if _compound in _utilities.h_bond_list:
-                        if _iso == '1-H':
-                            _utilities.is_element_in_database(element='H', database='Bonded_H')
-                            _database_folder_h = os.path.join(_file_path, 'reference_data', 'Bonded_H')
-                            sigma_file = os.path.join(_database_folder_h, 'H-{}.csv'.format(_compound))
-                            if _compound == 'ZrH':
-                                print("NOTICE:\n"
-                                      "Your entry {} contains bonded H, and has experimental data available.\n"
-                                      "Therefore, '1-H' cross-section has been replaced by the data "
-                                      "reported at https://t2.lanl.gov/nis/data/endf/endfvii-thermal.html".format(_compound))
-                            else:
-                                print("NOTICE:\n"
-                                      "Your entry {} contains bonded H, and has experimental data available.\n"
-                                      "Therefore, '1-H' cross-section has been replaced by the data "
-                                      "reported at https://doi.org/10.1103/PhysRev.76.1750".format(_compound))
-                        else:
-                            sigma_file = os.path.join(_database_folder, _file)
-                    else:
-                        sigma_file = os.path.join(_database_folder, _file)
-                    _dict = _utilities.get_sigma(database_file_name=sigma_file,
-                                                 e_min=self.energy_min,
-                                                 e_max=self.energy_max,
-                                                 e_step=self.energy_step)
-                    stack_sigma[_compound][_element][_iso]['energy_eV'] = _dict['energy_eV']
-                    stack_sigma[_compound][_element][_iso]['sigma_b'] = _dict['sigma_b'] * _ratio
-                    stack_sigma[_compound][_element][_iso]['sigma_b_raw'] = _dict['sigma_b']
-
-                    # sigma for all isotopes with their isotopic ratio
-                    _sigma_all_isotopes += _dict['sigma_b'] * _ratio
-                    _energy_all_isotopes += _dict['energy_eV']
-
-                # energy axis (x-axis) is averaged to take into account differences between x-axis of isotopes
-                _mean_energy_all_isotopes = _energy_all_isotopes / len(_list_isotopes)
-                stack_sigma[_compound][_element]['energy_eV'] = _mean_energy_all_isotopes
-                stack_sigma[_compound][_element]['sigma_b'] = _sigma_all_isotopes
+                # every isotope is interpolated on the energy axis of the instance
+                for _iso in _list_isotopes:
+                    stack_sigma[_compound][_element][_iso] = {'energy_eV': self.__energy_grid}
+                    _sigma_raw_loaded[_compound].append(next(_list_sigmas)['sigma_b'])
+                stack_sigma[_compound][_element]['energy_eV'] = self.__energy_grid
 
         self.stack_sigma = stack_sigma
 
+        # raw sigma of the stack as one isotope x energy matrix, weighted sigma derived from it
+        self.__build_sigma_matrix(sigma_raw_loaded=_sigma_raw_loaded)
+        for _compound in _list_compounds:
+            for _element in _stack[_compound]['elements']:
+                self.__update_element_sigma(compound=_compound, element=_element)
+
     def plot(self, y_axis='attenuation', x_axis='energy',
              logx=False, logy=False,
              mixed=True, all_layers=False, all_elements=False,
@@ -643,11 +928,13 @@ class Resonance(object):
         _stack = self.stack
 
         _stack_sigma = self.stack_sigma
-        _x_axis = self.total_signal['energy_eV']
+        _x_axis = self.__energy_grid
         x_axis_label = None
 
         # Creating the matplotlib graph..
         if ax_mpl is None:
+            # plotting libraries are only loaded when needed
+            import matplotlib.pyplot as plt
             fig_mpl, ax_mpl = plt.subplots()
 
         """X-axis"""
@@ -793,6 +1080,7 @@ class Resonance(object):
             # plt.tight_layout()
             return ax_mpl
         else:
+            import plotly.tools as tls
             fig_mpl = ax_mpl.get_figure()
             plotly_fig = tls.mpl_to_plotly(fig_mpl)
             plotly_fig.layout.showlegend = True
@@ -851,8 +1139,9 @@ class Resonance(object):
         _stack_signal = self.stack_signal
         _stack = self.stack
 
-        _x_axis = self.total_signal['energy_eV']
+        _x_axis = self.__energy_grid
         x_axis_label = None
+        import pandas as pd
         df = pd.DataFrame()
 
         """X-axis"""
@@ -0,0 +1,212 @@
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from ImagingReso import _cache
+from ImagingReso import _utilities
+
+# caches the published arrays are served from, by name in the registry
+_caches = {'raw': _cache.raw_sigma_cache,
+           'interpolated': _cache.interpolated_sigma_cache}
+
+# shared memory blocks attached by this process, kept open as long as their arrays may be used
+_attached_blocks = {}
+_attach_lock = threading.Lock()
+
+# (block, address of its first byte) of every block published or attached by this process, by name
+_block_addresses = {}
+
+
+def _open_block(name):
+    """attach to an existing shared memory block
+
+    The workers of a process pool share the resource tracker of the owner, which tracks the block once: it is
+    unlinked by the owner (close) or by the tracker if the owner dies.
+    """
+    return shared_memory.SharedMemory(name=name)
+
+
+def _add_block_address(block):
+    """remember the address of the memory of block (the temporary array viewing it is released at once)"""
+    _block_addresses[block.name] = (block, np.frombuffer(block.buf, dtype=np.uint8).ctypes.data)
+
+
+def get_block_matrix(rows: list):
+    """return the (n_rows x n_energy) read-only view of a shared memory block holding the rows
+
+    The rows (1D float64 arrays of the same size) must be views of one published or attached block, equally
+    spaced in it, ex: the interpolated sigma of files published consecutively.
+
+    Parameters:
+    ===========
+    rows: list of 1D arrays
+
+    Returns:
+    ========
+    2D array viewing the block (no copy), None if the rows can not be viewed as one matrix of a block
+    """
+    if not rows or not _block_addresses:
+        return None
+    _size = rows[0].shape
+    if any(_row.shape != _size or _row.dtype != np.float64 or _row.strides != (8,) for _row in rows):
+        return None
+    _addresses = np.array([_row.ctypes.data for _row in rows], dtype=np.int64)
+    _steps = np.diff(_addresses)
+    _stride = int(_steps[0]) if len(_steps) else _size[0] * 8
+    if _stride < 0 or np.any(_steps != _stride):
+        return None
+    _end = int(_addresses[-1]) + _size[0] * 8
+    for _block, _block_address in _block_addresses.values():
+        if _block_address <= _addresses[0] and _end <= _block_address + _block.size:
+            _matrix = np.ndarray((len(rows), _size[0]), dtype=np.float64, buffer=_block.buf,
+                                 offset=int(_addresses[0]) - _block_address, strides=(_stride, 8))
+            _matrix.flags.writeable = False
+            return _matrix
+    return None
+
+
+def _get_views(block, entry):
+    """return the dictionary of read-only arrays of a registry entry, viewing the shared memory block"""
+    _dict = {}
+    for _field, (_offset, _length) in entry['arrays'].items():
+        _array = np.ndarray((_length,), dtype=np.float64, buffer=block.buf, offset=_offset)
+        _array.flags.writeable = False
+        _dict[_field] = _array
+    return _dict
+
+
+def attach(registry: dict):
+    """serve the arrays published by a SharedSigmaStore from the cross-section caches of this process
+
+    The arrays are views of the shared memory blocks (no copy): every Resonance, get_sigma or get_sigmas call of
+    this process using a published file (and energy grid) reads them instead of loading its own copy. The sigma
+    matrix of a Resonance object whose isotopes were published consecutively, in the order of its stack (ex: the
+    files of get_samples_weights), is a view of the block too (see get_block_matrix).
+    Meant as the initializer of the workers of a process pool:
+
+        store = SharedSigmaStore()
+        registry = store.publish(database_file_names=files, energy_grid=energy_grid)
+        with multiprocessing.Pool(processes=64, initializer=ImagingReso.shared.attach, initargs=(registry,)):
+            ...
+
+    Parameters:
+    ===========
+    registry: dictionary returned by SharedSigmaStore.publish (or SharedSigmaStore.registry)
+
+    Returns:
+    ========
+    number of cache entries attached
+    """
+    with _attach_lock:
+        for _name in registry['blocks']:
+            if _name not in _attached_blocks:
+                _attached_blocks[_name] = _open_block(name=_name)
+                _add_block_address(block=_attached_blocks[_name])
+    for _entry in registry['entries']:
+        _caches[_entry['cache']].pin(_entry['key'], _get_views(block=_attached_blocks[_entry['block']],
+                                                               entry=_entry))
+    return len(registry['entries'])
+
+
+class SharedSigmaStore(object):
+    """owner of shared memory blocks holding raw and interpolated cross-sections for worker processes
+
+    Each call to publish copies the arrays of the given database files into one shared memory block and
+    describes them in a small registry (block names, cache keys, offsets) that is sent to the workers,
+    which attach to the block without copy (see attach). The interpolated sigma of the files are stored
+    consecutively, in the order of database_file_names, so that the sigma matrix of a Resonance object views them.
+    The owner process serves the published arrays from the shared block too. The blocks are removed by close
+    (or at the end of a with statement).
+    """
+
+    def __init__(self):
+        self._blocks = []
+        self.registry = {'blocks': [], 'entries': []}
+
+    def publish(self, database_file_names: list, energy_grid=None, t_kelvin=None, max_workers=None):
+        """copy the raw (and interpolated if energy_grid is given) cross-sections of files into shared memory
+
+        Parameters:
+        ===========
+        database_file_names: list of path/to/database files, ex: from ImagingReso.batch.get_samples_weights
+        energy_grid: np.array (default None). energy axis the workers interpolate on (ex: Resonance.energy_eV),
+           None -> only the raw arrays are published
+        t_kelvin: float (default None). temperature of the interpolated cross-sections (see get_sigmas)
+        max_workers: int (default None). number of threads loading and interpolating the files
+
+        Returns:
+        ========
+        registry: dictionary {'blocks': [names], 'entries': [...]} of every array published by the store
+        """
+        _file_names = list(dict.fromkeys(database_file_names))
+        _list_entries = []
+        for _file_name in _file_names:
+            _list_entries.append({'cache': 'raw',
+                                  'key': _utilities._get_database_file_key(file_name=_file_name),
+                                  'values': _utilities.get_database_arrays(file_name=_file_name)})
+        if energy_grid is not None:
+            energy_grid = np.array(energy_grid, dtype=np.float64)
+            _grid_signature = _utilities.get_grid_signature(energy_grid=energy_grid) + \
+                _utilities._get_temperature_key(t_kelvin)
+            _list_sigmas = _utilities.get_sigmas(database_file_names=_file_names, energy_grid=energy_grid,
+                                                 max_workers=max_workers, t_kelvin=t_kelvin)
+            for _file_name, _dict in zip(_file_names, _list_sigmas):
+                _list_entries.append({'cache': 'interpolated',
+                                      'key': _utilities._get_database_file_key(file_name=_file_name) +
+                                      _grid_signature,
+                                      'values': {'energy_eV': energy_grid, 'sigma_b': _dict['sigma_b']}})
+        if not _list_entries:
+            return self.registry
+
+        # layout of the block: every array once (the energy grid is shared by the interpolated entries), so the
+        # interpolated sigma follow each other in the order of the files
+        _offsets = {}
+        _size = 0
+        for _entry in _list_entries:
+            for _array in _entry['values'].values():
+                if id(_array) not in _offsets:
+                    _offsets[id(_array)] = _size
+                    _size += _array.nbytes
+        _block = shared_memory.SharedMemory(create=True, size=max(_size, 1))
+        self._blocks.append(_block)
+        _add_block_address(block=_block)
+        _written = set()
+        for _entry in _list_entries:
+            _arrays = {}
+            for _field, _array in _entry['values'].items():
+                _offset = _offsets[id(_array)]
+                if _offset not in _written:
+                    np.ndarray(_array.shape, dtype=np.float64, buffer=_block.buf, offset=_offset)[:] = _array
+                    _written.add(_offset)
+                _arrays[_field] = (_offset, len(_array))
+            _registry_entry = {'block': _block.name, 'cache': _entry['cache'], 'key': _entry['key'],
+                               'arrays': _arrays}
+            self.registry['entries'].append(_registry_entry)
+            _caches[_entry['cache']].pin(_entry['key'], _get_views(block=_block, entry=_registry_entry))
+        self.registry['blocks'].append(_block.name)
+        return self.registry
+
+    def close(self):
+        """stop serving the published arrays from the caches of this process and remove the shared memory blocks
+
+        The memory is released once every process using the arrays has released them.
+        """
+        for _entry in self.registry['entries']:
+            _caches[_entry['cache']].unpin(_entry['key'])
+        for _block in self._blocks:
+            _block_addresses.pop(_block.name, None)
+            _block.unlink()
+            try:
+                _block.close()
+            except BufferError:
+                # arrays of this process still view the block, it is closed when they are garbage collected
+                pass
+        self._blocks = []
+        self.registry = {'blocks': [], 'entries': []}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -17,7 +17,7 @@ setup(
     author="Yuxuan Zhang, Jean Bilheux",
     author_email="zhangy6@ornl.gov, bilheuxjm@ornl.gov",
     packages=find_packages(exclude=['tests', 'notebooks']),
-    package_data={'ImagingReso': ['reference_data/_data_for_unittest/*', 'reference_data/Bonded_H/*']},
+    package_data={'ImagingReso': ['reference_data/_data_for_unittest/*.csv', 'reference_data/Bonded_H/*.csv']},
     include_package_data=True,
     test_suite='tests',
     install_requires=[
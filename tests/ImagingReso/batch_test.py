@@ -0,0 +1,70 @@
+import unittest
+
+import numpy as np
+
+from ImagingReso.batch import calculate_transmission_of_samples, get_samples_weights
+from ImagingReso.resonance import Resonance
+
+
+class TestBatch(unittest.TestCase):
+    database = '_data_for_unittest'
+
+    def setUp(self):
+        self.stacks = [{'CoAg': {'elements': ['Co', 'Ag'],
+                                 'stoichiometric_ratio': [1, 1],
+                                 'thickness': {'value': 0.025,
+                                               'units': 'mm'},
+                                 },
+                        },
+                       {'Ag': {'elements': ['Ag'],
+                               'stoichiometric_ratio': [1],
+                               'thickness': {'value': 0.03,
+                                             'units': 'mm'},
+                               'density': {'value': 10.,
+                                           'units': 'g/cm3'},
+                               },
+                        'CH4': {'elements': ['C', 'H'],
+                                'stoichiometric_ratio': [1, 4],
+                                'thickness': {'value': 0.1,
+                                              'units': 'mm'},
+                                },
+                        },
+                       ]
+        self.energy_grid = np.linspace(1, 100, 991)
+
+    def _expected_transmission(self):
+        _list_transmission = []
+        for _stack in self.stacks:
+            o_reso = Resonance(stack={_key: {**_value} for _key, _value in _stack.items()},
+                               energy_grid=self.energy_grid, database=self.database)
+            _list_transmission.append(o_reso.total_signal['transmission'])
+        return np.vstack(_list_transmission)
+
+    def test_get_samples_weights(self):
+        """assert every isotope file is listed once and unused isotopes of a sample have no weight"""
+        weights, file_names = get_samples_weights(stacks=self.stacks, database=self.database)
+        self.assertEqual(len(file_names), len(set(file_names)))
+        self.assertEqual(weights.shape, (2, len(file_names)))
+        _index_co = [_index for _index, _name in enumerate(file_names) if _name.endswith('Co-59.csv')]
+        self.assertEqual(len(_index_co), 1)
+        self.assertGreater(weights[0, _index_co[0]], 0)
+        self.assertEqual(weights[1, _index_co[0]], 0)
+        self.assertTrue(any(_name.endswith('H-CH4.csv') for _name in file_names))
+
+    def test_calculate_transmission_of_samples(self):
+        """assert the batch transmission matches the transmission of one Resonance per sample"""
+        transmission = calculate_transmission_of_samples(stacks=self.stacks, energy_grid=self.energy_grid,
+                                                         database=self.database)
+        self.assertEqual(transmission.shape, (2, len(self.energy_grid)))
+        self.assertTrue(np.allclose(transmission, self._expected_transmission(), rtol=1e-12, atol=0))
+
+    def test_calculate_transmission_of_samples_with_processes(self):
+        """assert sharing the samples between processes gives the same transmission"""
+        transmission = calculate_transmission_of_samples(stacks=self.stacks, energy_grid=self.energy_grid,
+                                                         database=self.database, processes=2)
+        self.assertTrue(np.allclose(transmission, self._expected_transmission(), rtol=1e-12, atol=0))
+
+    def test_wrong_energy_grid(self):
+        """assert ValueError is raised if the energy axis is not strictly increasing"""
+        self.assertRaises(ValueError, calculate_transmission_of_samples, stacks=self.stacks,
+                          energy_grid=[1., 3., 2.], database=self.database)
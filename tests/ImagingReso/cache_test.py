@@ -0,0 +1,87 @@
+import os
+import unittest
+
+import numpy as np
+
+from ImagingReso import _cache
+from ImagingReso._utilities import get_database_arrays, get_sigma
+
+
+class TestArrayCache(unittest.TestCase):
+
+    def test_lru_eviction(self):
+        """assert the least recently used entry is evicted when the byte budget is exceeded"""
+        o_cache = _cache.ArrayCache(max_bytes=2 * 8 * 10)
+        o_cache.put('a', {'y': np.zeros(10)})
+        o_cache.put('b', {'y': np.zeros(10)})
+        o_cache.get('a')
+        o_cache.put('c', {'y': np.zeros(10)})
+        self.assertIsNotNone(o_cache.get('a'))
+        self.assertIsNone(o_cache.get('b'))
+        self.assertIsNotNone(o_cache.get('c'))
+        _stats = o_cache.stats()
+        self.assertEqual(_stats['entries'], 2)
+        self.assertEqual(_stats['nbytes'], 160)
+        self.assertEqual(_stats['evictions'], 1)
+
+    def test_stored_arrays_are_read_only(self):
+        """assert cached arrays can not be modified by callers"""
+        o_cache = _cache.ArrayCache()
+        _value = o_cache.put('a', {'y': np.zeros(10)})
+        self.assertFalse(_value['y'].flags.writeable)
+
+    def test_pinned_entries_are_not_evicted(self):
+        """assert pinned entries stay out of the byte budget until unpinned"""
+        o_cache = _cache.ArrayCache(max_bytes=8 * 10)
+        o_cache.pin('a', {'y': np.zeros(100)})
+        o_cache.put('b', {'y': np.zeros(10)})
+        o_cache.put('c', {'y': np.zeros(10)})
+        self.assertIsNotNone(o_cache.get('a'))
+        self.assertIsNone(o_cache.get('b'))
+        self.assertEqual(o_cache.stats()['nbytes'], 80)
+        o_cache.unpin('a')
+        self.assertIsNone(o_cache.get('a'))
+
+    def test_clear(self):
+        """assert clear removes every entry and resets counters"""
+        o_cache = _cache.ArrayCache()
+        o_cache.put('a', {'y': np.zeros(10)})
+        o_cache.get('a')
+        o_cache.clear()
+        self.assertEqual(o_cache.stats(), {'entries': 0, 'nbytes': 0, 'max_bytes': o_cache.max_bytes,
+                                           'hits': 0, 'misses': 0, 'evictions': 0})
+
+
+class TestRawSigmaCache(unittest.TestCase):
+
+    def setUp(self):
+        _file_path = os.path.dirname(__file__)
+        self.database_path = os.path.abspath(
+            os.path.join(_file_path, '../../ImagingReso/reference_data/_data_for_unittest'))
+        _cache.clear()
+
+    def test_database_arrays_shared_between_calls(self):
+        """assert a database file is loaded once and then served from the cache"""
+        file_name = os.path.join(self.database_path, 'Ag-107.csv')
+        _first = get_database_arrays(file_name=file_name)
+        _second = get_database_arrays(file_name=file_name)
+        self.assertIs(_first['Sig_b'], _second['Sig_b'])
+        _stats = _cache.stats()['raw']
+        self.assertEqual(_stats['misses'], 1)
+        self.assertEqual(_stats['hits'], 1)
+        # callers get their own dictionary, replacing one of its arrays does not change the cache
+        _first['Sig_b'] = _first['Sig_b'] * 2
+        self.assertIs(get_database_arrays(file_name=file_name)['Sig_b'], _second['Sig_b'])
+
+    def test_interpolated_sigma_shared_between_calls(self):
+        """assert the interpolated sigma of a given grid is computed once"""
+        file_name = os.path.join(self.database_path, 'Ag-107.csv')
+        _first = get_sigma(database_file_name=file_name, e_min=300, e_max=600, e_step=10)
+        _second = get_sigma(database_file_name=file_name, e_min=300, e_max=600, e_step=10)
+        self.assertIs(_first['sigma_b'], _second['sigma_b'])
+        self.assertFalse(_first['sigma_b'].flags.writeable)
+        _other = get_sigma(database_file_name=file_name, e_min=300, e_max=600, e_step=5)
+        self.assertEqual(len(_other['sigma_b']), 61)
+        _stats = _cache.stats()['interpolated']
+        self.assertEqual(_stats['misses'], 2)
+        self.assertEqual(_stats['hits'], 1)
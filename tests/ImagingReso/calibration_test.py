@@ -0,0 +1,52 @@
+import unittest
+
+import numpy as np
+
+from ImagingReso._utilities import ev_to_s
+from ImagingReso.calibration import calibrate, get_resonance_energies
+from ImagingReso.resonance import Resonance
+
+
+class TestCalibration(unittest.TestCase):
+    database = '_data_for_unittest'
+
+    def setUp(self):
+        _stack = {'Ag': {'elements': ['Ag'],
+                         'stoichiometric_ratio': [1],
+                         'thickness': {'value': 0.05,
+                                       'units': 'mm'},
+                         },
+                  'Co': {'elements': ['Co'],
+                         'stoichiometric_ratio': [1],
+                         'thickness': {'value': 0.05,
+                                       'units': 'mm'},
+                         },
+                  }
+        self.o_reso = Resonance(stack=_stack, energy_min=1, energy_max=300, energy_step=0.01,
+                                database=self.database)
+        # spectrum measured on a uniform time axis with source_to_detector_m=15.3 and offset_us=3.1
+        _time_s = ev_to_s(offset_us=3.1, source_to_detector_m=15.3, array=self.o_reso.energy_eV)
+        self.time_s = np.linspace(_time_s.min(), _time_s.max(), 20000)
+        self.transmission = np.interp(self.time_s, _time_s[::-1], self.o_reso.total_signal['transmission'][::-1])
+
+    def test_get_resonance_energies(self):
+        """assert the main resonances of Ag and Co are found"""
+        energies = get_resonance_energies(o_reso=self.o_reso)
+        self.assertTrue(np.all(np.diff(energies) > 0))
+        for _expected in [5.19, 16.3, 132.0]:
+            self.assertLess(np.min(np.abs(energies - _expected)), 0.05)
+
+    def test_calibrate(self):
+        """assert the flight path and delay used to simulate the spectrum are recovered from the default guess"""
+        _dict = calibrate(o_reso=self.o_reso, time_s=self.time_s, transmission=self.transmission)
+        self.assertAlmostEqual(_dict['source_to_detector_m'], 15.3, delta=0.01)
+        self.assertAlmostEqual(_dict['offset_us'], 3.1, delta=0.05)
+        self.assertGreaterEqual(len(_dict['energy_eV']), 4)
+        self.assertLess(np.max(np.abs(_dict['residuals_us'])), 0.1)
+
+    def test_calibrate_raises_error(self):
+        """assert ValueError is raised if the spectrum is not valid or has no dip"""
+        self.assertRaises(ValueError, calibrate, o_reso=self.o_reso, time_s=self.time_s,
+                          transmission=self.transmission[1:])
+        self.assertRaises(ValueError, calibrate, o_reso=self.o_reso, time_s=self.time_s,
+                          transmission=np.linspace(0.5, 0.9, len(self.time_s)))
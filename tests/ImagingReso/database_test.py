@@ -0,0 +1,106 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from ImagingReso import _database
+from ImagingReso._utilities import get_database_arrays, get_sigma
+
+
+class TestSigmaStore(unittest.TestCase):
+
+    def setUp(self):
+        _file_path = os.path.dirname(__file__)
+        _database_path = os.path.abspath(
+            os.path.join(_file_path, '../../ImagingReso/reference_data/_data_for_unittest'))
+        # temporary reference_data folder holding one database
+        self.reference_data_folder = _database.reference_data_folder
+        _database.reference_data_folder = tempfile.mkdtemp()
+        self.database_path = os.path.join(_database.reference_data_folder, '_data_for_test')
+        os.mkdir(self.database_path)
+        for _name in ['Ag-107.csv', 'Co-59.csv', '_elements_list.csv']:
+            shutil.copy(os.path.join(_database_path, _name), self.database_path)
+
+    def tearDown(self):
+        shutil.rmtree(_database.reference_data_folder)
+        _database.reference_data_folder = self.reference_data_folder
+
+    def test_build_sigma_store(self):
+        """assert the store indexes every isotope file and skips the '_' files"""
+        index = _database.build_sigma_store(database_folder=self.database_path)
+        self.assertEqual(sorted(index['files'].keys()), ['Ag-107.csv', 'Co-59.csv'])
+        self.assertEqual(index['files']['Ag-107.csv']['offset'], 0)
+        self.assertEqual(index['files']['Co-59.csv']['offset'], 2 * index['files']['Ag-107.csv']['length'])
+        self.assertEqual(index['elements'], {'Ag': ['Ag-107.csv'], 'Co': ['Co-59.csv']})
+
+    def test_manifest_follows_added_files(self):
+        """assert the manifest is loaded once and rebuilt when isotope files are added to the folder"""
+        _database.build_sigma_store(database_folder=self.database_path)
+        shutil.copy(os.path.join(self.database_path, 'Ag-107.csv'), os.path.join(self.database_path, 'Ag-109.csv'))
+        manifest = _database.get_manifest(database_folder=self.database_path)
+        self.assertEqual(manifest['elements']['Ag'], ['Ag-107.csv', 'Ag-109.csv'])
+        self.assertIs(manifest, _database.get_manifest(database_folder=self.database_path))
+
+    def test_get_stored_sigma_matches_csv(self):
+        """assert the memory-mapped arrays are identical to the '.csv' data"""
+        file_name = os.path.join(self.database_path, 'Co-59.csv')
+        energy, sigma = _database.get_stored_sigma(file_name=file_name)
+        df = pd.read_csv(file_name)
+        self.assertTrue(np.array_equal(energy, df['E_eV'].to_numpy()))
+        self.assertTrue(np.array_equal(sigma, df['Sig_b'].to_numpy()))
+        self.assertFalse(energy.flags.writeable)
+
+    def test_modified_file_rebuilds_store(self):
+        """assert a file modified after the store was built is read from the rebuilt store"""
+        _database.build_sigma_store(database_folder=self.database_path)
+        file_name = os.path.join(self.database_path, 'Ag-107.csv')
+        with open(file_name, 'w') as fh:
+            fh.write('E_eV,Sig_b\n1,2\n3,4\n')
+        _energy, _sigma = _database.get_stored_sigma(file_name=file_name)
+        self.assertEqual(list(_sigma), [2, 4])
+        _dict = get_database_arrays(file_name=file_name)
+        self.assertEqual(list(_dict['Sig_b']), [2, 4])
+
+    def test_touched_file_is_served_from_store(self):
+        """assert a file touched after the store was built is served from the store again, in a new process too"""
+        _database.build_sigma_store(database_folder=self.database_path)
+        file_name = os.path.join(self.database_path, 'Ag-107.csv')
+        _stat = os.stat(file_name)
+        os.utime(file_name, ns=(_stat.st_atime_ns, _stat.st_mtime_ns + 10 ** 9))
+        self.assertIsNotNone(_database.get_stored_sigma(file_name=file_name))
+        # a new process only finds the store on disk
+        _database._loaded_stores.clear()
+        _database._manifests.clear()
+        energy, sigma = _database.get_stored_sigma(file_name=file_name)
+        df = pd.read_csv(file_name)
+        self.assertTrue(np.array_equal(sigma, df['Sig_b'].to_numpy()))
+        _index = _database.load_sigma_store(database_folder=self.database_path, build=False)[1]
+        self.assertEqual(_index['files']['Ag-107.csv']['mtime_ns'], _stat.st_mtime_ns + 10 ** 9)
+
+    def test_user_folder_is_read_from_csv(self):
+        """assert files outside of the database folders are read from the '.csv' file, whatever else the
+        folder holds, and no store is written there"""
+        _user_path = tempfile.mkdtemp()
+        try:
+            file_name = os.path.join(_user_path, 'my.csv')
+            shutil.copy(os.path.join(self.database_path, 'Ag-107.csv'), file_name)
+            with open(os.path.join(_user_path, 'unrelated.csv'), 'w') as fh:
+                fh.write('a,b\n1,2\n')
+            self.assertIsNone(_database.get_stored_sigma(file_name=file_name))
+            _dict = get_sigma(database_file_name=file_name, e_min=300, e_max=600, e_step=10)
+            self.assertAlmostEqual(_dict['sigma_b'][0], 4.101356, delta=0.00001)
+            self.assertEqual(sorted(os.listdir(_user_path)), ['my.csv', 'unrelated.csv'])
+        finally:
+            shutil.rmtree(_user_path)
+
+    def test_failed_build_leaves_no_temporary_file(self):
+        """assert the temporary files are removed when a file of the database can not be converted"""
+        with open(os.path.join(self.database_path, 'Xx-1.csv'), 'w') as fh:
+            fh.write('a,b\n1,2\n')
+        self.assertRaises(KeyError, _database.build_sigma_store, database_folder=self.database_path)
+        self.assertEqual(sorted(os.listdir(self.database_path)),
+                         ['Ag-107.csv', 'Co-59.csv', 'Xx-1.csv', '_elements_list.csv'])
+        self.assertIsNone(_database.get_stored_sigma(file_name=os.path.join(self.database_path, 'Co-59.csv')))
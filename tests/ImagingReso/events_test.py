@@ -0,0 +1,99 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from ImagingReso._utilities import ev_to_s
+from ImagingReso.events import event_dtype, get_energy_bin_edges, histogram_events
+from ImagingReso.resonance import Resonance
+
+
+class TestHistogramEvents(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.folder, 'events.bin')
+        self.energy_grid = np.linspace(1, 100, 100)
+        _random = np.random.RandomState(0)
+        self.energy = _random.uniform(0.5, 110, 10000)
+        self.events = np.zeros(len(self.energy), dtype=event_dtype)
+        self.events['x'] = _random.randint(0, 4, len(self.energy))
+        self.events['y'] = _random.randint(0, 3, len(self.energy))
+        self.events['tof'] = ev_to_s(offset_us=2.7, source_to_detector_m=16., array=self.energy)
+        self.events.tofile(self.file_name)
+        self.edges = get_energy_bin_edges(energy_grid=self.energy_grid)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_get_energy_bin_edges(self):
+        """assert the bins are centered on the energies of the grid"""
+        np.testing.assert_allclose((self.edges[1:] + self.edges[:-1]) / 2., self.energy_grid)
+        self.assertRaises(ValueError, get_energy_bin_edges, energy_grid=[1., 3., 2.])
+
+    def test_histogram_on_energy_axis(self):
+        """assert the spectrum read by chunks is the histogram of the event energies"""
+        _dict = histogram_events(file_name=self.file_name, energy_grid=self.energy_grid, offset_us=2.7,
+                                 chunk_size=777)
+        _expected = np.histogram(self.energy, bins=self.edges)[0]
+        np.testing.assert_array_equal(_dict['counts'], _expected)
+        np.testing.assert_array_equal(_dict['x_axis'], self.energy_grid)
+        self.assertEqual(_dict['nbr_events'], len(self.energy))
+        self.assertEqual(_dict['nbr_events_binned'], _expected.sum())
+
+    def test_histogram_per_pixel_and_roi(self):
+        """assert the spectra of the pixels and of the regions of interest add up to the right counts"""
+        _pixels = histogram_events(file_name=self.file_name, energy_grid=self.energy_grid, offset_us=2.7,
+                                   detector_shape=(3, 4), chunk_size=1000)
+        self.assertEqual(_pixels['counts'].shape, (3, 4, 100))
+        _in_pixel = (self.events['x'] == 2) & (self.events['y'] == 1)
+        np.testing.assert_array_equal(_pixels['counts'][1, 2], np.histogram(self.energy[_in_pixel],
+                                                                              bins=self.edges)[0])
+        _roi = histogram_events(file_name=self.file_name, energy_grid=self.energy_grid, offset_us=2.7,
+                                roi=[(0, 0, 4, 3), (2, 1, 4, 3)], chunk_size=1000)
+        np.testing.assert_array_equal(_roi['counts'][0], _pixels['counts'].sum(axis=(0, 1)))
+        np.testing.assert_array_equal(_roi['counts'][1], _pixels['counts'][1:, 2:].sum(axis=(0, 1)))
+        self.assertRaises(ValueError, histogram_events, file_name=self.file_name, energy_grid=self.energy_grid,
+                          roi=[(2, 0, 1, 3)])
+
+    def test_histogram_on_image_number_axis(self):
+        """assert an event is counted in image floor((tof - t_start) / time_resolution) of its recorded tof"""
+        _file_name = os.path.join(self.folder, 'events_us.bin')
+        _events = np.zeros(5, dtype=event_dtype)
+        _events['tof'] = [500., 509., 515., 1500., 2000.]
+        _events.tofile(_file_name)
+        _dict = histogram_events(file_name=_file_name, energy_grid=np.linspace(1, 1000, 1000), offset_us=20.,
+                                 x_axis='number', time_resolution_us=10., t_start_us=0., tof_units='us')
+        _counts = dict(zip(_dict['x_axis'], _dict['counts']))
+        self.assertEqual(_counts[50], 2)
+        self.assertEqual(_counts[51], 1)
+        self.assertEqual(_counts[150], 1)
+        # 2000 us is the time of an energy below the energy grid
+        self.assertEqual(_dict['nbr_events_binned'], 4)
+        self.assertRaises(ValueError, histogram_events, file_name=self.file_name, energy_grid=self.energy_grid,
+                          x_axis='number')
+
+    def test_image_number_axis_of_resonance(self):
+        """assert the events of an energy are counted in the image of that energy on the Resonance 'number' axis"""
+        _stack = {'Ag': {'elements': ['Ag'],
+                         'stoichiometric_ratio': [1],
+                         'thickness': {'value': 0.03,
+                                       'units': 'mm'},
+                         },
+                  }
+        o_reso = Resonance(stack=_stack, energy_min=1, energy_max=100, energy_step=0.1,
+                           database='_data_for_unittest')
+        _numbers = o_reso.export(x_axis='number', offset_us=20., time_resolution_us=10.,
+                                 t_start_us=0.)['Image number (#)'].to_numpy()
+        _file_name = os.path.join(self.folder, 'events_reso.bin')
+        _events = np.zeros(len(o_reso.energy_eV), dtype=event_dtype)
+        _events['tof'] = ev_to_s(offset_us=20., source_to_detector_m=16., array=o_reso.energy_eV)
+        _events.tofile(_file_name)
+        _dict = histogram_events(file_name=_file_name, energy_grid=o_reso.energy_eV, offset_us=20., x_axis='number',
+                                 time_resolution_us=10., t_start_us=0.)
+        _images = np.floor(_numbers).astype(int)
+        self.assertTrue(np.all(np.isin(_images, _dict['x_axis'])))
+        np.testing.assert_array_equal(_dict['counts'],
+                                      np.bincount(_images - _dict['x_axis'][0], minlength=len(_dict['x_axis'])))
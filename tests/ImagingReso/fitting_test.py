@@ -0,0 +1,149 @@
+import unittest
+
+import numpy as np
+
+from ImagingReso.fitting import TransmissionModel, fit_areal_density, fit_transmission, get_sigma_components
+from ImagingReso.resonance import Resonance
+
+
+class TestArealDensityFit(unittest.TestCase):
+    database = '_data_for_unittest'
+
+    def setUp(self):
+        _stack = {'Ag': {'elements': ['Ag'],
+                         'stoichiometric_ratio': [1],
+                         'thickness': {'value': 0.03,
+                                       'units': 'mm'},
+                         },
+                  'Co': {'elements': ['Co'],
+                         'stoichiometric_ratio': [1],
+                         'thickness': {'value': 0.05,
+                                       'units': 'mm'},
+                         },
+                  }
+        self.o_reso = Resonance(stack=_stack, energy_min=1, energy_max=300, energy_step=0.1,
+                                database=self.database)
+        self.components = ['Ag/Ag/107-Ag', 'Ag/Ag/109-Ag', 'Co/Co/59-Co']
+        _, sigma = get_sigma_components(o_reso=self.o_reso, components=self.components)
+
+        # 2 x 3 pixels of known areal densities (atoms/cm2)
+        self.areal_density = np.array([1e20, 5e19, 2e20])[:, None, None] * np.arange(1, 7).reshape(1, 2, 3)
+        self.transmission = np.exp(-np.einsum('ce,cyx->eyx', sigma * 1e-24, self.areal_density))
+
+    def test_get_sigma_components(self):
+        """assert every isotope of the stack is a component by default and unknown components are refused"""
+        components, sigma = get_sigma_components(o_reso=self.o_reso)
+        self.assertEqual(components[:2], ['Ag/Ag/107-Ag', 'Ag/Ag/109-Ag'])
+        self.assertEqual(sigma.shape, (len(components), len(self.o_reso.energy_eV)))
+        self.assertRaises(ValueError, get_sigma_components, o_reso=self.o_reso, components=['Ag/Ag/1-H'])
+
+    def test_isotope_of_several_layers_is_one_component(self):
+        """assert an isotope found in 2 layers is a single default component and can not be listed twice"""
+        _stack = {'Ag': {'elements': ['Ag'],
+                         'stoichiometric_ratio': [1],
+                         'thickness': {'value': 0.03,
+                                       'units': 'mm'},
+                         },
+                  'CoAg': {'elements': ['Co', 'Ag'],
+                           'stoichiometric_ratio': [1, 1],
+                           'thickness': {'value': 0.025,
+                                         'units': 'mm'},
+                           },
+                  }
+        o_reso = Resonance(stack=_stack, energy_min=1, energy_max=300, energy_step=0.1, database=self.database)
+        components, sigma = get_sigma_components(o_reso=o_reso)
+        self.assertIn('Ag/Ag/107-Ag', components)
+        self.assertNotIn('CoAg/Ag/107-Ag', components)
+        self.assertIn('CoAg/Co/59-Co', components)
+        self.assertEqual(sigma.shape[0], len(components))
+        self.assertRaises(ValueError, get_sigma_components, o_reso=o_reso,
+                          components=['Ag/Ag/107-Ag', 'CoAg/Ag/107-Ag'])
+
+    def test_fit_areal_density(self):
+        """assert the areal densities used to simulate the pixels are recovered, by blocks of pixels"""
+        _dict = fit_areal_density(o_reso=self.o_reso, transmission=self.transmission,
+                                  components=self.components, chunk_size=4)
+        self.assertEqual(_dict['components'], self.components)
+        self.assertEqual(_dict['areal_density'].shape, (3, 2, 3))
+        self.assertTrue(np.allclose(_dict['areal_density'], self.areal_density, rtol=1e-8))
+
+    def test_fit_areal_density_with_processes(self):
+        """assert solving the blocks of pixels in a process pool gives the same areal densities"""
+        _dict = fit_areal_density(o_reso=self.o_reso, transmission=self.transmission,
+                                  components=self.components, chunk_size=2, processes=2)
+        self.assertTrue(np.allclose(_dict['areal_density'], self.areal_density, rtol=1e-8))
+
+    def test_fit_areal_density_raises_error_if_wrong_energy_axis(self):
+        """assert ValueError is raised if the spectra do not have the energies of the Resonance object"""
+        self.assertRaises(ValueError, fit_areal_density, o_reso=self.o_reso, transmission=self.transmission[1:])
+
+
+class TestTransmissionFit(unittest.TestCase):
+    database = '_data_for_unittest'
+
+    def setUp(self):
+        _stack = {'CoAg': {'elements': ['Co', 'Ag'],
+                           'stoichiometric_ratio': [1, 1],
+                           'thickness': {'value': 0.025,
+                                         'units': 'mm'},
+                           },
+                  'Ag': {'elements': ['Ag'],
+                         'stoichiometric_ratio': [1],
+                         'thickness': {'value': 0.03,
+                                       'units': 'mm'},
+                         },
+                  }
+        self.o_reso = Resonance(stack=_stack, energy_min=1, energy_max=100, energy_step=0.1,
+                                database=self.database)
+        self.params = {'thickness': ['Ag'], 'density': ['CoAg'], 'isotopic_ratio': ['Ag/Ag/107-Ag'],
+                       'norm': True, 'background': True}
+
+    def test_model_matches_resonance(self):
+        """assert the model at the starting values is the total transmission of the Resonance object"""
+        model = TransmissionModel(o_reso=self.o_reso, thickness=['Ag'], density=['CoAg'], norm=True)
+        self.assertEqual(model.params, ['density/CoAg', 'thickness/Ag', 'norm'])
+        self.assertTrue(np.allclose(model.transmission(model.x0), self.o_reso.total_signal['transmission'],
+                                    rtol=1e-12, atol=0))
+
+    def test_analytic_jacobian(self):
+        """assert the analytic Jacobian matches finite differences"""
+        model = TransmissionModel(o_reso=self.o_reso, **self.params)
+        x = model.x0 * 1.1 + 0.01
+        jacobian = model.jacobian(x)
+        self.assertEqual(jacobian.shape, (len(self.o_reso.energy_eV), 5))
+        for _index in range(len(x)):
+            _step = np.zeros(len(x))
+            _step[_index] = 1e-6 * max(abs(x[_index]), 1e-3)
+            _derivative = (model.transmission(x + _step) - model.transmission(x - _step)) / (2 * _step[_index])
+            self.assertTrue(np.allclose(jacobian[:, _index], _derivative, rtol=1e-5, atol=1e-8), model.params[_index])
+
+    def test_fit_transmission(self):
+        """assert the parameters used to simulate a spectrum are recovered"""
+        model = TransmissionModel(o_reso=self.o_reso, **self.params)
+        # weight of 107-Ag giving a ratio of 0.3, relative to the ratio of 109-Ag
+        _ratio_109 = self.o_reso.stack['Ag']['Ag']['isotopes']['isotopic_ratio'][1]
+        _expected = {'thickness/Ag': 0.04, 'density/CoAg': 7., 'isotopic_ratio/Ag/Ag/107-Ag': 0.3 * _ratio_109 / 0.7,
+                     'norm': 0.95, 'background': 0.01}
+        x_expected = np.array([_expected[_name] for _name in model.params])
+        measured = model.transmission(x_expected)
+        fitted = fit_transmission(o_reso=self.o_reso, transmission=measured, **self.params)
+        self.assertTrue(fitted['success'])
+        self.assertAlmostEqual(fitted['thickness']['Ag'], 0.04, delta=1e-6)
+        self.assertAlmostEqual(fitted['density']['CoAg'], 7., delta=1e-4)
+        self.assertAlmostEqual(fitted['isotopic_ratio']['Ag/Ag/107-Ag'], 0.3, delta=1e-6)
+        self.assertAlmostEqual(fitted['isotopic_ratio']['Ag/Ag/109-Ag'], 0.7, delta=1e-6)
+        self.assertAlmostEqual(fitted['norm'], 0.95, delta=1e-6)
+        self.assertAlmostEqual(fitted['background'], 0.01, delta=1e-6)
+        self.assertRaises(ValueError, fit_transmission, o_reso=self.o_reso, transmission=measured)
+
+    def test_fitted_ratios_sum_to_one(self):
+        """assert the fitted isotopic ratios of an element sum to 1 and can be set to the Resonance object"""
+        model = TransmissionModel(o_reso=self.o_reso, isotopic_ratio=['Ag/Ag/107-Ag'])
+        measured = model.transmission(np.array([0.2]))
+        fitted = fit_transmission(o_reso=self.o_reso, transmission=measured, isotopic_ratio=['Ag/Ag/107-Ag'])
+        _list_isotopes = ['Ag/Ag/' + _iso for _iso in self.o_reso.stack['Ag']['Ag']['isotopes']['list']]
+        self.assertEqual(sorted(fitted['isotopic_ratio'].keys()), sorted(_list_isotopes))
+        self.assertAlmostEqual(sum(fitted['isotopic_ratio'].values()), 1., delta=1e-12)
+        _list_ratio = [fitted['isotopic_ratio'][_iso] for _iso in _list_isotopes]
+        self.o_reso.set_isotopic_ratio(compound='Ag', element='Ag', list_ratio=_list_ratio)
+        self.assertRaises(ValueError, TransmissionModel, o_reso=self.o_reso, isotopic_ratio=_list_isotopes)
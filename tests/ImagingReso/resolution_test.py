@@ -0,0 +1,67 @@
+import unittest
+
+import numpy as np
+
+from ImagingReso import _cache
+from ImagingReso._utilities import ev_to_s
+from ImagingReso.resolution import convolve_resonance, convolve_signal, get_kernel, ikeda_carpenter
+from ImagingReso.resonance import Resonance
+
+
+def _trapezoid(y, x):
+    return np.sum(np.diff(x) * (y[1:] + y[:-1]) / 2.)
+
+
+class TestResolution(unittest.TestCase):
+    database = '_data_for_unittest'
+
+    def test_ikeda_carpenter(self):
+        """assert the pulse is normalized, causal and has the mean time of the Ikeda-Carpenter function"""
+        t_us = np.linspace(-10, 400, 410001)
+        pulse = ikeda_carpenter(t_us=t_us, alpha_us=0.5, beta_us=0.05, r=0.3)
+        self.assertAlmostEqual(_trapezoid(pulse, t_us), 1., delta=1e-6)
+        self.assertTrue(np.all(pulse[t_us < 0] == 0))
+        kernel = get_kernel(time_resolution_us=0.16, alpha_us=0.5, beta_us=0.05, r=0.3)
+        self.assertAlmostEqual(kernel.sum(), 1., delta=1e-12)
+        # mean time: 3 / alpha + r / beta
+        self.assertAlmostEqual(np.sum(np.arange(len(kernel)) * kernel) * 0.16, 3. / 0.5 + 0.3 / 0.05, delta=1e-3)
+
+    def test_convolve_signal(self):
+        """assert a flat signal is unchanged and a dip is shallower, delayed and keeps its area"""
+        energy_eV = np.linspace(1, 100, 100000)
+        _flat = convolve_signal(energy_eV=energy_eV, signal=np.ones_like(energy_eV), source_to_detector_m=16.,
+                                offset_us=0., time_resolution_us=0.16)
+        np.testing.assert_allclose(_flat['signal'], 1., rtol=1e-12)
+        self.assertTrue(np.all(np.diff(_flat['time_us']) > 0))
+        self.assertTrue(np.all(np.diff(_flat['energy_eV']) < 0))
+
+        _signal = 1. - 0.8 * np.exp(-((energy_eV - 20.) / 0.05) ** 2)
+        _convolved = convolve_signal(energy_eV=energy_eV, signal=_signal, source_to_detector_m=16., offset_us=0.,
+                                     time_resolution_us=0.16)
+        _dip = _convolved['signal'][np.argmin(_convolved['signal'])]
+        self.assertGreater(_dip, 0.2)
+        self.assertLess(_convolved['energy_eV'][np.argmin(_convolved['signal'])], 20.)
+        _time_us = ev_to_s(offset_us=0., source_to_detector_m=16., array=energy_eV)[::-1] * 1e6
+        _area = _trapezoid(1. - _signal[::-1], _time_us)
+        self.assertAlmostEqual(np.sum(1. - _convolved['signal']) * 0.16, _area, delta=0.001 * _area)
+        self.assertRaises(ValueError, convolve_signal, energy_eV=energy_eV, signal=_signal[1:],
+                          source_to_detector_m=16., offset_us=0., time_resolution_us=0.16)
+
+    def test_kernel_transform_is_cached(self):
+        """assert the kernel transform is computed once per instrument and grid"""
+        _cache.clear()
+        _stack = {'Ag': {'elements': ['Ag'],
+                         'stoichiometric_ratio': [1],
+                         'thickness': {'value': 0.03,
+                                       'units': 'mm'},
+                         },
+                  }
+        o_reso = Resonance(stack=_stack, energy_min=1, energy_max=100, energy_step=0.01, database=self.database)
+        _first = convolve_resonance(o_reso=o_reso, source_to_detector_m=16., offset_us=2.7, time_resolution_us=0.16)
+        _second = convolve_resonance(o_reso=o_reso, source_to_detector_m=16., offset_us=2.7, time_resolution_us=0.16)
+        np.testing.assert_array_equal(_first['signal'], _second['signal'])
+        _stats = _cache.stats()['resolution_kernel']
+        self.assertEqual(_stats['misses'], 1)
+        self.assertEqual(_stats['hits'], 1)
+        self.assertRaises(ValueError, convolve_resonance, o_reso=o_reso, source_to_detector_m=16., offset_us=2.7,
+                          time_resolution_us=0.16, y_axis='sigma')
@@ -1,7 +1,10 @@
+import subprocess
+import sys
 import unittest
 import numpy as np
 import pprint
 
+from ImagingReso import _cache
 from ImagingReso.resonance import Resonance
 
 
@@ -18,6 +21,84 @@ class TestInitialization(unittest.TestCase):
         energy_max = 1e9
         self.assertRaises(ValueError, Resonance, energy_max=energy_max, database=self.database)
 
+    def test_import_does_not_load_plotting_libraries(self):
+        """assert matplotlib, plotly and pandas are only imported when plotting or exporting"""
+        _code = "import sys; import ImagingReso.resonance; " \
+                "print(sorted(set(sys.modules) & {'matplotlib', 'plotly', 'pandas', 'scipy'}))"
+        _output = subprocess.check_output([sys.executable, '-c', _code])
+        self.assertEqual(_output.decode().strip(), '[]')
+
+    def test_instances_do_not_share_state(self):
+        """assert every Resonance owns its stack and signals, and instances can be built in threads"""
+        from concurrent.futures import ThreadPoolExecutor
+        o_reso_empty = Resonance(database=self.database)
+        self.assertEqual(o_reso_empty.stack, {})
+        o_reso_empty.add_layer(formula='Co', thickness=0.05)
+        self.assertEqual(Resonance(database=self.database).stack, {})
+        self.assertEqual(Resonance(database=self.database).density_lock, {})
+
+        def _transmission(thickness):
+            _stack = {'Ag': {'elements': ['Ag'],
+                             'stoichiometric_ratio': [1],
+                             'thickness': {'value': 0.03,
+                                           'units': 'mm'},
+                             },
+                      }
+            o_reso = Resonance(stack=_stack, energy_min=1, energy_max=100, energy_step=0.1, database=self.database)
+            o_reso.add_layer(formula='Co', thickness=thickness)
+            return o_reso.total_signal['transmission']
+
+        _list_thickness = [0.01, 0.02, 0.03, 0.04]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            _list_transmission = list(executor.map(_transmission, _list_thickness))
+        for _thickness, _transmission_threaded in zip(_list_thickness, _list_transmission):
+            self.assertTrue(np.array_equal(_transmission(_thickness), _transmission_threaded))
+
+    def test_initialization_with_max_workers(self):
+        """assert loading the isotopes with a pool of threads gives the same sigma, in the same order"""
+        _stack = {'CoAg': {'elements': ['Co', 'Ag'],
+                           'stoichiometric_ratio': [1, 1],
+                           'thickness': {'value': 0.025,
+                                         'units': 'mm'},
+                           },
+                  }
+        o_reso = Resonance(stack=_stack, energy_min=1, energy_max=100, energy_step=0.1, database=self.database)
+        _cache.clear()
+        _stack = {'CoAg': {'elements': ['Co', 'Ag'],
+                           'stoichiometric_ratio': [1, 1],
+                           'thickness': {'value': 0.025,
+                                         'units': 'mm'},
+                           },
+                  }
+        o_reso_threads = Resonance(stack=_stack, energy_min=1, energy_max=100, energy_step=0.1,
+                                   database=self.database, max_workers=4)
+        self.assertEqual(list(o_reso_threads.stack_sigma['CoAg']['Ag'].keys()),
+                         list(o_reso.stack_sigma['CoAg']['Ag'].keys()))
+        for _iso in o_reso.stack['CoAg']['Ag']['isotopes']['list']:
+            self.assertTrue(np.array_equal(o_reso_threads.stack_sigma['CoAg']['Ag'][_iso]['sigma_b_raw'],
+                                           o_reso.stack_sigma['CoAg']['Ag'][_iso]['sigma_b_raw']))
+        self.assertRaises(ValueError, Resonance, database=self.database, max_workers=0)
+
+    def test_initialization_with_temperature(self):
+        """assert the resonances of a sample above 294K are broadened and temperatures below 294K are refused"""
+        _transmission = {}
+        for _temperature in ['294K', '1000K']:
+            _stack = {'Ag': {'elements': ['Ag'],
+                             'stoichiometric_ratio': [1],
+                             'thickness': {'value': 0.03,
+                                           'units': 'mm'},
+                             },
+                      }
+            o_reso = Resonance(stack=_stack, energy_min=1, energy_max=100, energy_step=0.01,
+                               database=self.database, temperature=_temperature)
+            _transmission[_temperature] = o_reso.total_signal['transmission']
+        self.assertEqual(o_reso.t_kelvin, 1000.)
+        self.assertGreater(_transmission['1000K'].min(), _transmission['294K'].min())
+        self.assertRaises(ValueError, Resonance, database=self.database, temperature='77K')
+        # energies outside of the database are refused above 294K as at 294K
+        self.assertRaises(Exception, Resonance, stack=_stack, energy_min=1.5e7, energy_max=3e7, energy_step=1e5,
+                          database=self.database, temperature=600)
+
     def test_database(self):
         """assert ValueError if unsupported or wrong database passed to Resonance()"""
         self.assertRaises(ValueError, Resonance, database='_do_not_exist')
@@ -122,6 +203,112 @@ class TestInitialization(unittest.TestCase):
         self.assertRaises(ValueError, Resonance, stack=_stack, energy_max=energy_max, energy_min=energy_min,
                           energy_step=energy_step, database=self.database)
 
+    def test_initialization_with_log_energy_scale(self):
+        """assert the log energy axis has a constant relative step"""
+        _stack = {'Ag': {'elements': ['Ag'],
+                         'stoichiometric_ratio': [1],
+                         'thickness': {'value': 0.03,
+                                       'units': 'mm'},
+                         },
+                  }
+        o_reso = Resonance(stack=_stack, energy_min=1, energy_max=100, energy_step=0.01, energy_scale='log',
+                           database=self.database)
+        energy = o_reso.total_signal['energy_eV']
+        self.assertAlmostEqual(energy[0], 1)
+        self.assertAlmostEqual(energy[-1], 100)
+        self.assertEqual(len(energy), 463)
+        self.assertTrue(np.allclose(energy[1:] / energy[:-1], energy[1] / energy[0]))
+        self.assertEqual(len(o_reso.total_signal['transmission']), len(energy))
+        self.assertRaises(ValueError, Resonance, energy_scale='wrong', database=self.database)
+
+    def test_initialization_with_energy_grid(self):
+        """assert a user energy axis is used for every signal and export"""
+        _stack = {'Ag': {'elements': ['Ag'],
+                         'stoichiometric_ratio': [1],
+                         'thickness': {'value': 0.03,
+                                       'units': 'mm'},
+                         },
+                  }
+        energy_grid = np.array([1., 2.5, 7., 50., 120.])
+        o_reso = Resonance(stack=_stack, energy_grid=energy_grid, database=self.database)
+        self.assertEqual(o_reso.energy_min, 1.)
+        self.assertEqual(o_reso.energy_max, 120.)
+        self.assertTrue(np.array_equal(o_reso.stack_sigma['Ag']['Ag']['107-Ag']['energy_eV'], energy_grid))
+        df = o_reso.export(y_axis='transmission')
+        self.assertTrue(np.array_equal(df['Energy (eV)'], energy_grid))
+        self.assertRaises(ValueError, Resonance, energy_grid=[1., 3., 2.], database=self.database)
+
+    def test_energy_axis_is_shared(self):
+        """assert every sigma and signal refers to the single read-only energy axis of the instance"""
+        _stack = {'CoAg': {'elements': ['Co', 'Ag'],
+                           'stoichiometric_ratio': [1, 1],
+                           'thickness': {'value': 0.025,
+                                         'units': 'mm'},
+                           },
+                  }
+        o_reso = Resonance(stack=_stack, energy_min=1, energy_max=10, energy_step=0.5, database=self.database)
+        energy = o_reso.energy_eV
+        self.assertFalse(energy.flags.writeable)
+        self.assertIs(o_reso.stack_sigma['CoAg']['Ag']['energy_eV'], energy)
+        self.assertIs(o_reso.stack_sigma['CoAg']['Ag']['107-Ag']['energy_eV'], energy)
+        self.assertIs(o_reso.stack_signal['CoAg']['energy_eV'], energy)
+        self.assertIs(o_reso.stack_signal['CoAg']['Co']['59-Co']['energy_eV'], energy)
+        self.assertIs(o_reso.total_signal['energy_eV'], energy)
+
+    def test_initialization_with_adaptive_energy_scale(self):
+        """assert the adaptive energy axis describes the transmission within tolerance with fewer points"""
+        _stack = {'Ag': {'elements': ['Ag'],
+                         'stoichiometric_ratio': [1],
+                         'thickness': {'value': 0.03,
+                                       'units': 'mm'},
+                         },
+                  }
+        o_reso_fine = Resonance(stack=_stack, energy_min=1, energy_max=300, energy_step=0.01,
+                                database=self.database)
+        o_reso = Resonance(stack=_stack, energy_min=1, energy_max=300, energy_step=0.001, energy_scale='adaptive',
+                           database=self.database)
+        energy = o_reso.total_signal['energy_eV']
+        self.assertEqual(energy[0], 1)
+        self.assertEqual(energy[-1], 300)
+        self.assertLess(len(energy), len(o_reso_fine.total_signal['energy_eV']) / 10)
+        transmission = np.interp(o_reso_fine.total_signal['energy_eV'], energy, o_reso.total_signal['transmission'])
+        self.assertLess(np.max(np.abs(transmission - o_reso_fine.total_signal['transmission'])), 0.002)
+
+        # adding a layer rebuilds the energy axis of every layer
+        o_reso.add_layer(formula='Co', thickness=0.05)
+        self.assertEqual(len(o_reso.stack_signal['Ag']['energy_eV']), len(o_reso.total_signal['energy_eV']))
+
+        # changing isotopic ratios rebuilds the energy axis too
+        _energy_before = o_reso.energy_eV
+        o_reso.set_isotopic_ratio(compound='Ag', element='Ag', list_ratio=[0.2, 0.8, 0., 0.])
+        _layer = {'elements': ['Ag'],
+                  'stoichiometric_ratio': [1],
+                  'thickness': {'value': 0.03,
+                                'units': 'mm'},
+                  'density': {'value': o_reso.stack['Ag']['density']['value'],
+                              'units': 'g/cm3'},
+                  }
+        o_reso_fine = Resonance(stack={'Ag': _layer}, energy_min=1, energy_max=300, energy_step=0.01,
+                                database=self.database)
+        o_reso_fine.set_isotopic_ratio(compound='Ag', element='Ag', list_ratio=[0.2, 0.8, 0., 0.])
+        o_reso_fine.add_layer(formula='Co', thickness=0.05)
+        self.assertFalse(np.array_equal(o_reso.energy_eV, _energy_before))
+        self.assertIs(o_reso.stack_signal['Ag']['energy_eV'], o_reso.energy_eV)
+        transmission = np.interp(o_reso_fine.energy_eV, o_reso.energy_eV, o_reso.total_signal['transmission'])
+        self.assertLess(np.max(np.abs(transmission - o_reso_fine.total_signal['transmission'])), 0.002)
+
+    def test_adaptive_energy_scale_without_layer(self):
+        """assert an empty stack with the adaptive energy scale has an energy axis"""
+        o_reso = Resonance(energy_min=1, energy_max=300, energy_step=0.001, energy_scale='adaptive',
+                           database=self.database)
+        np.testing.assert_array_equal(o_reso.energy_eV, [1, 300])
+        np.testing.assert_array_equal(o_reso.calculate_transmission_batch(), [[1., 1.]])
+        o_reso.add_layer(formula='Ag', thickness=0.03)
+        self.assertGreater(len(o_reso.energy_eV), 2)
+        with self.assertRaises(ValueError) as context:
+            Resonance(energy_scale='wrong', database=self.database)
+        self.assertIn('adaptive', str(context.exception))
+
     def test_get_sigma_isotopes(self):
         """assert get_sigma works"""
         _stack = {'CoAg': {'elements': ['Co', 'Ag'],
@@ -308,6 +495,33 @@ class TestInitialization(unittest.TestCase):
         thickness2 = 0.01
         self.assertRaises(ValueError, o_reso.add_layer, formula=layer2, thickness=thickness2)
 
+    def test_adding_layer_only_computes_new_layer(self):
+        """assert add_layer keeps the existing layers and gives the same signal as a full initialization"""
+        _stack = {'CoAg': {'elements': ['Co', 'Ag'],
+                           'stoichiometric_ratio': [1, 1],
+                           'thickness': {'value': 0.025,
+                                         'units': 'mm'},
+                           },
+                  'Ag': {'elements': ['Ag'],
+                         'stoichiometric_ratio': [1],
+                         'thickness': {'value': 0.03,
+                                       'units': 'mm'},
+                         },
+                  }
+        o_reso_full = Resonance(stack=_stack, energy_min=10, energy_max=150, energy_step=1,
+                                database=self.database)
+
+        o_reso = Resonance(energy_min=10, energy_max=150, energy_step=1, database=self.database)
+        o_reso.add_layer(formula='CoAg', thickness=0.025)
+        _sigma_coag = o_reso.stack_sigma['CoAg']['Ag']['sigma_b']
+        _signal_coag = o_reso.stack_signal['CoAg']['transmission']
+        o_reso.add_layer(formula='Ag', thickness=0.03)
+
+        self.assertIs(o_reso.stack_sigma['CoAg']['Ag']['sigma_b'], _sigma_coag)
+        self.assertIs(o_reso.stack_signal['CoAg']['transmission'], _signal_coag)
+        self.assertTrue(np.allclose(o_reso.total_signal['transmission'],
+                                    o_reso_full.total_signal['transmission']))
+
     def test_element_metadata_via_stack_initialization(self):
         """assert __element_metadata is correctly populated using stack initialization"""
 
@@ -513,6 +727,22 @@ class TestGetterSetter(unittest.TestCase):
         expected_density = np.array([_d * _r for _d, _r in density_ratio]).sum()
         self.assertAlmostEqual(new_density, expected_density, delta=0.0001)
 
+    def test_set_stoichiometric_ratio_reweights_loaded_sigma(self):
+        """assert new stoichiometric coefficients reuse the raw sigma without reading the database"""
+        _stats_before = _cache.stats()['interpolated']
+        self.o_reso.set_isotopic_ratio(compound='CoAg', element='Co', list_ratio=[0.5, 0.5])
+        _stats_after = _cache.stats()['interpolated']
+        self.assertEqual(_stats_before['hits'] + _stats_before['misses'],
+                         _stats_after['hits'] + _stats_after['misses'])
+
+        _stack_sigma = self.o_reso.stack_sigma['CoAg']['Co']
+        expected_sigma = 0.5 * _stack_sigma['58-Co']['sigma_b_raw'] + 0.5 * _stack_sigma['59-Co']['sigma_b_raw']
+        self.assertTrue(np.allclose(_stack_sigma['sigma_b'], expected_sigma))
+
+        _atoms_per_cm3 = self.o_reso.stack['CoAg']['Co']['atoms_per_cm3']
+        expected_transmission = np.exp(-0.0025 * 1e-24 * _atoms_per_cm3 * expected_sigma)
+        self.assertTrue(np.allclose(self.o_reso.stack_signal['CoAg']['Co']['transmission'], expected_transmission))
+
         # density
 
     def test_retrieve_density_raises_error_if_unknown_compound(self):
@@ -683,6 +913,109 @@ class TestTransmissionAttenuation(unittest.TestCase):
         self.assertAlmostEqual(expected_tran_2, attenuation[2], delta=0.001)
 
 
+class TestLazySignal(unittest.TestCase):
+    database = '_data_for_unittest'
+
+    def setUp(self):
+        _stack = {'CoAg': {'elements': ['Co', 'Ag'],
+                           'stoichiometric_ratio': [1, 2],
+                           'thickness': {'value': 0.025,
+                                         'units': 'mm'},
+                           },
+                  }
+        self.o_reso = Resonance(stack=_stack, energy_min=10, energy_max=150, energy_step=1,
+                                database=self.database)
+
+    def test_signals_computed_on_access(self):
+        """assert only the signals accessed are calculated"""
+        _signal_iso = self.o_reso.stack_signal['CoAg']['Ag']['107-Ag']
+        self.o_reso.total_signal['transmission']
+        self.assertTrue(self.o_reso.total_signal.is_computed('transmission'))
+        self.assertFalse(self.o_reso.total_signal.is_computed('attenuation'))
+        self.assertFalse(self.o_reso.stack_signal['CoAg'].is_computed('transmission'))
+        self.assertFalse(_signal_iso.is_computed('mu_per_cm'))
+
+        _attenuation_iso = _signal_iso['attenuation']
+        self.assertTrue(_signal_iso.is_computed('mu_per_cm'))
+        self.assertIs(_signal_iso['attenuation'], _attenuation_iso)
+
+    def test_total_signal_is_product_of_layers(self):
+        """assert the total transmission is the product of the element transmissions"""
+        _signal = self.o_reso.stack_signal['CoAg']
+        expected_transmission = _signal['Co']['transmission'] * _signal['Ag']['transmission']
+        self.assertTrue(np.allclose(self.o_reso.total_signal['transmission'], expected_transmission))
+        self.assertTrue(np.allclose(_signal['transmission'], expected_transmission))
+
+    def test_held_signals_after_add_layer(self):
+        """assert signals held before a layer is added keep the values of the previous stack"""
+        _total_signal = self.o_reso.total_signal
+        _signal_layer = self.o_reso.stack_signal['CoAg']
+        _expected = Resonance(stack={'CoAg': {'elements': ['Co', 'Ag'],
+                                              'stoichiometric_ratio': [1, 2],
+                                              'thickness': {'value': 0.025,
+                                                            'units': 'mm'},
+                                              },
+                                     }, energy_min=10, energy_max=150, energy_step=1,
+                              database=self.database).total_signal['transmission']
+        self.o_reso.add_layer(formula='Ag', thickness=0.01)
+        self.assertTrue(np.array_equal(_total_signal['transmission'], _expected))
+        self.assertTrue(np.allclose(_signal_layer['transmission'], _expected, rtol=1e-12, atol=0))
+        self.assertTrue(np.allclose(self.o_reso.total_signal['transmission'],
+                                    _expected * self.o_reso.stack_signal['Ag']['transmission']))
+
+
+class TestTransmissionBatch(unittest.TestCase):
+    database = '_data_for_unittest'
+
+    def setUp(self):
+        self._stack = {'CoAg': {'elements': ['Co', 'Ag'],
+                                'stoichiometric_ratio': [1, 2],
+                                'thickness': {'value': 0.025,
+                                              'units': 'mm'},
+                                },
+                       'Ag': {'elements': ['Ag'],
+                              'stoichiometric_ratio': [1],
+                              'thickness': {'value': 0.03,
+                                            'units': 'mm'},
+                              },
+                       }
+        self.o_reso = Resonance(stack=self._stack, energy_min=10, energy_max=150, energy_step=1,
+                                database=self.database)
+
+    def test_batch_without_sweep_matches_total_signal(self):
+        """assert the batch with the current stack values returns the total transmission"""
+        transmission = self.o_reso.calculate_transmission_batch()
+        self.assertEqual(transmission.shape, (1, 141))
+        self.assertTrue(np.allclose(transmission[0], self.o_reso.total_signal['transmission']))
+
+    def test_thickness_sweep(self):
+        """assert each row of a thickness sweep matches the stack built with that thickness"""
+        thickness = [0.01, 0.05, 0.1]
+        transmission = self.o_reso.calculate_transmission_batch(thickness={'Ag': thickness})
+        self.assertEqual(transmission.shape, (3, 141))
+        for _index, _thickness in enumerate(thickness):
+            self._stack['Ag']['thickness']['value'] = _thickness
+            o_reso = Resonance(stack=self._stack, energy_min=10, energy_max=150, energy_step=1,
+                               database=self.database)
+            self.assertTrue(np.allclose(transmission[_index], o_reso.total_signal['transmission']))
+
+    def test_density_sweep(self):
+        """assert a density sweep matches the stack built with that density"""
+        transmission = self.o_reso.calculate_transmission_batch(thickness={'Ag': [0.01, 0.02]},
+                                                                density={'CoAg': 5.})
+        self._stack['Ag']['thickness']['value'] = 0.02
+        self._stack['CoAg']['density'] = {'value': 5., 'units': 'g/cm3'}
+        o_reso = Resonance(stack=self._stack, energy_min=10, energy_max=150, energy_step=1,
+                           database=self.database)
+        self.assertTrue(np.allclose(transmission[1], o_reso.total_signal['transmission']))
+
+    def test_batch_raises_value_error(self):
+        """assert ValueError raised if unknown layer or mismatched number of samples"""
+        self.assertRaises(ValueError, self.o_reso.calculate_transmission_batch, thickness={'unknown': [1]})
+        self.assertRaises(ValueError, self.o_reso.calculate_transmission_batch,
+                          thickness={'Ag': [0.01, 0.02]}, density={'CoAg': [1., 2., 3.]})
+
+
 class TestPlot(unittest.TestCase):
     database = '_data_for_unittest'
 
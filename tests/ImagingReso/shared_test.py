@@ -0,0 +1,89 @@
+import multiprocessing
+import unittest
+
+import numpy as np
+
+from ImagingReso import _cache
+from ImagingReso import _utilities
+from ImagingReso import shared
+from ImagingReso.batch import get_samples_weights
+from ImagingReso.resonance import Resonance
+from ImagingReso.shared import SharedSigmaStore, attach
+
+_database = '_data_for_unittest'
+_stack = {'Ag': {'elements': ['Ag'],
+                 'stoichiometric_ratio': [1],
+                 'thickness': {'value': 0.03,
+                               'units': 'mm'},
+                 },
+          }
+
+
+def _get_sigma_raw_rows(o_reso):
+    return [o_reso.stack_sigma['Ag']['Ag'][_iso]['sigma_b_raw']
+            for _iso in o_reso.stack['Ag']['Ag']['isotopes']['list']]
+
+
+def _transmission_in_worker():
+    _cache.raw_sigma_cache.set_max_bytes(0)
+    _cache.interpolated_sigma_cache.set_max_bytes(0)
+    o_reso = Resonance(stack={_key: {**_value} for _key, _value in _stack.items()}, energy_min=1, energy_max=100,
+                       energy_step=0.1, database=_database)
+    _stats = _cache.stats()
+    _block = np.frombuffer(list(shared._attached_blocks.values())[0].buf, dtype=np.uint8)
+    _in_block = all(np.shares_memory(_row, _block) for _row in _get_sigma_raw_rows(o_reso=o_reso))
+    return o_reso.total_signal['transmission'], _stats['raw']['misses'], _stats['interpolated']['misses'], _in_block
+
+
+class TestSharedSigmaStore(unittest.TestCase):
+
+    def setUp(self):
+        _cache.clear()
+        _, self.file_names = get_samples_weights(stacks=[_stack], database=_database)
+        self.o_reso = Resonance(stack={_key: {**_value} for _key, _value in _stack.items()}, energy_min=1,
+                                energy_max=100, energy_step=0.1, database=_database)
+
+    def tearDown(self):
+        _cache.set_max_bytes(raw=_cache.default_max_bytes, interpolated=_cache.default_max_bytes)
+        _cache.clear()
+
+    def test_publish_and_attach(self):
+        """assert the published arrays are served from shared memory with the values of the caches"""
+        with SharedSigmaStore() as store:
+            registry = store.publish(database_file_names=self.file_names, energy_grid=self.o_reso.energy_eV)
+            self.assertEqual(len(registry['blocks']), 1)
+            self.assertEqual(len(registry['entries']), 2 * len(self.file_names))
+            self.assertEqual(attach(registry=registry), 2 * len(self.file_names))
+            _cache.raw_sigma_cache.set_max_bytes(0)
+            _cache.interpolated_sigma_cache.set_max_bytes(0)
+            o_reso = Resonance(stack={_key: {**_value} for _key, _value in _stack.items()}, energy_min=1,
+                               energy_max=100, energy_step=0.1, database=_database)
+            np.testing.assert_array_equal(o_reso.total_signal['transmission'],
+                                          self.o_reso.total_signal['transmission'])
+            _block = np.frombuffer(shared._attached_blocks[registry['blocks'][0]].buf, dtype=np.uint8)
+            _sigma_raw = _utilities.get_database_arrays(file_name=self.file_names[0])['Sig_b']
+            _sigma = _utilities.get_sigma(database_file_name=self.file_names[0],
+                                          energy_grid=self.o_reso.energy_eV)['sigma_b']
+            self.assertTrue(np.shares_memory(_sigma_raw, _block))
+            self.assertTrue(np.shares_memory(_sigma, _block))
+            self.assertFalse(_sigma.flags.writeable)
+            # the sigma matrix of the Resonance object is a view of the block
+            for _row in _get_sigma_raw_rows(o_reso=o_reso):
+                self.assertTrue(np.shares_memory(_row, _block))
+                self.assertFalse(_row.flags.writeable)
+            del _block, _sigma_raw, _sigma, _row
+        self.assertIsNone(_cache.interpolated_sigma_cache.get(registry['entries'][-1]['key']))
+
+    def test_workers_attach_without_loading(self):
+        """assert workers of a process pool read the published arrays instead of loading the files"""
+        _context = multiprocessing.get_context('spawn')
+        with SharedSigmaStore() as store:
+            registry = store.publish(database_file_names=self.file_names, energy_grid=self.o_reso.energy_eV)
+            with _context.Pool(processes=2, initializer=attach, initargs=(registry,)) as pool:
+                _results = [pool.apply_async(_transmission_in_worker) for _ in range(2)]
+                for _result in _results:
+                    _transmission, _raw_misses, _interpolated_misses, _in_block = _result.get(timeout=120)
+                    np.testing.assert_array_equal(_transmission, self.o_reso.total_signal['transmission'])
+                    self.assertEqual(_raw_misses, 0)
+                    self.assertEqual(_interpolated_misses, 0)
+                    self.assertTrue(_in_block)
@@ -1,9 +1,15 @@
 import unittest
 
+import pandas as pd
+
 from ImagingReso.resonance import Resonance
 from ImagingReso._utilities import *
 
 
+def _trapezoid(y, x):
+    return np.sum(np.diff(x) * (y[1:] + y[:-1]) / 2.)
+
+
 class TestUtilities_1(unittest.TestCase):
     database = '_data_for_unittest'
 
@@ -242,6 +248,52 @@ class TestUtilities_1(unittest.TestCase):
 
         self.assertEqual(_dict_returned, _dict_expected)
 
+    def test_get_isotope_metadata(self):
+        """assert the metadata table holds the periodictable values of every isotope and is loaded once"""
+        table = get_isotope_metadata(database=self.database)
+        _isotopes = table['elements']['Ag']['isotopes']
+        self.assertEqual(_isotopes['list'], ['107-Ag', '109-Ag', '110-Ag', '111-Ag'])
+        self.assertEqual(_isotopes['meta'], [0, 0, 1, 0])
+        self.assertEqual(_isotopes['mass'][0], get_mass('107-Ag'))
+        self.assertEqual(_isotopes['isotopic_ratio'][1], get_abundance('109-Ag'))
+        self.assertEqual(table['elements']['Ag']['density'], get_density('Ag'))
+        self.assertIs(table, get_isotope_metadata(database=self.database))
+
+    def test_get_isotope_metadata_notices(self):
+        """assert the periodictable fallback notices are only printed for the elements requested"""
+        import contextlib
+        import io
+        import shutil
+        import tempfile
+        from ImagingReso import _database
+
+        _reference_data_folder = _database.reference_data_folder
+        _database.reference_data_folder = tempfile.mkdtemp()
+        try:
+            _database_folder = os.path.join(_database.reference_data_folder, '_data_for_test')
+            os.mkdir(_database_folder)
+            _file_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../ImagingReso/reference_data'))
+            for _name in glob.glob(os.path.join(_file_path, '_data_for_unittest', 'Ag-*.csv')) + \
+                    glob.glob(os.path.join(_file_path, 'ENDF_VII', 'Ra-*.csv')):
+                shutil.copy(_name, _database_folder)
+            _output = io.StringIO()
+            with contextlib.redirect_stdout(_output):
+                table = get_isotope_metadata(database='_data_for_test')
+            self.assertEqual(_output.getvalue(), '')
+            self.assertEqual(table['elements']['Ag']['notices'], [])
+            self.assertTrue(table['elements']['Ra']['notices'])
+
+            _output = io.StringIO()
+            with contextlib.redirect_stdout(_output):
+                get_isotope_dicts(element='Ag', database='_data_for_test')
+            self.assertEqual(_output.getvalue(), '')
+            with contextlib.redirect_stdout(_output):
+                get_isotope_dicts(element='Ra', database='_data_for_test')
+            self.assertIn("Density of 'Ra' is not available in periodictable", _output.getvalue())
+        finally:
+            shutil.rmtree(_database.reference_data_folder)
+            _database.reference_data_folder = _reference_data_folder
+
     def test_check_iso_ratios(self):
         self.assertRaises(ValueError, check_iso_ratios, ratios=[0, 0, 1.06], tol=0.005)
         self.assertRaises(AssertionError, check_iso_ratios, ratios=[-1, 0, 0], tol=0.005)
@@ -361,6 +413,81 @@ class TestUtilities_2(unittest.TestCase):
         energy_1_expected = 310
         self.assertEqual(energy_1_returned, energy_1_expected)
 
+    def test_interpolate_with_index(self):
+        """assert the shared interpolation kernel matches np.interp for one or many data sets"""
+        x = np.array([1., 2., 4., 8.])
+        y = np.array([[1., 3., 2., 0.], [5., 4., 3., 2.]])
+        x_new = np.array([1., 1.5, 4., 7., 8.])
+        _index = get_interpolation_index(x=x, x_new=x_new)
+        y_new = interpolate_with_index(y=y, index=_index)
+        self.assertEqual(y_new.shape, (2, 5))
+        np.testing.assert_allclose(y_new[0], np.interp(x_new, x, y[0]))
+        np.testing.assert_allclose(interpolate_with_index(y=y[1], index=_index), np.interp(x_new, x, y[1]))
+        self.assertIs(_index, get_interpolation_index(x=x, x_new=x_new))
+        self.assertRaises(ValueError, get_interpolation_index, x=x, x_new=np.array([0.5, 2.]))
+        # step in the data
+        x_step = np.array([1., 2., 2., 3.])
+        y_step = np.array([0., 1., 5., 5.])
+        x_new = np.array([1.5, 2., 3.])
+        np.testing.assert_allclose(interpolate_with_index(y=y_step, index=get_interpolation_index(x=x_step,
+                                                                                                 x_new=x_new)),
+                                   np.interp(x_new, x_step, y_step))
+
+    def test_get_sigmas(self):
+        """assert get_sigmas returns the same sigma as get_sigma for every file, in order"""
+        energy_grid = np.linspace(300, 600, 31)
+        file_names = [os.path.join(self.database_path, _name) for _name in ['Ag-107.csv', 'Ag-109.csv',
+                                                                              'Ag-107.csv']]
+        _list_returned = get_sigmas(database_file_names=file_names, energy_grid=energy_grid)
+        self.assertEqual(len(_list_returned), 3)
+        for _file_name, _dict_returned in zip(file_names, _list_returned):
+            _dict_expected = get_sigma(database_file_name=_file_name, e_min=300, e_max=600, e_step=10)
+            np.testing.assert_allclose(_dict_returned['energy_eV'], _dict_expected['energy_eV'])
+            np.testing.assert_allclose(_dict_returned['sigma_b'], _dict_expected['sigma_b'])
+        self.assertTrue(energy_grid.flags.writeable)
+
+    def test_get_doppler_broadened_sigma(self):
+        """assert broadening keeps a 1/v cross-section, conserves the area of a resonance and lowers its peak"""
+        energy = np.linspace(0.5, 200, 20000)
+        energy_out = np.linspace(1, 100, 500)
+        _one_over_v = get_doppler_broadened_sigma(energy=energy, sigma=3. / np.sqrt(energy), energy_out=energy_out,
+                                                  mass_ratio=100., t_kelvin=1000.)
+        np.testing.assert_allclose(_one_over_v, 3. / np.sqrt(energy_out), rtol=1e-4)
+        sigma = 1. + 1e4 / (1. + ((energy - 50.) / 0.05) ** 2)
+        _broadened = get_doppler_broadened_sigma(energy=energy, sigma=sigma, energy_out=energy[100:-100],
+                                                 mass_ratio=100., t_kelvin=1000.)
+        self.assertLess(_broadened.max(), sigma.max() / 2)
+        self.assertAlmostEqual(_trapezoid(_broadened, energy[100:-100]), _trapezoid(sigma, energy),
+                               delta=0.01 * _trapezoid(sigma, energy))
+        self.assertRaises(ValueError, get_doppler_broadened_sigma, energy=energy, sigma=sigma,
+                          energy_out=energy_out, mass_ratio=100., t_kelvin=200.)
+        self.assertTrue(np.all(_broadened >= 0))
+        self.assertRaises(ValueError, get_doppler_broadened_sigma, energy=energy, sigma=sigma,
+                          energy_out=np.linspace(100, 300, 10), mass_ratio=100., t_kelvin=600.)
+
+    def test_get_sigma_with_temperature(self):
+        """assert the broadened sigma is cached per temperature and get_sigmas gives the same values"""
+        file_name = os.path.join(self.database_path, 'Ag-107.csv')
+        energy_grid = np.linspace(10, 100, 901)
+        _dict_294 = get_sigma(database_file_name=file_name, energy_grid=energy_grid)
+        self.assertIs(get_sigma(database_file_name=file_name, energy_grid=energy_grid, t_kelvin=294.)['sigma_b'],
+                      _dict_294['sigma_b'])
+        _dict_600 = get_sigma(database_file_name=file_name, energy_grid=energy_grid, t_kelvin=600.)
+        self.assertIs(get_sigma(database_file_name=file_name, energy_grid=energy_grid, t_kelvin=600.)['sigma_b'],
+                      _dict_600['sigma_b'])
+        self.assertLess(_dict_600['sigma_b'].max(), _dict_294['sigma_b'].max())
+        _dict_returned = get_sigmas(database_file_names=[file_name], energy_grid=energy_grid, t_kelvin=600.)[0]
+        self.assertIs(_dict_returned['sigma_b'], _dict_600['sigma_b'])
+        self.assertTrue(energy_grid.flags.writeable)
+        self.assertAlmostEqual(get_mass_ratio_of_file(file_name=file_name), 106.905 / 1.00866, delta=0.01)
+        self.assertEqual(get_temperature_kelvin(temperature='600K'), 600.)
+        self.assertRaises(ValueError, get_temperature_kelvin, temperature='20C')
+        self.assertRaises(ValueError, get_temperature_kelvin, temperature=77)
+        self.assertRaises(Exception, get_sigma, database_file_name=file_name, energy_grid=np.linspace(1.5e7, 3e7, 11),
+                          t_kelvin=600.)
+        self.assertRaises(Exception, get_sigmas, database_file_names=[file_name],
+                          energy_grid=np.linspace(1.5e7, 3e7, 11), t_kelvin=600.)
+
     def test_get_atoms_per_cm3_of_layer(self):
         """assert get_atoms_per_cm3_of_layer works"""
         _stack = {'CoAg': {'elements': ['Co', 'Ag'],
@@ -397,6 +524,27 @@ class TestUtilities_2(unittest.TestCase):
         self.assertAlmostEqual(transmission_expected[2], transmission_returned[2], delta=1e-16)
         self.assertAlmostEqual(transmission_expected[3], transmission_returned[3], delta=1e-16)
 
+    def test_thin_energy_grid(self):
+        """assert thin_energy_grid keeps the points needed to describe the signal within tolerance"""
+        energy = np.linspace(0, 10, 1001)
+        signal = np.where(energy < 5, 0, 1.) + 0.001 * energy
+        thinned = thin_energy_grid(energy=energy, signal=signal, tolerance=0.01)
+        self.assertLess(len(thinned), 10)
+        _error = np.abs(np.interp(energy, thinned, np.interp(thinned, energy, signal)) - signal)
+        self.assertLessEqual(_error.max(), 0.01)
+
+    def test_lazy_dict(self):
+        """assert LazyDict calls the function of a key once, on first access"""
+        _calls = []
+        _dict = LazyDict(energy_eV=1)
+        _dict.set_lazy('transmission', lambda: _calls.append(1) or 0.5)
+        self.assertEqual(list(_dict.keys()), ['energy_eV', 'transmission'])
+        self.assertFalse(_dict.is_computed('transmission'))
+        self.assertEqual(_dict['transmission'], 0.5)
+        self.assertEqual(_dict['transmission'], 0.5)
+        self.assertEqual(len(_calls), 1)
+        self.assertTrue(_dict.is_computed('transmission'))
+
     def test_set_distance_units(self):
         """asset set_distance_units works"""
         value = 10